@@ -1,40 +1,120 @@
-from flask import Flask, jsonify, request
+import os
+import threading
+import time
+
+STARTED_AT = time.perf_counter()
+
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
+from sqlalchemy.orm import selectinload
 from datetime import datetime
-import os
+
+from config import Config, configure_engine
 
 # Initialize Flask app
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///racing.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+app.config.from_object(Config)
 
 # Initialize extensions
 CORS(app)
 
 # Import and initialize database
-from models import db, RaceEvent, Session, Lap, TireData, EngineData, SetupData
+from models import (db, RaceEvent, Session, Lap, SessionLapSummary, TireData, EngineData, SetupData,
+                    TelemetryChannel)
+from calculations import RacingCalculations
+from calc_service import calculation_service, CalculationError, SourceNotFoundError, UnknownCalculationError
+from migrations import run_migrations
+from lap_import import insert_laps, parse_ndjson
+from pagination import list_response
+from http_cache import conditional
+from rcme import RCME_VERSION, RcmeError, export_event, import_event
+from live import LIVE_BULK_MAX_ROWS, RETRY_WHEN_FULL_SECONDS, broker
+import serializers
 db.init_app(app)
 
-# Create tables
 with app.app_context():
-    db.create_all()
+    configure_engine(db.engine)
+
+# Startup timings in milliseconds, reported by /api/health
+startup = {'import_ms': round((time.perf_counter() - STARTED_AT) * 1000, 1),
+           'database_ms': None, 'ready_ms': None}
+_database_lock = threading.Lock()
+_database_ready = False
+
+def init_database():
+    """
+    Create missing tables and apply schema migrations, once per process
+
+    Runs on the first request that needs the database rather than at import,
+    so the server starts listening (and /api/health answers) without waiting
+    for the schema check.
+    """
+    global _database_ready
+    if _database_ready:
+        return
+    with _database_lock:
+        if _database_ready:
+            return
+        began = time.perf_counter()
+        with app.app_context():
+            db.create_all()
+            run_migrations(db)
+        startup['database_ms'] = round((time.perf_counter() - began) * 1000, 1)
+        startup['ready_ms'] = round((time.perf_counter() - STARTED_AT) * 1000, 1)
+        _database_ready = True
+
+@app.before_request
+def ensure_database():
+    """Set up the database before the first request that uses it"""
+    if request.endpoint != 'health_check':
+        init_database()
+
+def event_tree(event_id):
+    """Rows an event response with all its session data is built from"""
+    session_ids = db.select(Session.id).where(Session.event_id == event_id)
+    return [
+        (RaceEvent, [RaceEvent.id == event_id]),
+        (Session, [Session.event_id == event_id]),
+        (Lap, [Lap.session_id.in_(session_ids)]),
+        (TireData, [TireData.session_id.in_(session_ids)]),
+        (EngineData, [EngineData.session_id.in_(session_ids)]),
+        (SetupData, [SetupData.session_id.in_(session_ids)]),
+        (SessionLapSummary, [SessionLapSummary.session_id.in_(session_ids)])
+    ]
+
+def publish_bulk_laps(session_id, inserted, last_id):
+    """Push the laps of a bulk insert, or a reload hint when there are many"""
+    if not inserted:
+        return
+    if inserted > LIVE_BULK_MAX_ROWS:
+        broker.publish(session_id, 'laps.reload', {'session_id': session_id, 'inserted': inserted})
+        return
+    columns = list(Lap.__table__.columns)
+    rows = db.session.execute(
+        db.select(*columns)
+        .where(Lap.session_id == session_id, Lap.id > (last_id or 0))
+        .order_by(Lap.id)
+    )
+    names = [column.key for column in columns]
+    broker.publish(session_id, 'laps.created', {'laps': [dict(zip(names, row)) for row in rows]})
 
 # Routes
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Health check endpoint; answers before the database is set up"""
     return jsonify({
         'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat()
+        'timestamp': datetime.utcnow().isoformat(),
+        'database': 'ready' if _database_ready else 'starting',
+        'startup': startup
     })
 
 @app.route('/api/events', methods=['GET', 'POST'])
+@conditional(lambda: [(RaceEvent, [])])
 def handle_events():
     """Get all events or create a new event"""
     if request.method == 'GET':
-        events = RaceEvent.query.all()
-        return jsonify([event.to_dict() for event in events])
+        return list_response(RaceEvent, [], [RaceEvent.id])
     
     elif request.method == 'POST':
         data = request.json
@@ -51,6 +131,7 @@ def handle_events():
         return jsonify(event.to_dict()), 201
 
 @app.route('/api/events/<int:event_id>', methods=['GET', 'PUT', 'DELETE'])
+@conditional(lambda event_id: [(RaceEvent, [RaceEvent.id == event_id])])
 def handle_event(event_id):
     """Get, update or delete a specific event"""
     event = RaceEvent.query.get_or_404(event_id)
@@ -76,14 +157,78 @@ def handle_event(event_id):
         db.session.commit()
         return '', 204
 
+@app.route('/api/events/<int:event_id>/full', methods=['GET'])
+@conditional(lambda event_id: event_tree(event_id))
+def event_full(event_id):
+    """Get an event with all its sessions and their laps, tires, engine and setup data"""
+    # One SELECT per relationship level, however many sessions the event has
+    event = db.session.get(RaceEvent, event_id, options=[
+        selectinload(RaceEvent.sessions).options(
+            selectinload(Session.laps),
+            selectinload(Session.tire_data),
+            selectinload(Session.engine_data),
+            selectinload(Session.setup_data),
+            selectinload(Session.lap_summary)
+        )
+    ])
+    if event is None:
+        return jsonify({'error': 'Event not found'}), 404
+    
+    result = event.to_dict()
+    result['sessions'] = [
+        dict(
+            session.to_dict(),
+            laps=[lap.to_dict() for lap in sorted(session.laps, key=lambda lap: (lap.lap_number, lap.id))],
+            tire_data=[data.to_dict() for data in session.tire_data],
+            engine_data=[data.to_dict() for data in session.engine_data],
+            setup_data=[data.to_dict() for data in session.setup_data],
+            lap_summary=session.lap_summary.to_dict() if session.lap_summary else None
+        )
+        for session in sorted(event.sessions, key=lambda session: session.id)
+    ]
+    return jsonify(result)
+
+@app.route('/api/events/<int:event_id>/export', methods=['GET', 'POST'])
+def export_event_file(event_id):
+    """Stream an event with all its sessions and laps as an .rcme file"""
+    event = RaceEvent.query.get_or_404(event_id)
+    # POST embeds the run plans and tire pressures kept by the frontend
+    data = request.get_json(silent=True) if request.method == 'POST' else None
+    data = data if isinstance(data, dict) else {}
+    
+    # ?version=3 selects the binary columnar container
+    version = request.args.get('version', RCME_VERSION)
+    if version not in ('2', '2.0', '3', '3.0'):
+        return jsonify({'error': 'version must be 2 or 3'}), 400
+    
+    name = ''.join(c if c.isascii() and c.isalnum() else '_' for c in event.name)
+    filename = f"event_{name}_{datetime.utcnow().strftime('%Y-%m-%d')}.rcme"
+    body = export_event(event_id, data.get('runPlans') or [], data.get('tirePressureDatabase') or [], version)
+    return Response(
+        stream_with_context(body),
+        mimetype='application/octet-stream' if version.startswith('3') else 'application/json',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.route('/api/events/import', methods=['POST'])
+def import_event_file():
+    """Create an event, its sessions and laps from an .rcme file (v2 or v3) in one transaction"""
+    try:
+        result = import_event(request.stream, request.args.get('name'))
+    except RcmeError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    return jsonify(result), 201
+
 @app.route('/api/events/<int:event_id>/sessions', methods=['GET', 'POST'])
+@conditional(lambda event_id: [(Session, [Session.event_id == event_id])])
 def handle_sessions(event_id):
     """Get all sessions for an event or create a new session"""
     event = RaceEvent.query.get_or_404(event_id)
     
     if request.method == 'GET':
-        sessions = Session.query.filter_by(event_id=event_id).all()
-        return jsonify([session.to_dict() for session in sessions])
+        return list_response(Session, [Session.event_id == event_id], [Session.id])
     
     elif request.method == 'POST':
         data = request.json
@@ -103,6 +248,7 @@ def handle_sessions(event_id):
         return jsonify(session.to_dict()), 201
 
 @app.route('/api/sessions/<int:session_id>', methods=['GET', 'PUT', 'DELETE'])
+@conditional(lambda session_id: [(Session, [Session.id == session_id])])
 def handle_session(session_id):
     """Get, update or delete a specific session"""
     session = Session.query.get_or_404(session_id)
@@ -121,21 +267,24 @@ def handle_session(session_id):
         session.session_status = data.get('session_status', session.session_status)
         session.notes = data.get('notes', session.notes)
         db.session.commit()
-        return jsonify(session.to_dict())
+        result = session.to_dict()
+        broker.publish(session_id, 'session.updated', result)
+        return jsonify(result)
     
     elif request.method == 'DELETE':
         db.session.delete(session)
         db.session.commit()
+        broker.close(session_id)
         return '', 204
 
 @app.route('/api/sessions/<int:session_id>/laps', methods=['GET', 'POST'])
+@conditional(lambda session_id: [(Lap, [Lap.session_id == session_id])])
 def handle_laps(session_id):
     """Get all laps for a session or create a new lap"""
     session = Session.query.get_or_404(session_id)
     
     if request.method == 'GET':
-        laps = Lap.query.filter_by(session_id=session_id).order_by(Lap.lap_number).all()
-        return jsonify([lap.to_dict() for lap in laps])
+        return list_response(Lap, [Lap.session_id == session_id], [Lap.lap_number, Lap.id])
     
     elif request.method == 'POST':
         data = request.json
@@ -152,11 +301,17 @@ def handle_laps(session_id):
             lap_status=data.get('lap_status'),
             notes=data.get('notes')
         )
+        summary = SessionLapSummary.for_session(session_id)
         db.session.add(lap)
+        db.session.flush()
+        summary.add_lap(SessionLapSummary.lap_values(lap))
         db.session.commit()
-        return jsonify(lap.to_dict()), 201
+        result = lap.to_dict()
+        broker.publish(session_id, 'lap.created', result)
+        return jsonify(result), 201
 
 @app.route('/api/laps/<int:lap_id>', methods=['GET', 'PUT', 'DELETE'])
+@conditional(lambda lap_id: [(Lap, [Lap.id == lap_id])])
 def handle_lap(lap_id):
     """Get, update or delete a specific lap"""
     lap = Lap.query.get_or_404(lap_id)
@@ -166,6 +321,8 @@ def handle_lap(lap_id):
     
     elif request.method == 'PUT':
         data = request.json
+        summary = SessionLapSummary.for_session(lap.session_id)
+        old_values = SessionLapSummary.lap_values(lap)
         lap.lap_number = data.get('lap_number', lap.lap_number)
         lap.lap_time = data.get('lap_time', lap.lap_time)
         lap.sector1 = data.get('sector1', lap.sector1)
@@ -176,22 +333,215 @@ def handle_lap(lap_id):
         lap.tire_set = data.get('tire_set', lap.tire_set)
         lap.lap_status = data.get('lap_status', lap.lap_status)
         lap.notes = data.get('notes', lap.notes)
+        summary.update_lap(old_values, SessionLapSummary.lap_values(lap))
         db.session.commit()
-        return jsonify(lap.to_dict())
+        result = lap.to_dict()
+        broker.publish(lap.session_id, 'lap.updated', result)
+        return jsonify(result)
     
     elif request.method == 'DELETE':
+        session_id = lap.session_id
+        summary = SessionLapSummary.for_session(session_id)
+        values = SessionLapSummary.lap_values(lap)
         db.session.delete(lap)
+        summary.remove_lap(values)
         db.session.commit()
+        broker.publish(session_id, 'lap.deleted', {'id': lap_id, 'session_id': session_id})
         return '', 204
 
+@app.route('/api/sessions/<int:session_id>/summary', methods=['GET'])
+@conditional(lambda session_id: [(SessionLapSummary, [SessionLapSummary.session_id == session_id]),
+                                 (Lap, [Lap.session_id == session_id])])
+def session_summary(session_id):
+    """Best lap, theoretical best, average pace, lap count and fuel of a session"""
+    Session.query.get_or_404(session_id)
+    # Reads never write: the stored row is created by the lap write paths
+    summary = db.session.get(SessionLapSummary, session_id) or SessionLapSummary.computed(session_id)
+    return jsonify(summary.to_dict())
+
+@app.route('/api/sessions/<int:session_id>/laps/bulk', methods=['POST'])
+def bulk_create_laps(session_id):
+    """Insert many laps in one transaction from a JSON array or an NDJSON stream"""
+    Session.query.get_or_404(session_id)
+    
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        records = parse_ndjson(request.stream)
+    else:
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            return jsonify({'error': 'Expected a JSON array of laps or an NDJSON body'}), 400
+    
+    last_id = db.session.scalar(db.select(db.func.max(Lap.id)).where(Lap.session_id == session_id))
+    inserted, rejected, errors = insert_laps(session_id, records)
+    db.session.commit()
+    publish_bulk_laps(session_id, inserted, last_id)
+    return jsonify({
+        'inserted': inserted,
+        'rejected': rejected,
+        'errors': errors
+    }), 201 if inserted else 400
+
+@app.route('/api/sessions/<int:session_id>/live', methods=['GET'])
+def session_live(session_id):
+    """Server-Sent Events stream of lap, tire and session changes"""
+    Session.query.get_or_404(session_id)
+    # The stream only reads the broker's buffer, never the database
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    # Every open stream holds a server thread; past the limit, pages retry later
+    if not broker.reserve_stream():
+        return jsonify({'error': 'too many live streams open, try again later'}), 503, \
+            {'Retry-After': str(RETRY_WHEN_FULL_SECONDS)}
+    response = Response(
+        broker.subscribe(session_id, last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(broker.release_stream)
+    return response
+
+@app.route('/api/sessions/<int:session_id>/telemetry', methods=['GET', 'POST'])
+@conditional(lambda session_id: [(TelemetryChannel, [TelemetryChannel.session_id == session_id])])
+def handle_telemetry(session_id):
+    """List the telemetry channels of a session or append samples to them"""
+    session = Session.query.get_or_404(session_id)
+    
+    if request.method == 'GET':
+        channels = TelemetryChannel.query.filter_by(session_id=session_id).order_by(TelemetryChannel.name).all()
+        return jsonify([channel.to_dict() for channel in channels])
+    
+    if session.closed_at is not None:
+        return jsonify({'error': 'session is closed; telemetry can only be appended while it is open'}), 400
+    
+    from telemetry import TelemetryError, append_samples, get_or_create_channel, sample_arrays
+    
+    # {"channels": [{"name", "unit", "dtype", "sample_rate", "t": [ms, ...], "v": [...]}]}
+    data = request.get_json(silent=True)
+    entries = data.get('channels') if isinstance(data, dict) else None
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'error': 'channels must be a non-empty list'}), 400
+    
+    appended = {}
+    try:
+        for entry in entries:
+            if not isinstance(entry, dict):
+                raise TelemetryError('each channel must be an object')
+            channel = get_or_create_channel(session_id, entry.get('name'), entry.get('unit'),
+                                            entry.get('dtype', 'float32'), entry.get('sample_rate'))
+            times, values = sample_arrays(channel, entry.get('t'), entry.get('v'))
+            appended[channel.name] = appended.get(channel.name, 0) + append_samples(channel, times, values)
+    except TelemetryError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    end_ms = dict(db.session.execute(
+        db.select(TelemetryChannel.name, TelemetryChannel.end_ms)
+        .where(TelemetryChannel.session_id == session_id, TelemetryChannel.name.in_(appended))
+    ).all())
+    broker.publish(session_id, 'telemetry.appended', {'appended': appended, 'end_ms': end_ms})
+    return jsonify({'appended': appended, 'end_ms': end_ms}), 201
+
+@app.route('/api/sessions/<int:session_id>/telemetry/<name>', methods=['GET'])
+@conditional(lambda session_id, name: [(TelemetryChannel, [TelemetryChannel.session_id == session_id,
+                                                           TelemetryChannel.name == name])])
+def telemetry_range(session_id, name):
+    """
+    Samples of a channel between start_ms and end_ms, decoding only the chunks in range
+
+    With points=N the series is downsampled to at most N points
+    (method=minmax, the default, or method=lttb).
+    """
+    from telemetry import TelemetryError, json_values, read_downsampled, read_range
+    
+    channel = TelemetryChannel.query.filter_by(session_id=session_id, name=name).first_or_404()
+    try:
+        start_ms, end_ms, points = [int(request.args[key]) if request.args.get(key) else None
+                                    for key in ('start_ms', 'end_ms', 'points')]
+    except ValueError:
+        return jsonify({'error': 'start_ms, end_ms and points must be integers'}), 400
+    
+    try:
+        if points is None:
+            times, values = read_range(channel, start_ms, end_ms)
+            method = source = 'raw'
+        else:
+            method = request.args.get('method', 'minmax')
+            times, values, source = read_downsampled(channel, start_ms, end_ms, points, method)
+    except TelemetryError as e:
+        return jsonify({'error': str(e)}), 400
+    return Response(serializers.dumps({
+        'channel': channel.to_dict(),
+        'method': method,
+        'source': source,
+        'count': len(times),
+        't': times.tolist(),
+        'v': json_values(values)
+    }), mimetype='application/json')
+
+@app.route('/api/sessions/<int:session_id>/close', methods=['POST'])
+def close_session(session_id):
+    """Mark a session as over and build the telemetry pyramids of its channels"""
+    from telemetry import build_pyramid
+    
+    session = Session.query.get_or_404(session_id)
+    session.closed_at = session.closed_at or datetime.utcnow()
+    channels = TelemetryChannel.query.filter_by(session_id=session_id).order_by(TelemetryChannel.name).all()
+    levels = {channel.name: build_pyramid(channel) for channel in channels}
+    db.session.commit()
+    result = session.to_dict()
+    broker.publish(session_id, 'session.updated', result)
+    return jsonify({'session': result, 'levels': levels})
+
+@app.route('/api/sessions/<int:session_id>/laps/stats', methods=['GET'])
+@conditional(lambda session_id: [(Lap, [Lap.session_id == session_id])])
+def lap_stats(session_id):
+    """Best, average and percentile lap times computed in the database"""
+    Session.query.get_or_404(session_id)
+    try:
+        percentiles = [float(p) for p in request.args.get('percentiles', '50,90').split(',') if p]
+    except ValueError:
+        return jsonify({'error': 'percentiles must be numbers'}), 400
+    if any(not 0 <= p <= 100 for p in percentiles):
+        return jsonify({'error': 'percentiles must be between 0 and 100'}), 400
+
+    query = db.session.query(Lap.lap_time_ms).filter(
+        Lap.session_id == session_id, Lap.lap_time_ms.isnot(None)
+    )
+    if request.args.get('green_only', 'false').lower() == 'true':
+        query = query.filter(Lap.lap_status.is_(None))
+
+    count, best, average = query.with_entities(
+        db.func.count(Lap.lap_time_ms), db.func.min(Lap.lap_time_ms), db.func.avg(Lap.lap_time_ms)
+    ).one()
+
+    # Nearest-rank percentiles, each a single indexed lookup
+    values = {}
+    for p in percentiles:
+        if count:
+            rank = max(int(-(-p * count // 100)), 1)
+            values[f'{p:g}'] = query.order_by(Lap.lap_time_ms).offset(rank - 1).limit(1).scalar()
+
+    def formatted(ms):
+        return RacingCalculations.format_time(ms / 1000) if ms is not None else None
+
+    return jsonify({
+        'session_id': session_id,
+        'lap_count': count,
+        'best_lap_ms': best,
+        'best_lap': formatted(best),
+        'average_lap_ms': round(average, 1) if average is not None else None,
+        'average_lap': formatted(average),
+        'percentiles_ms': values,
+        'percentiles': {p: formatted(ms) for p, ms in values.items()}
+    })
+
 @app.route('/api/sessions/<int:session_id>/tires', methods=['GET', 'POST'])
+@conditional(lambda session_id: [(TireData, [TireData.session_id == session_id])])
 def handle_tire_data(session_id):
     """Get tire data for a session or add new tire data"""
     session = Session.query.get_or_404(session_id)
     
     if request.method == 'GET':
-        tire_data = TireData.query.filter_by(session_id=session_id).all()
-        return jsonify([data.to_dict() for data in tire_data])
+        return list_response(TireData, [TireData.session_id == session_id], [TireData.id])
     
     elif request.method == 'POST':
         data = request.json
@@ -207,7 +557,147 @@ def handle_tire_data(session_id):
         )
         db.session.add(tire_data)
         db.session.commit()
-        return jsonify(tire_data.to_dict()), 201
+        result = tire_data.to_dict()
+        broker.publish(session_id, 'tire.created', result)
+        return jsonify(result), 201
+
+@app.route('/api/calc/<name>', methods=['POST'])
+def calculate(name):
+    """Run a memoized calculation (stint-strategy, race-time, tire-pressure, ...)"""
+    params = request.get_json(silent=True) or {}
+    if not isinstance(params, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    try:
+        result = calculation_service.calculate(name, params)
+    except UnknownCalculationError:
+        return jsonify({'error': f'Unknown calculation: {name}'}), 404
+    except SourceNotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except CalculationError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+@app.route('/api/calc/cache', methods=['GET', 'DELETE'])
+def calculation_cache():
+    """Get calculation cache statistics or clear the cache"""
+    if request.method == 'GET':
+        return jsonify(calculation_service.stats())
+    
+    elif request.method == 'DELETE':
+        calculation_service.clear()
+        return '', 204
+
+@app.route('/api/calc/stint-strategy/batch', methods=['POST'])
+def stint_strategy_batch():
+    """Evaluate the stint strategy for many parameter combinations at once"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    try:
+        result = RacingCalculations.calculate_stint_strategy_batch(
+            data['session_duration'],
+            data['lap_time'],
+            data['fuel_tank_capacity'],
+            data['fuel_per_lap'],
+            data.get('minimum_fuel', 5),
+            grid=data.get('grid', False)
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid batch parameters: {e}'}), 400
+    
+    return jsonify({
+        'count': int(result['total_laps'].size),
+        'columns': {name: column.tolist() for name, column in result.items()}
+    })
+
+@app.route('/api/tires/analysis', methods=['GET'])
+def tire_analysis():
+    """Analyze every tire reading of an event or a set of sessions in one pass"""
+    event_id = request.args.get('event_id', type=int)
+    try:
+        session_ids = [int(value) for value in request.args.get('session_ids', '').split(',') if value.strip()]
+    except ValueError:
+        return jsonify({'error': 'session_ids must be integers'}), 400
+    target_temp = request.args.get('target_temp', 85, type=float)
+    if event_id is None and not session_ids:
+        return jsonify({'error': 'event_id or session_ids is required'}), 400
+    
+    query = db.session.query(
+        TireData.id, TireData.session_id, TireData.tire_position, TireData.tire_set,
+        TireData.temp_inner, TireData.temp_middle, TireData.temp_outer,
+        db.func.coalesce(TireData.pressure_hot, TireData.pressure_cold)
+    ).filter(
+        TireData.temp_inner.isnot(None),
+        TireData.temp_middle.isnot(None),
+        TireData.temp_outer.isnot(None)
+    )
+    if event_id is not None:
+        query = query.join(Session).filter(Session.event_id == event_id)
+    if session_ids:
+        query = query.filter(TireData.session_id.in_(session_ids))
+    rows = query.order_by(TireData.session_id, TireData.id).all()
+    
+    ids, sessions, positions, tire_sets, inner, middle, outer, pressure = (
+        [list(column) for column in zip(*rows)] if rows else [[] for _ in range(8)]
+    )
+    # Readings without a pressure still get their temperature analysis
+    pressure = [float('nan') if value is None else value for value in pressure]
+    result = RacingCalculations.optimize_tire_pressure_batch(
+        inner, middle, outer, pressure, target_temp
+    )
+    
+    columns = {
+        'id': ids,
+        'session_id': sessions,
+        'tire_position': positions,
+        'tire_set': tire_sets
+    }
+    for name, column in result.items():
+        values = column.tolist()
+        if column.dtype.kind == 'f':
+            values = [None if value != value else value for value in values]
+        columns[name] = values
+    
+    return jsonify({'count': len(rows), 'columns': columns})
+
+@app.route('/api/calc/race-simulation', methods=['POST'])
+def race_simulation():
+    """Monte Carlo simulation of a race with cautions and pit-loss variation"""
+    from simulation import simulate_race, estimate_cautions
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    cautions = data.get('cautions')
+    
+    # Calibrate the caution model on the lap statuses recorded for an event
+    if cautions is None and data.get('calibration_event_id') is not None:
+        rows = db.session.query(Lap.session_id, Lap.lap_status).join(Session).filter(
+            Session.event_id == data['calibration_event_id']
+        ).order_by(Lap.session_id, Lap.lap_number).all()
+        sequences = {}
+        for session_id, lap_status in rows:
+            sequences.setdefault(session_id, []).append(lap_status)
+        cautions = estimate_cautions(sequences.values())
+    
+    try:
+        result = simulate_race(
+            data['laps'],
+            data['base_lap_time'],
+            data['fuel_per_lap'],
+            data['initial_fuel'],
+            fuel_effect=data.get('fuel_effect', 0.035),
+            pit_stop_time=data.get('pit_stop_time', 25),
+            n_races=data.get('n_races', 100000),
+            lap_time_sigma=data.get('lap_time_sigma', 0.4),
+            pit_time_sigma=data.get('pit_time_sigma', 2.0),
+            cautions=cautions,
+            seed=data.get('seed')
+        )
+    except (KeyError, ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid simulation parameters: {e}'}), 400
+    
+    return jsonify(result)
 
 @app.route('/api/archive', methods=['POST'])
 def archive_event():
@@ -222,5 +712,26 @@ def archive_event():
         'event_id': event_id
     }), 200
 
+def _warm_up():
+    """Set up the database while the development server starts listening"""
+    try:
+        init_database()
+    except Exception as e:
+        # Left to the first request, which reports the error
+        print(f"Database setup failed: {e}")
+        return
+    print(f"Backend ready in {startup['ready_ms']:.0f} ms "
+          f"(imports {startup['import_ms']:.0f} ms, database {startup['database_ms']:.0f} ms)")
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    debug = os.environ.get('DEBUG', 'False').lower() in ('1', 'true')
+    # With the debug reloader only the child process serves requests
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN'):
+        threading.Thread(target=_warm_up, name='warm-up', daemon=True).start()
+    # Development server; the team server runs gunicorn (see gunicorn.conf.py)
+    app.run(
+        debug=debug,
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', 5000)),
+        threaded=True
+    )
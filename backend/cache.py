@@ -0,0 +1,119 @@
+"""
+In-process caching helpers
+Size-bounded LRU cache whose entries can be tagged with the database rows
+they were computed from, so that writes to those rows invalidate them
+"""
+
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+
+
+class LRUCache:
+    """Thread-safe LRU cache with hit/miss counters and tag invalidation"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key (and mark it recently used)"""
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tags=()):
+        """Store a value, evicting the least recently used entry when full"""
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            tags = frozenset(tags)
+            self._entries[key] = (value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute, tags=()):
+        """Return the cached value or compute, store and return it"""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.set(key, value, tags)
+        return value
+
+    def invalidate(self, tag):
+        """Drop every entry tagged with tag"""
+        with self._lock:
+            for key in self._tags.pop(tag, ()):
+                if key in self._entries:
+                    self._discard(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, key):
+        _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+def row_tag(instance):
+    """Tag identifying a database row, e.g. ('sessions', 12)"""
+    return (instance.__tablename__, instance.id)
+
+
+def invalidate_on_write(cache, models):
+    """
+    Invalidate cache entries tagged with rows of the given models whenever
+    those rows are updated or deleted through the ORM
+    """
+    models = tuple(models)
+
+    def after_flush(session, flush_context):
+        changed = [instance for instance in session.dirty if session.is_modified(instance)]
+        for instance in changed + list(session.deleted):
+            if isinstance(instance, models) and instance.id is not None:
+                cache.invalidate(row_tag(instance))
+
+    event.listen(OrmSession, 'after_flush', after_flush)
+    return after_flush
@@ -0,0 +1,195 @@
+"""
+Calculation service
+Memoizes RacingCalculations results keyed on normalized inputs. Inputs can
+be read from a Session, TireData or SetupData row; results computed from a
+row are tagged with it and dropped when the row is updated or deleted.
+"""
+
+import os
+
+from cache import LRUCache, invalidate_on_write
+from calculations import RacingCalculations
+from models import db, Session, TireData, SetupData
+
+DEFAULT_CACHE_SIZE = int(os.environ.get('CALC_CACHE_SIZE', 2048))
+# Longest race a calculation accepts
+MAX_RACE_LAPS = int(os.environ.get('CALC_MAX_RACE_LAPS', 10000))
+# The pit strategy search is far costlier per lap
+MAX_PIT_STRATEGY_LAPS = int(os.environ.get('CALC_MAX_PIT_STRATEGY_LAPS', 1000))
+MAX_PIT_STRATEGY_PLANS = 20
+
+
+class Calculation:
+    """A cacheable calculation and where its inputs may come from"""
+
+    def __init__(self, function, args, defaults=None, source=None, source_key=None, columns=None,
+                 limits=None):
+        self.function = function
+        self.args = args
+        self.defaults = defaults or {}
+        self.source = source
+        self.source_key = source_key
+        self.columns = columns or {}
+        # Largest value accepted per input, bounding the cost of one request
+        self.limits = limits or {}
+
+
+def _pit_strategy(*args):
+    """optimize_pit_strategy, imported on first use (it loads numpy)"""
+    from strategy import optimize_pit_strategy
+    return optimize_pit_strategy(*args)
+
+
+CALCULATIONS = {
+    'stint-strategy': Calculation(
+        RacingCalculations.calculate_stint_strategy,
+        ['session_duration', 'lap_time', 'fuel_tank_capacity', 'fuel_per_lap', 'minimum_fuel'],
+        defaults={'minimum_fuel': 5},
+        source=Session, source_key='session_id',
+        columns={'session_duration': 'duration', 'fuel_per_lap': 'fuel_per_lap'}
+    ),
+    'race-time': Calculation(
+        RacingCalculations.calculate_race_time,
+        ['laps', 'base_lap_time', 'fuel_per_lap', 'initial_fuel', 'fuel_effect', 'pit_stop_time'],
+        defaults={'fuel_effect': 0.035, 'pit_stop_time': 25},
+        source=Session, source_key='session_id',
+        columns={'fuel_per_lap': 'fuel_per_lap', 'initial_fuel': 'fuel_start'},
+        limits={'laps': MAX_RACE_LAPS}
+    ),
+    'pit-strategy': Calculation(
+        _pit_strategy,
+        ['laps', 'base_lap_time', 'fuel_per_lap', 'fuel_tank_capacity', 'tire_life_laps',
+         'pit_stop_time', 'tire_change_time', 'refuel_rate', 'fuel_effect', 'tire_degradation',
+         'wear_rate', 'minimum_fuel', 'initial_tire_age', 'top_k'],
+        defaults={'pit_stop_time': 25, 'tire_change_time': 0, 'refuel_rate': None,
+                  'fuel_effect': 0.035, 'tire_degradation': 2.0, 'wear_rate': 1.0,
+                  'minimum_fuel': 5, 'initial_tire_age': 0, 'top_k': 5},
+        source=Session, source_key='session_id',
+        columns={'fuel_per_lap': 'fuel_per_lap'},
+        limits={'laps': MAX_PIT_STRATEGY_LAPS, 'top_k': MAX_PIT_STRATEGY_PLANS}
+    ),
+    'tire-pressure': Calculation(
+        RacingCalculations.optimize_tire_pressure,
+        ['temp_inner', 'temp_middle', 'temp_outer', 'current_pressure', 'target_temp'],
+        defaults={'target_temp': 85},
+        source=TireData, source_key='tire_data_id',
+        columns={'temp_inner': 'temp_inner', 'temp_middle': 'temp_middle',
+                 'temp_outer': 'temp_outer', 'current_pressure': 'pressure_hot'}
+    ),
+    'tire-wear': Calculation(
+        RacingCalculations.calculate_tire_wear,
+        ['laps_on_tire', 'tire_life_laps', 'wear_rate'],
+        defaults={'wear_rate': 1.0}
+    ),
+    'lap-time-with-fuel': Calculation(
+        RacingCalculations.calculate_lap_time_with_fuel,
+        ['base_lap_time', 'fuel_weight', 'fuel_effect'],
+        defaults={'fuel_effect': 0.035}
+    ),
+    'setup-balance': Calculation(
+        RacingCalculations.calculate_setup_balance,
+        ['front_wing', 'rear_wing', 'front_spring', 'rear_spring'],
+        source=SetupData, source_key='setup_id',
+        columns={'front_wing': 'front_wing', 'rear_wing': 'rear_wing',
+                 'front_spring': 'front_spring_rate', 'rear_spring': 'rear_spring_rate'}
+    ),
+}
+
+
+class CalculationError(ValueError):
+    """Raised when a calculation cannot be run with the given inputs"""
+
+
+class UnknownCalculationError(LookupError):
+    """Raised for a calculation name that is not in CALCULATIONS"""
+
+
+class SourceNotFoundError(LookupError):
+    """Raised when the row a calculation reads its inputs from does not exist"""
+
+
+class CalculationService:
+    """Memoizing front end for RacingCalculations"""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.cache = LRUCache(maxsize)
+
+    def calculate(self, name, params):
+        """
+        Run (or fetch from cache) a calculation
+
+        Args:
+            name: Calculation name, a key of CALCULATIONS
+            params: Explicit inputs; may include the calculation's source key
+                (e.g. session_id) to read the remaining inputs from that row
+
+        Returns:
+            The calculation result
+        """
+        calculation = CALCULATIONS.get(name)
+        if calculation is None:
+            raise UnknownCalculationError(name)
+
+        explicit = {arg: _normalize(params[arg]) for arg in calculation.args
+                    if params.get(arg) is not None}
+        source_id = params.get(calculation.source_key) if calculation.source else None
+        if source_id is not None:
+            try:
+                source_id = int(source_id)
+            except (TypeError, ValueError):
+                raise CalculationError(f'Invalid {calculation.source_key}: {source_id!r}')
+        # The row version keeps entries valid when another worker process
+        # changed the row (write invalidation only reaches this process)
+        version = None
+        if source_id is not None:
+            source = calculation.source
+            version = db.session.scalar(db.select(source.updated_at).where(source.id == source_id))
+        key = (name, source_id, version, tuple(sorted(explicit.items())))
+
+        def compute():
+            inputs = dict(calculation.defaults)
+            if source_id is not None:
+                row = db.session.get(calculation.source, source_id)
+                if row is None:
+                    raise SourceNotFoundError(f'{calculation.source.__name__} {source_id} not found')
+                for arg, column in calculation.columns.items():
+                    value = getattr(row, column)
+                    if value is not None:
+                        inputs[arg] = value
+            inputs.update(explicit)
+
+            missing = [arg for arg in calculation.args if arg not in inputs]
+            if missing:
+                raise CalculationError(f"Missing inputs: {', '.join(missing)}")
+            for arg, limit in calculation.limits.items():
+                if inputs[arg] > limit:
+                    raise CalculationError(f'{arg} must be at most {limit}')
+            try:
+                return calculation.function(*[inputs[arg] for arg in calculation.args])
+            except (ArithmeticError, TypeError, ValueError) as e:
+                raise CalculationError(str(e)) from e
+
+        # Results read from a row are dropped when that row changes
+        tags = [(calculation.source.__tablename__, source_id)] if source_id is not None else []
+        return self.cache.get_or_compute(key, compute, tags)
+
+    def stats(self):
+        return self.cache.stats()
+
+    def clear(self):
+        self.cache.clear()
+
+
+def _normalize(value):
+    """Normalize an input so equal values share a cache entry (2 == 2.0)"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise CalculationError(f'Unsupported input value: {value!r}')
+    try:
+        number = float(value)
+    except ValueError:
+        raise CalculationError(f'Not a number: {value!r}')
+    return int(number) if number.is_integer() else number
+
+
+calculation_service = CalculationService()
+invalidate_on_write(calculation_service.cache, (Session, TireData, SetupData))
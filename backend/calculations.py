@@ -3,9 +3,23 @@ Racing calculations module
 Implements the core calculation logic from the Excel formulas
 """
 
+import math
+import re
+
+# numpy is imported inside the batch methods so the backend starts without it
+
+# [[H:]MM:]SS[.mmm]: whole hours and minutes, seconds with optional decimals
+TIME_PATTERN = re.compile(r'(?:(?:(\d+):)?(\d+):)?(\d+(?:\.\d+)?)')
+
 class RacingCalculations:
     """Helper class for racing-related calculations"""
     
+    # Fuel density approximately 0.75 kg/liter
+    FUEL_DENSITY = 0.75
+    
+    # The car pits once less than this many liters are left in the tank
+    REFUEL_THRESHOLD = 5
+    
     @staticmethod
     def calculate_fuel_consumption(laps, fuel_per_lap):
         """
@@ -80,6 +94,68 @@ class RacingCalculations:
             'fuel_per_stint': [laps * fuel_per_lap for laps in stints]
         }
     
+    @staticmethod
+    def calculate_stint_strategy_batch(session_duration, lap_time, fuel_tank_capacity,
+                                       fuel_per_lap, minimum_fuel=5, grid=False):
+        """
+        Vectorized version of calculate_stint_strategy for parameter sweeps
+        
+        Every argument may be a scalar or an array. Arrays are broadcast
+        against each other, or combined as a full cartesian product when
+        grid is True. Stints are described by their regular length plus
+        the length of the last stint, which absorbs the remainder exactly
+        like calculate_stint_strategy does.
+        
+        Args:
+            session_duration: Session duration(s) in minutes
+            lap_time: Average lap time(s) in seconds
+            fuel_tank_capacity: Maximum fuel capacity(ies) in liters
+            fuel_per_lap: Fuel consumption(s) per lap in liters
+            minimum_fuel: Minimum fuel to keep in tank (liters)
+            grid: Evaluate every combination of the given values
+            
+        Returns:
+            Dictionary of equally sized 1-D arrays (one entry per combination)
+        """
+        import numpy as np
+        
+        params = [np.asarray(value, dtype=float) for value in
+                  (session_duration, lap_time, fuel_tank_capacity, fuel_per_lap, minimum_fuel)]
+        if grid:
+            params = np.meshgrid(*[p.ravel() for p in params], indexing='ij')
+        params = [p.ravel() for p in np.broadcast_arrays(*params)]
+        duration, lap, capacity, consumption, reserve = params
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            total_laps = np.trunc(duration * 60 / lap)
+            laps_per_tank = np.trunc((capacity - reserve) / consumption)
+        
+        # The scalar version raises on an empty tank; flag those rows instead
+        valid = np.isfinite(total_laps) & np.isfinite(laps_per_tank) & (laps_per_tank > 0)
+        total_laps = np.where(valid, total_laps, 0).astype(np.int64)
+        laps_per_tank = np.where(valid, laps_per_tank, 1).astype(np.int64)
+        
+        pit_stops = np.maximum(0, total_laps // laps_per_tank)
+        stint_length = total_laps // (pit_stops + 1)
+        last_stint = total_laps - stint_length * pit_stops
+        laps_per_tank = np.where(valid, laps_per_tank, 0)
+        
+        return {
+            'session_duration': duration,
+            'lap_time': lap,
+            'fuel_tank_capacity': capacity,
+            'fuel_per_lap': consumption,
+            'minimum_fuel': reserve,
+            'valid': valid,
+            'total_laps': total_laps,
+            'pit_stops': pit_stops,
+            'laps_per_tank': laps_per_tank,
+            'stint_length': stint_length,
+            'last_stint_length': last_stint,
+            'fuel_per_stint': stint_length * consumption,
+            'fuel_last_stint': last_stint * consumption
+        }
+    
     @staticmethod
     def optimize_tire_pressure(temp_inner, temp_middle, temp_outer, 
                                current_pressure, target_temp=85):
@@ -135,6 +211,59 @@ class RacingCalculations:
             'within_target': abs(temp_diff) < 5
         }
     
+    @staticmethod
+    def optimize_tire_pressure_batch(temp_inner, temp_middle, temp_outer,
+                                     current_pressure, target_temp=85):
+        """
+        Vectorized version of optimize_tire_pressure
+        
+        Args:
+            temp_inner: Inner tire temperatures in °C
+            temp_middle: Middle tire temperatures in °C
+            temp_outer: Outer tire temperatures in °C
+            current_pressure: Current tire pressures in bar
+            target_temp: Target average temperature in °C
+            
+        Returns:
+            Dictionary of equally sized 1-D arrays (one entry per reading)
+        """
+        import numpy as np
+        
+        inner, middle, outer, pressure, target = [
+            array.ravel() for array in np.broadcast_arrays(*[
+                np.asarray(value, dtype=float)
+                for value in (temp_inner, temp_middle, temp_outer, current_pressure, target_temp)
+            ])
+        ]
+        temps = np.stack([inner, middle, outer])
+        
+        avg_temp = temps.mean(axis=0)
+        temp_range = temps.max(axis=0) - temps.min(axis=0)
+        temp_diff = avg_temp - target
+        pressure_adjustment = temp_diff * 0.02  # 0.02 bar per degree
+        
+        distribution = np.select(
+            [temp_range < 5, temp_range < 10, temp_range < 15],
+            ['Excellent', 'Good', 'Fair'],
+            default='Poor'
+        )
+        camber_advice = np.select(
+            [inner > outer + 5, outer > inner + 5],
+            ['Reduce negative camber', 'Increase negative camber'],
+            default='Camber is good'
+        )
+        
+        return {
+            'average_temp': np.round(avg_temp, 1),
+            'temp_range': np.round(temp_range, 1),
+            'current_pressure': pressure,
+            'recommended_pressure': np.round(pressure - pressure_adjustment, 2),
+            'pressure_change': np.round(pressure_adjustment, 2),
+            'distribution_rating': distribution,
+            'camber_advice': camber_advice,
+            'within_target': np.abs(temp_diff) < 5
+        }
+    
     @staticmethod
     def calculate_lap_time_with_fuel(base_lap_time, fuel_weight, fuel_effect=0.035):
         """
@@ -183,30 +312,21 @@ class RacingCalculations:
         Returns:
             Dictionary with race time breakdown
         """
-        # Fuel density approximately 0.75 kg/liter
-        fuel_density = 0.75
+        # Fuel falls linearly within a stint, so every stint is an arithmetic
+        # series of lap times and the race reduces to a few closed-form terms
+        stint_laps = RacingCalculations._laps_per_stint(initial_fuel, fuel_per_lap, laps)
         
-        total_time = 0
-        current_fuel = initial_fuel
-        pit_stops = 0
+        # The car pits after every full stint, except on the last lap
+        pit_stops = (laps - 1) // stint_laps if laps > 0 else 0
+        last_stint_laps = laps - pit_stops * stint_laps
         
-        for lap in range(laps):
-            # Calculate current fuel weight
-            fuel_weight = current_fuel * fuel_density
-            
-            # Calculate lap time with current fuel load
-            lap_time = RacingCalculations.calculate_lap_time_with_fuel(
-                base_lap_time, fuel_weight, fuel_effect
-            )
-            
-            total_time += lap_time
-            current_fuel -= fuel_per_lap
-            
-            # Check if pit stop needed
-            if current_fuel < 5 and lap < laps - 1:  # Don't pit on last lap
-                total_time += pit_stop_time
-                current_fuel = initial_fuel  # Refuel
-                pit_stops += 1
+        full_stint_time = RacingCalculations._stint_time(
+            stint_laps, base_lap_time, fuel_per_lap, initial_fuel, fuel_effect
+        )
+        last_stint_time = RacingCalculations._stint_time(
+            last_stint_laps, base_lap_time, fuel_per_lap, initial_fuel, fuel_effect
+        )
+        total_time = pit_stops * (full_stint_time + pit_stop_time) + last_stint_time
         
         return {
             'total_time_seconds': round(total_time, 2),
@@ -215,6 +335,100 @@ class RacingCalculations:
             'average_lap_time': round(total_time / laps, 2)
         }
     
+    @staticmethod
+    def calculate_race_time_batch(laps, base_lap_time, fuel_per_lap, initial_fuel,
+                                  fuel_effect=0.035, pit_stop_time=25):
+        """
+        Vectorized version of calculate_race_time
+        
+        Every argument may be a scalar or an array; arrays are broadcast
+        against each other and each race is evaluated in O(1).
+        
+        Args:
+            laps: Total race laps
+            base_lap_time: Base lap time in seconds
+            fuel_per_lap: Fuel consumption per lap in liters
+            initial_fuel: Starting fuel in liters
+            fuel_effect: Time penalty per kg of fuel
+            pit_stop_time: Pit stop duration in seconds
+            
+        Returns:
+            Dictionary of equally sized 1-D arrays (one entry per race)
+        """
+        import numpy as np
+        
+        laps, base, consumption, fuel, effect, pit_time = [
+            array.ravel() for array in np.broadcast_arrays(
+                np.asarray(laps, dtype=np.int64), np.asarray(base_lap_time, dtype=float),
+                np.asarray(fuel_per_lap, dtype=float), np.asarray(initial_fuel, dtype=float),
+                np.asarray(fuel_effect, dtype=float), np.asarray(pit_stop_time, dtype=float)
+            )
+        ]
+        
+        threshold = RacingCalculations.REFUEL_THRESHOLD
+        with np.errstate(divide='ignore', invalid='ignore'):
+            usable = (fuel - threshold) / consumption
+            stint_laps = np.where(consumption > 0, np.floor(usable) + 1, np.where(fuel - consumption < threshold, 1, laps))
+            # Fuel levels that land exactly on the threshold depend on how the
+            # repeated subtraction rounds, so those few races are resolved exactly
+            near_boundary = (consumption > 0) & (np.abs(usable - np.round(usable)) < 1e-9)
+        stint_laps = np.clip(np.nan_to_num(stint_laps, nan=1), 1, np.maximum(laps, 1)).astype(np.int64)
+        
+        for i in np.flatnonzero(near_boundary):
+            stint_laps[i] = RacingCalculations._laps_per_stint(fuel[i], consumption[i], int(laps[i]))
+        
+        pit_stops = np.where(laps > 0, (laps - 1) // stint_laps, 0)
+        last_stint_laps = laps - pit_stops * stint_laps
+        
+        full_stint_time = RacingCalculations._stint_time(stint_laps, base, consumption, fuel, effect)
+        last_stint_time = RacingCalculations._stint_time(last_stint_laps, base, consumption, fuel, effect)
+        total_time = pit_stops * (full_stint_time + pit_time) + last_stint_time
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            average_lap_time = total_time / laps
+        
+        return {
+            'laps': laps,
+            'stint_laps': stint_laps,
+            'pit_stops': pit_stops,
+            'total_time_seconds': np.round(total_time, 2),
+            'average_lap_time': np.round(average_lap_time, 2)
+        }
+    
+    @staticmethod
+    def _laps_per_stint(initial_fuel, fuel_per_lap, laps):
+        """
+        Number of laps driven on a full tank before the car has to pit
+        
+        Mirrors the lap-by-lap rule: the car pits once the fuel left after a
+        lap drops below REFUEL_THRESHOLD. Capped at the race length when the
+        car never needs to pit.
+        """
+        threshold = RacingCalculations.REFUEL_THRESHOLD
+        if fuel_per_lap <= 0:
+            return 1 if initial_fuel - fuel_per_lap < threshold else max(laps, 1)
+        
+        usable = (initial_fuel - threshold) / fuel_per_lap
+        if abs(usable - round(usable)) >= 1e-9:
+            return min(max(1, math.floor(usable) + 1), max(laps, 1))
+        
+        # Exactly on the threshold: the division cannot tell whether lap k
+        # leaves the car just under it, so check the fuel left after k laps
+        k = max(round(usable), 0)
+        stint_laps = k if initial_fuel - k * fuel_per_lap < threshold else k + 1
+        return min(max(stint_laps, 1), max(laps, 1))
+    
+    @staticmethod
+    def _stint_time(stint_laps, base_lap_time, fuel_per_lap, initial_fuel, fuel_effect):
+        """
+        Total time of a stint started on a full tank
+        
+        Lap n of the stint carries initial_fuel - n * fuel_per_lap liters, so the
+        fuel penalty is an arithmetic series summed in closed form.
+        """
+        fuel_liters = stint_laps * initial_fuel - fuel_per_lap * stint_laps * (stint_laps - 1) / 2
+        return stint_laps * base_lap_time + fuel_liters * RacingCalculations.FUEL_DENSITY * fuel_effect
+    
     @staticmethod
     def format_time(seconds):
         """
@@ -230,6 +444,45 @@ class RacingCalculations:
         remaining_seconds = seconds % 60
         return f"{minutes}:{remaining_seconds:06.3f}"
     
+    @staticmethod
+    def parse_time(time_string):
+        """
+        Parse a time in MM:SS.mmm format (inverse of format_time)
+        
+        Also accepts SS.mmm and H:MM:SS.mmm, as used for sector times.
+        
+        Args:
+            time_string: Formatted time
+            
+        Returns:
+            Time in seconds, or None if the string is empty or not a time
+        """
+        if time_string is None:
+            return None
+        match = TIME_PATTERN.fullmatch(str(time_string).strip())
+        if match is None:
+            return None
+        hours, minutes, seconds = match.groups()
+        try:
+            seconds = (int(hours or 0) * 60 + int(minutes or 0)) * 60 + float(seconds)
+        except (OverflowError, ValueError):  # thousands of digits
+            return None
+        return seconds if math.isfinite(seconds) else None
+    
+    @staticmethod
+    def time_to_ms(time_string):
+        """
+        Convert a formatted time to integer milliseconds
+        
+        Args:
+            time_string: Time in MM:SS.mmm or SS.mmm format
+            
+        Returns:
+            Milliseconds, or None if the string is empty or not a time
+        """
+        seconds = RacingCalculations.parse_time(time_string)
+        return None if seconds is None else int(round(seconds * 1000))
+    
     @staticmethod
     def calculate_setup_balance(front_wing, rear_wing, front_spring, rear_spring):
         """
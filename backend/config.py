@@ -0,0 +1,88 @@
+"""
+Application configuration
+Database settings come from the environment (or a .env file next to this
+module): SQLite with WAL for the desktop build, or PostgreSQL with a sized
+connection pool for a shared team server.
+"""
+
+import os
+import sqlite3
+
+from sqlalchemy import event
+
+try:
+    from dotenv import load_dotenv
+except ImportError:  # python-dotenv is optional at runtime
+    load_dotenv = None
+
+if load_dotenv is not None:
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def database_url():
+    """Database URI from DATABASE_URL (default: racing.db in the instance folder)"""
+    url = os.environ.get('DATABASE_URL') or 'sqlite:///racing.db'
+    # Some hosting providers still hand out the pre-SQLAlchemy-1.4 scheme
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(url):
+    """SQLAlchemy create_engine options for the database in use"""
+    if url.startswith('sqlite'):
+        return {'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': True,
+        # Cancel queries that would hold a worker thread past the request timeout
+        'connect_args': {'options': f"-c statement_timeout={_env_int('DB_STATEMENT_TIMEOUT_MS', 30000)}"}
+    }
+
+
+# SQLite tuning, applied to every new connection
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)
+SQLITE_MMAP_SIZE = _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+SQLITE_CACHE_SIZE_KB = _env_int('SQLITE_CACHE_SIZE_KB', 16384)
+
+
+class Config:
+    """Flask configuration read from the environment"""
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+    SQLALCHEMY_DATABASE_URI = database_url()
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers run while a writer commits, NORMAL synchronous skips
+    the fsync on every commit (still safe in WAL mode) and the busy timeout
+    makes writers wait for the lock instead of failing with "database is
+    locked"
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.execute(f'PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}')
+    cursor.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+    cursor.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}')
+    cursor.close()
+
+
+def configure_engine(engine):
+    """Install the per-connection settings of the engine's database"""
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
@@ -0,0 +1,114 @@
+"""
+Shape-preserving downsampling of telemetry series
+- min/max: split the series into buckets and keep each bucket's lowest and
+  highest sample, so spikes survive at any zoom level. Buckets of buckets
+  give the same result as buckets of samples, which is what the
+  precomputed pyramid levels rely on.
+- LTTB (Largest-Triangle-Three-Buckets): keep one sample per bucket, the
+  one forming the largest triangle with the previously kept sample and the
+  average of the next bucket; smoother lines for the same point budget.
+
+All functions take and return numpy arrays.
+"""
+
+import numpy as np
+
+
+def minmax_reduce(t_min, v_min, t_max, v_max, size):
+    """
+    Merge every `size` consecutive buckets into one
+
+    Raw samples are buckets of one: pass (times, values, times, values).
+
+    Args:
+        t_min, v_min: Time and value of each bucket's minimum
+        t_max, v_max: Time and value of each bucket's maximum
+        size: Buckets per merged bucket (the last one may hold fewer)
+
+    Returns:
+        (t_min, v_min, t_max, v_max) of the merged buckets; all-NaN buckets
+        get NaN values
+    """
+    count = len(v_min)
+    buckets = -(-count // size)
+    pad = buckets * size - count
+    lows = np.pad(v_min.astype(np.float64), (0, pad), constant_values=np.nan).reshape(buckets, size)
+    highs = np.pad(v_max.astype(np.float64), (0, pad), constant_values=np.nan).reshape(buckets, size)
+    low_index = np.where(np.isnan(lows), np.inf, lows).argmin(axis=1)
+    high_index = np.where(np.isnan(highs), -np.inf, highs).argmax(axis=1)
+    rows = np.arange(buckets)
+    first = rows * size
+    return (t_min[first + low_index], lows[rows, low_index],
+            t_max[first + high_index], highs[rows, high_index])
+
+
+def minmax_points(t_min, v_min, t_max, v_max):
+    """
+    Bucket minima and maxima as one time-ordered series
+
+    Returns:
+        (times, values) with up to two points per bucket
+    """
+    min_first = t_min <= t_max
+    times = np.stack([np.where(min_first, t_min, t_max), np.where(min_first, t_max, t_min)], axis=1)
+    values = np.stack([np.where(min_first, v_min, v_max), np.where(min_first, v_max, v_min)], axis=1)
+    # A bucket whose minimum and maximum are the same sample gives one point
+    keep = np.ones(times.shape, dtype=bool)
+    keep[:, 1] = times[:, 1] != times[:, 0]
+    return times[keep], values[keep]
+
+
+def minmax(times, values, points):
+    """
+    Downsample to at most `points` points with min/max buckets
+
+    Args:
+        times, values: Series to downsample
+        points: Point budget (two per bucket)
+
+    Returns:
+        (times, values)
+    """
+    if len(times) <= points:
+        return times, values
+    size = -(-len(times) // max(points // 2, 1))
+    return minmax_points(*minmax_reduce(times, values, times, values, size))
+
+
+def lttb(times, values, points):
+    """
+    Largest-Triangle-Three-Buckets downsampling
+
+    NaN samples are dropped first.
+
+    Args:
+        times, values: Series to downsample
+        points: Number of points to keep (at least 3)
+
+    Returns:
+        (times, values)
+    """
+    finite = ~np.isnan(values) if values.dtype.kind == 'f' else slice(None)
+    times, values = times[finite], values[finite]
+    count = len(times)
+    if points >= count or points < 3:
+        return times, values
+
+    x = times.astype(np.float64)
+    y = values.astype(np.float64)
+    # points - 2 buckets between the first and the last sample, which are always kept
+    edges = np.linspace(1, count - 1, points - 1).astype(np.int64)
+    edges = np.append(edges, count)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, count - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x = x[end:edges[bucket + 2]].mean()
+        next_y = y[end:edges[bucket + 2]].mean()
+        # Twice the area of the triangle (previous, candidate, next bucket average)
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(area.argmax())
+        selected[bucket + 1] = previous
+    return times[selected], values[selected]
@@ -0,0 +1,669 @@
+"""
+Race-weekend workbook import
+Reads the team's Excel workbook (.xlsm/.xlsx, or .xlsb when pyxlsb is
+installed) into an event with its sessions, laps, tire, setup and engine
+data.
+
+Sheets are streamed row by row in read-only mode and never loaded whole.
+They are split between worker processes, which each open the workbook once
+and return plain dictionaries; the inserts then run in the caller's
+transaction, so a failed import leaves nothing behind.
+
+Where each value lives (see formule_estratte.txt):
+- DatiEvento: event name O4, track D4, current session O5, date D1
+- RunPlan<session>: starting fuel D5, fuel per lap I5, first stint tire set H11
+- Timing sheets (Test1, FP1, Qualy, Race1, ...): a lap table found by its
+  Sector1..Sector4 header row
+- Pressioni: cold pressures in bar F13:G14, hot F16:G17 (front row first,
+  left column first)
+- Tyre Temp Optimiser: outer/middle/inner temperatures in C:E, rows 8 (FL),
+  10 (RL), 12 (RR) and 14 (FR)
+- Assetto: one row per setting, labelled in column A, with a column per
+  session (T1, Fp1, Q, R1, ...) as in SetupSheet.xlsx
+- Motore: track lengths in L:M, labelled engine settings
+"""
+
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta
+
+from calculations import RacingCalculations
+from lap_import import insert_laps
+from models import db, RaceEvent, Session, TireData, SetupData, EngineData
+
+# Excel serial dates count days from this date; 36526 is 2000-01-01
+EXCEL_EPOCH = datetime(1899, 12, 30)
+EXCEL_SERIAL_2000 = 36526
+
+# Rows searched for a timing sheet's header and a setup sheet's session columns
+HEADER_SEARCH_ROWS = 40
+
+# Session types in weekend order, with the names sheets and columns use for them
+SESSION_ORDER = [('Test', 1), ('Test', 2), ('Test', 3), ('Test', 4), ('FP1', 1), ('FP2', 1),
+                 ('FP3', 1), ('Q', 1), ('R1', 1), ('R2', 1), ('Endurance', 1)]
+SESSION_PATTERNS = [
+    (re.compile(r'^(?:test|t)0*(\d+)$'), lambda m: ('Test', int(m.group(1)))),
+    (re.compile(r'^(?:fp|pl)(\d)$'), lambda m: (f'FP{m.group(1)}', 1)),
+    (re.compile(r'^(?:q|qualy|quali|qualifying|qualifica)$'), lambda m: ('Q', 1)),
+    (re.compile(r'^(?:r|race|gara)(\d)$'), lambda m: (f'R{m.group(1)}', 1)),
+    (re.compile(r'^endurance$'), lambda m: ('Endurance', 1)),
+]
+
+EVENT_CELLS = {'name': 'O4', 'track': 'D4', 'session': 'O5', 'date': 'D1'}
+RUN_PLAN_CELLS = {'fuel_start': 'D5', 'fuel_per_lap': 'I5', 'tire_set': 'H11'}
+PRESSURE_CELLS = {
+    'FL': {'pressure_cold': 'F13', 'pressure_hot': 'F16'},
+    'FR': {'pressure_cold': 'G13', 'pressure_hot': 'G16'},
+    'RL': {'pressure_cold': 'F14', 'pressure_hot': 'F17'},
+    'RR': {'pressure_cold': 'G14', 'pressure_hot': 'G17'},
+}
+TEMPERATURE_CELLS = {
+    position: {'temp_outer': f'C{row}', 'temp_middle': f'D{row}', 'temp_inner': f'E{row}'}
+    for position, row in (('FL', 8), ('RL', 10), ('RR', 12), ('FR', 14))
+}
+TRACK_LENGTH_COLUMNS = (11, 12)  # Motore!L:M
+
+# Lap table headers, normalized to lowercase letters and digits
+LAP_COLUMNS = {
+    'lap_number': ('lap', 'laps', 'giro', 'giri', 'n', 'nr', 'no', 'lapnumber'),
+    'lap_time': ('laptime', 'time', 'tempo', 'tempogiro', 'total'),
+    'sector1': ('sector1', 'settore1', 's1', 'sec1'),
+    'sector2': ('sector2', 'settore2', 's2', 'sec2'),
+    'sector3': ('sector3', 'settore3', 's3', 'sec3'),
+    'sector4': ('sector4', 'settore4', 's4', 'sec4'),
+    'fuel_consumed': ('fuel', 'fuelconsumed', 'benzina', 'carburante', 'consumo'),
+    'tire_set': ('tireset', 'tyreset', 'set', 'gomme', 'tires', 'tyres'),
+    'lap_status': ('status', 'stato', 'flag'),
+    'notes': ('notes', 'note', 'comment', 'commenti'),
+}
+SECTORS = ('sector1', 'sector2', 'sector3', 'sector4')
+
+# Setup labels (lowercase prefixes) and what they set; axle settings follow
+# the last "front"/"rear" section row
+SETUP_SECTIONS = (('asse ant', 'front'), ('asse post', 'rear'), ('front', 'front'), ('rear', 'rear'))
+SETUP_LABELS = (
+    ('altezza fondo', 'ride_height'), ('ride height', 'ride_height'),
+    ('rigid. molla', 'spring_rate'), ('spring', 'spring_rate'),
+    ('camber', 'camber'),
+    ('convergenza', 'toe'), ('toe', 'toe'),
+    ('set ammortizzatore', 'damper'), ('damper', 'damper'),
+    ('d. barra', 'anti_roll_bar'), ('d. e sp. barra', 'anti_roll_bar'), ('anti roll bar', 'anti_roll_bar'),
+    ('ala ant', 'front_wing'), ('front wing', 'front_wing'),
+    ('regolazione ala', 'rear_wing'), ('ala post', 'rear_wing'), ('rear wing', 'rear_wing'),
+    ('ripartizione', 'brake_balance'), ('brake balance', 'brake_balance'),
+)
+ENGINE_LABELS = (
+    ('mappa', 'engine_map'), ('engine map', 'engine_map'),
+    ('limitatore', 'rpm_limit'), ('rpm', 'rpm_limit'),
+    ('temp. olio', 'oil_temp'), ('oil temp', 'oil_temp'),
+    ('temp. acqua', 'water_temp'), ('water temp', 'water_temp'),
+    ('consumo', 'fuel_consumption_rate'), ('fuel consumption', 'fuel_consumption_rate'),
+)
+
+NUMBER = re.compile(r'-?\d+(?:[.,]\d+)?')
+
+
+class ExcelImportError(ValueError):
+    """Raised when a workbook cannot be imported"""
+
+
+def _normalize(value):
+    return re.sub(r'[^a-z0-9]', '', str(value).lower())
+
+
+def session_key(name):
+    """
+    Session a sheet or setup column name refers to
+
+    Args:
+        name: "Test04", "RunPlanFP2", "Qualy", "R1", "Fp1", ...
+
+    Returns:
+        (session_type, session_number), or None
+    """
+    if not isinstance(name, str):
+        return None
+    name = _normalize(name)
+    if name.startswith('runplan'):
+        name = name[len('runplan'):]
+    for pattern, key in SESSION_PATTERNS:
+        match = pattern.match(name)
+        if match:
+            return key(match)
+    return None
+
+
+def _address(cell):
+    """'D5' -> zero-based (row, column)"""
+    letters, digits = re.match(r'([A-Z]+)(\d+)$', cell).groups()
+    column = 0
+    for letter in letters:
+        column = column * 26 + ord(letter) - ord('A') + 1
+    return int(digits) - 1, column - 1
+
+
+def _cells(rows, wanted):
+    """
+    Pick single cells out of a row stream
+
+    Args:
+        rows: Iterable of row value sequences
+        wanted: {key: 'D5'}
+
+    Returns:
+        {key: value}, reading no further than the last wanted row
+    """
+    positions = {key: _address(cell) for key, cell in wanted.items()}
+    last_row = max(row for row, _ in positions.values())
+    found = dict.fromkeys(wanted)
+    for index, values in enumerate(rows):
+        for key, (row, column) in positions.items():
+            if row == index and column < len(values):
+                found[key] = values[column]
+        if index >= last_row:
+            break
+    return found
+
+
+def _number(value):
+    """Float from a numeric cell or a number written as text, else None"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    numbers = _numbers(value)
+    return numbers[0] if numbers else None
+
+
+def _numbers(value):
+    """Every number in a cell: '-3,5 / -3,2' -> [-3.5, -3.2]"""
+    if isinstance(value, bool) or value is None:
+        return []
+    if isinstance(value, (int, float)):
+        return [float(value)]
+    return [float(number.replace(',', '.')) for number in NUMBER.findall(str(value))]
+
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def _seconds(value):
+    """
+    Duration in seconds from a timing cell
+
+    Excel stores times as fractions of a day; openpyxl hands them back as
+    time, timedelta or datetime depending on the cell format, pyxlsb as
+    plain floats. Numbers of a second or more are taken as seconds.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, timedelta):
+        seconds = value.total_seconds()
+    elif isinstance(value, datetime):
+        seconds = (value - EXCEL_EPOCH).total_seconds()
+    elif isinstance(value, time):
+        seconds = value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6
+    elif isinstance(value, (int, float)):
+        seconds = value * 86400 if value < 1 else float(value)
+    else:
+        seconds = RacingCalculations.parse_time(value)
+    return seconds if seconds and seconds > 0 else None
+
+
+def _sector_time(seconds):
+    return f'{seconds:.3f}' if seconds < 60 else RacingCalculations.format_time(seconds)
+
+
+def _date(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    # pyxlsb returns dates as serial numbers; smaller numbers are not dates
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value > EXCEL_SERIAL_2000:
+        return EXCEL_EPOCH + timedelta(days=value)
+    return None
+
+
+def _label_values(row):
+    """(lowercase label, cells after it) for a row whose first filled cell is text"""
+    for index, value in enumerate(row):
+        if value is None:
+            continue
+        if isinstance(value, str) and value.strip():
+            return ' '.join(value.lower().split()), row[index + 1:]
+        return None, ()
+    return None, ()
+
+
+def _match(label, aliases):
+    for prefix, field in aliases:
+        if label.startswith(prefix):
+            return field
+    return None
+
+
+def parse_event(rows):
+    values = _cells(rows, EVENT_CELLS)
+    return {'name': _text(values['name']), 'track': _text(values['track']),
+            'session': session_key(values['session']), 'date': _date(values['date'])}
+
+
+def parse_run_plan(rows):
+    values = _cells(rows, RUN_PLAN_CELLS)
+    return {'fuel_start': _number(values['fuel_start']), 'fuel_per_lap': _number(values['fuel_per_lap']),
+            'tire_set': _text(values['tire_set'])}
+
+
+def parse_tires(rows, cells):
+    wanted = {(position, field): cell for position, fields in cells.items() for field, cell in fields.items()}
+    values = _cells(rows, wanted)
+    return {position: {field: _number(values[(position, field)]) for field in fields}
+            for position, fields in cells.items()}
+
+
+def parse_laps(rows):
+    """
+    Lap records of a timing sheet
+
+    The header row is the first one naming a sector column; rows without
+    any time (the empty part of the table) are skipped. An empty lap time
+    is the sum of the sectors only when every sector column is filled.
+    """
+    columns = None
+    laps = []
+    for index, row in enumerate(rows):
+        if columns is None:
+            if index >= HEADER_SEARCH_ROWS:
+                break
+            headers = [_normalize(value) if value is not None else '' for value in row]
+            if 'sector1' not in headers and 'settore1' not in headers:
+                continue
+            columns = {}
+            for field, aliases in LAP_COLUMNS.items():
+                for position, header in enumerate(headers):
+                    if header in aliases and position not in columns.values():
+                        columns[field] = position
+                        break
+            # The lap number column is often left without a header
+            if 'lap_number' not in columns and 0 not in columns.values():
+                columns['lap_number'] = 0
+            continue
+
+        cell = lambda field: row[columns[field]] if field in columns and columns[field] < len(row) else None
+        sectors = {field: _seconds(cell(field)) for field in SECTORS}
+        lap_time = _seconds(cell('lap_time'))
+        # Without a lap time only a complete set of sectors adds up to one; a
+        # lap with a sector missing (in-lap, red flag) keeps lap_time empty
+        timed = [sectors[field] for field in SECTORS if field in columns]
+        if lap_time is None and timed and all(seconds is not None for seconds in timed):
+            lap_time = sum(timed)
+        if lap_time is None and not any(sectors.values()):
+            continue
+
+        lap_number = _number(cell('lap_number'))
+        lap = {
+            'lap_number': int(lap_number) if lap_number is not None else len(laps) + 1,
+            'lap_time': RacingCalculations.format_time(lap_time) if lap_time is not None else None,
+            'fuel_consumed': _number(cell('fuel_consumed')),
+            'tire_set': _text(cell('tire_set')),
+            'lap_status': _text(cell('lap_status')),
+            'notes': _text(cell('notes')),
+        }
+        for field, seconds in sectors.items():
+            lap[field] = _sector_time(seconds) if seconds is not None else None
+        if lap['lap_status']:
+            lap['lap_status'] = lap['lap_status'].upper()[:10]
+        laps.append(lap)
+    return laps
+
+
+def _setup_fields(setting, axle, value):
+    """SetupData columns a labelled setting fills"""
+    numbers = _numbers(value)
+    if not numbers:
+        return {}
+    if setting in ('front_wing', 'rear_wing', 'brake_balance'):
+        return {setting: numbers[0]}
+    if axle is None:
+        return {}
+    if setting == 'camber':
+        return {f'camber_{axle}_left': numbers[0], f'camber_{axle}_right': numbers[-1]}
+    if setting == 'toe':
+        return {f'toe_{axle}': numbers[0]}
+    if setting == 'damper':
+        # "bump / rebound"
+        return {f'{axle}_damper_compression': numbers[0], f'{axle}_damper_rebound': numbers[-1]}
+    return {f'{axle}_{setting}': numbers[0]}
+
+
+def parse_setup(rows):
+    """
+    Setup values per session column
+
+    Returns:
+        {session key: {SetupData column: value}}; the key is None when the
+        sheet has a single column of values
+    """
+    sessions = None
+    axle = None
+    setups = {}
+    for index, row in enumerate(rows):
+        if sessions is None and index < HEADER_SEARCH_ROWS:
+            keys = {position: session_key(value) for position, value in enumerate(row)}
+            keys = {position: key for position, key in keys.items() if key is not None}
+            if len(keys) >= 2:
+                sessions = keys
+        label, rest = _label_values(row)
+        if label is None:
+            continue
+        setting = _match(label, SETUP_LABELS)
+        row_axle = axle
+        for side in ('front', 'rear'):
+            # "Front ride height" rather than a "Front" section
+            if setting is None and label.startswith(side + ' '):
+                setting = _match(label[len(side) + 1:], SETUP_LABELS)
+                row_axle = side
+        if setting is None:
+            axle = _match(label, SETUP_SECTIONS) or axle
+            continue
+
+        if sessions is None:
+            value = next((value for value in rest if value is not None), None)
+            columns = [(None, value)]
+        else:
+            columns = [(key, row[position]) for position, key in sessions.items() if position < len(row)]
+        for key, value in columns:
+            values = setups.setdefault(key, {})
+            for field, number in _setup_fields(setting, row_axle, value).items():
+                # Low speed damping comes before high speed: first value wins
+                values.setdefault(field, number)
+    return {key: values for key, values in setups.items() if values}
+
+
+def parse_engine(rows):
+    """Track lengths (Motore!L:M) and labelled engine settings"""
+    tracks = {}
+    values = {}
+    name_column, length_column = TRACK_LENGTH_COLUMNS
+    for row in rows:
+        if len(row) > length_column and isinstance(row[name_column], str):
+            length = _number(row[length_column])
+            if length is not None:
+                tracks[row[name_column].strip().lower()] = length
+        label, rest = _label_values(row)
+        field = _match(label, ENGINE_LABELS) if label else None
+        if field is None or field in values:
+            continue
+        value = next((value for value in rest if value is not None), None)
+        if field == 'engine_map':
+            values[field] = _text(value)
+        elif field == 'rpm_limit':
+            number = _number(value)
+            values[field] = int(number) if number is not None else None
+        else:
+            values[field] = _number(value)
+    return {'tracks': tracks, 'values': {field: value for field, value in values.items() if value is not None}}
+
+
+def sheet_kind(name):
+    """What a sheet holds, or None for sheets the import does not read"""
+    normalized = _normalize(name)
+    if normalized == 'datievento':
+        return 'event'
+    if normalized == 'pressioni':
+        return 'pressures'
+    if normalized == 'tyretempoptimiser':
+        return 'temperatures'
+    if normalized == 'assetto':
+        return 'setup'
+    if normalized == 'motore':
+        return 'engine'
+    if normalized.startswith('runplan') and session_key(name):
+        return 'run_plan'
+    if session_key(name):
+        return 'laps'
+    return None
+
+
+def _parse_sheet(name, rows):
+    kind = sheet_kind(name)
+    if kind == 'event':
+        return parse_event(rows)
+    if kind == 'run_plan':
+        return parse_run_plan(rows)
+    if kind == 'laps':
+        return parse_laps(rows)
+    if kind == 'pressures':
+        return parse_tires(rows, PRESSURE_CELLS)
+    if kind == 'temperatures':
+        return parse_tires(rows, TEMPERATURE_CELLS)
+    if kind == 'setup':
+        return parse_setup(rows)
+    return parse_engine(rows)
+
+
+def _is_xlsb(path):
+    return path.lower().endswith('.xlsb')
+
+
+def sheet_names(path):
+    """Names of the sheets the import reads, in workbook order"""
+    if _is_xlsb(path):
+        try:
+            from pyxlsb import open_workbook
+        except ImportError:
+            raise ExcelImportError('.xlsb workbooks need pyxlsb (pip install pyxlsb), '
+                                   'or save the workbook as .xlsm')
+        with open_workbook(path) as workbook:
+            names = workbook.sheets
+    else:
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+        try:
+            workbook = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+        except (InvalidFileException, zipfile.BadZipFile, KeyError) as e:
+            raise ExcelImportError(f'{path} is not a readable workbook: {e}')
+        names = workbook.sheetnames
+        workbook.close()
+    return [name for name in names if sheet_kind(name)]
+
+
+def read_sheets(path, names):
+    """
+    Parse some sheets of a workbook (runs in a worker process)
+
+    The workbook is opened once in read-only mode and each sheet is parsed
+    while its rows stream in.
+
+    Args:
+        path: Workbook file
+        names: Sheets to parse
+
+    Returns:
+        {sheet name: parsed data}
+    """
+    parsed = {}
+    if _is_xlsb(path):
+        from pyxlsb import open_workbook
+        with open_workbook(path) as workbook:
+            for name in names:
+                with workbook.get_sheet(name) as sheet:
+                    parsed[name] = _parse_sheet(name, ([cell.v for cell in row] for row in sheet.rows()))
+    else:
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+        try:
+            for name in names:
+                parsed[name] = _parse_sheet(name, workbook[name].iter_rows(values_only=True))
+        finally:
+            workbook.close()
+    return parsed
+
+
+def parse_workbook(path, workers=None):
+    """
+    Parse every sheet the import reads
+
+    Args:
+        path: Workbook file
+        workers: Worker processes (defaults to the number of CPUs)
+
+    Returns:
+        {sheet name: parsed data}
+    """
+    if not os.path.isfile(path):
+        raise ExcelImportError(f'{path} does not exist')
+    names = sheet_names(path)
+    if not names:
+        raise ExcelImportError(f'{path} has none of the expected sheets')
+
+    workers = min(workers or os.cpu_count() or 1, len(names))
+    # Lap sheets are the large ones: deal them out first so each worker gets a share
+    names.sort(key=lambda name: sheet_kind(name) != 'laps')
+    batches = [names[index::workers] for index in range(workers)]
+    if workers == 1:
+        return read_sheets(path, names)
+    parsed = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(read_sheets, [path] * workers, batches):
+            parsed.update(result)
+    return parsed
+
+
+def _weekend(parsed):
+    """Group parsed sheets by session, in weekend order"""
+    event = {'name': None, 'track': None, 'session': None, 'date': None}
+    engine = {'tracks': {}, 'values': {}}
+    sessions = {}
+    tires = {}
+    setups = {}
+    for name, data in parsed.items():
+        kind = sheet_kind(name)
+        if kind == 'event':
+            event = data
+        elif kind == 'engine':
+            engine = data
+        elif kind in ('pressures', 'temperatures'):
+            for position, values in data.items():
+                tires.setdefault(position, {}).update(values)
+        elif kind == 'setup':
+            setups = data
+        elif kind == 'run_plan':
+            if any(value is not None for value in data.values()):
+                sessions.setdefault(session_key(name), {})['plan'] = data
+        elif data:
+            # Two sheets for one session (Test4 and Test04): keep the longer one
+            session = sessions.setdefault(session_key(name), {})
+            if len(data) > len(session.get('laps', ())):
+                session['laps'], session['sheet'] = data, name
+    for key in setups:
+        if key is not None:
+            sessions.setdefault(key, {})
+    rank = {key: index for index, key in enumerate(SESSION_ORDER)}
+    ordered = sorted(sessions, key=lambda key: (rank.get(key, len(rank)), key))
+    return event, engine, [(key, sessions[key]) for key in ordered], tires, setups
+
+
+def import_workbook(path, name=None, date_start=None, date_end=None, workers=None):
+    """
+    Import a race-weekend workbook without committing
+
+    Args:
+        path: Workbook file
+        name: Event name (defaults to DatiEvento!O4, then the file name)
+        date_start, date_end: Event dates (default to DatiEvento!D1, then today)
+        workers: Worker processes used to parse the sheets
+
+    Returns:
+        Report of what was created: event_id, sessions, laps, tire_data,
+        setups and engine_data counts
+    """
+    event_data, engine, sessions, tires, setups = _weekend(parse_workbook(path, workers))
+    if not sessions and not tires:
+        raise ExcelImportError(f'{path} has no session, lap or tire data')
+
+    track = event_data['track'] or 'Unknown track'
+    date_start = date_start or event_data['date'] or datetime.combine(date.today(), time())
+    event = RaceEvent(
+        name=name or event_data['name'] or os.path.basename(path).split('.')[0],
+        track=track,
+        track_length=engine['tracks'].get(track.lower()),
+        date_start=date_start,
+        date_end=date_end or date_start,
+        notes=f'Imported from {os.path.basename(path)}',
+    )
+    db.session.add(event)
+    db.session.flush()
+
+    session_ids = {}
+    for key, data in sessions:
+        plan = data.get('plan', {})
+        session = Session(
+            event_id=event.id,
+            session_type=key[0],
+            session_number=key[1],
+            fuel_start=plan.get('fuel_start'),
+            fuel_per_lap=plan.get('fuel_per_lap'),
+            tire_set=plan.get('tire_set'),
+            notes=f"Imported from {data['sheet']}" if 'sheet' in data else None,
+        )
+        db.session.add(session)
+        session_ids[key] = session
+    db.session.flush()
+    session_ids = {key: session.id for key, session in session_ids.items()}
+
+    laps = 0
+    for key, data in sessions:
+        if data.get('laps'):
+            inserted, rejected, errors = insert_laps(session_ids[key], data['laps'])
+            if rejected:
+                raise ExcelImportError(f"{data['sheet']}: {errors[0]['error']}")
+            laps += inserted
+
+    # Pressures, temperatures and a single-column setup are for the session in progress
+    current = event_data['session'] if event_data['session'] in session_ids else None
+    if current is None:
+        with_laps = [key for key, data in sessions if data.get('laps')]
+        current = with_laps[-1] if with_laps else next(iter(session_ids), None)
+
+    tire_rows = []
+    if current is not None:
+        tire_set = dict(sessions)[current].get('plan', {}).get('tire_set')
+        for position in ('FL', 'FR', 'RL', 'RR'):
+            values = {field: value for field, value in tires.get(position, {}).items() if value is not None}
+            if values:
+                tire_rows.append(dict(values, session_id=session_ids[current], tire_position=position,
+                                      tire_set=tire_set))
+
+    setup_rows = []
+    for key, values in setups.items():
+        session_id = session_ids.get(current if key is None else key)
+        if session_id is not None:
+            setup_rows.append(dict(values, session_id=session_id))
+
+    engine_rows = []
+    for key, data in sessions:
+        values = dict(engine['values'])
+        fuel_per_lap = data.get('plan', {}).get('fuel_per_lap')
+        if fuel_per_lap is not None:
+            values['fuel_consumption_rate'] = fuel_per_lap
+        if values:
+            engine_rows.append(dict(values, session_id=session_ids[key]))
+
+    for model, rows in ((TireData, tire_rows), (SetupData, setup_rows), (EngineData, engine_rows)):
+        if rows:
+            # Same columns in every row, as executemany needs
+            columns = set().union(*rows)
+            db.session.execute(model.__table__.insert(), [{**dict.fromkeys(columns), **row} for row in rows])
+
+    return {'event_id': event.id, 'sessions': len(session_ids), 'laps': laps,
+            'tire_data': len(tire_rows), 'setups': len(setup_rows), 'engine_data': len(engine_rows)}
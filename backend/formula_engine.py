@@ -0,0 +1,956 @@
+"""
+Formula engine for the formulas extracted from the Excel workbook
+Parses formule_estratte.txt into a cell dependency graph and evaluates it
+incrementally: changing an input only recomputes the cells downstream of it
+"""
+
+import heapq
+import math
+import os
+import re
+
+FORMULAS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'formule_estratte.txt')
+
+
+class ExcelError:
+    """Excel error value such as #REF! or #DIV/0!"""
+
+    def __init__(self, code):
+        self.code = code
+
+    def __eq__(self, other):
+        return isinstance(other, ExcelError) and other.code == self.code
+
+    def __hash__(self):
+        return hash(self.code)
+
+    def __repr__(self):
+        return self.code
+
+
+REF_ERROR = ExcelError('#REF!')
+VALUE_ERROR = ExcelError('#VALUE!')
+DIV_ERROR = ExcelError('#DIV/0!')
+NAME_ERROR = ExcelError('#NAME?')
+NA_ERROR = ExcelError('#N/A')
+NUM_ERROR = ExcelError('#NUM!')
+# Not an Excel error: marks cells that are part of a circular reference
+CIRCULAR_ERROR = ExcelError('#CIRC!')
+
+_ERRORS = {error.code: error for error in
+           (REF_ERROR, VALUE_ERROR, DIV_ERROR, NAME_ERROR, NA_ERROR, NUM_ERROR, ExcelError('#NULL!'))}
+
+# Evaluations of one volatile formula per recalc; INDIRECT pointing back at
+# its own dependents would otherwise be queued again forever
+MAX_VOLATILE_RUNS = 10
+
+
+class FormulaSyntaxError(ValueError):
+    """Raised when a formula cannot be parsed"""
+
+
+# ---------------------------------------------------------------------------
+# References
+# ---------------------------------------------------------------------------
+
+_CELL = re.compile(r'^\$?([A-Za-z]{1,3})\$?(\d+)$')
+
+
+def column_index(letters):
+    """Convert column letters to a 1-based index (A -> 1, AA -> 27)"""
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - 64
+    return index
+
+
+def column_letters(index):
+    """Convert a 1-based column index to letters (27 -> AA)"""
+    letters = ''
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def parse_cell(ref):
+    """Parse an A1 reference (dollar signs allowed) into (row, col)"""
+    match = _CELL.match(ref.strip())
+    if not match:
+        raise FormulaSyntaxError(f'Invalid cell reference: {ref}')
+    return int(match.group(2)), column_index(match.group(1))
+
+
+def cell_name(row, col):
+    """Format (row, col) as an A1 reference"""
+    return f'{column_letters(col)}{row}'
+
+
+class RangeRef:
+    """
+    Rectangular range used as a function argument
+
+    Whole-column ranges such as K:K have last_row set to None.
+    """
+
+    __slots__ = ('sheet', 'first_row', 'first_col', 'last_row', 'last_col')
+
+    def __init__(self, sheet, first_row, first_col, last_row, last_col):
+        self.sheet = sheet
+        self.first_row = first_row
+        self.first_col = first_col
+        self.last_row = last_row
+        self.last_col = last_col
+
+
+# ---------------------------------------------------------------------------
+# Parser
+# ---------------------------------------------------------------------------
+
+_SHEET = r"(?:'(?:[^']|'')+'|[A-Za-z_][\w\.]*)!"
+_TOKEN = re.compile(rf'''
+    (?P<ws>\s+)
+  | (?P<string>"(?:[^"]|"")*")
+  | (?P<error>\#(?:REF!|N/A|DIV/0!|VALUE!|NAME\?|NUM!|NULL!))
+  | (?P<func>[A-Za-z_][\w\.]*(?=\())
+  | (?P<ref>(?:{_SHEET})?(?:\$?[A-Za-z]{{1,3}}\$?\d+(?::\$?[A-Za-z]{{1,3}}\$?\d+)?
+                          |\$?[A-Za-z]{{1,3}}:\$?[A-Za-z]{{1,3}}
+                          |\#REF!)(?![\w\[]))
+  | (?P<bool>(?:TRUE|FALSE)(?![\w\[]))
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<op><>|<=|>=|[-+*/^&=<>%])
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<comma>,)
+''', re.VERBOSE)
+
+_COMPARISONS = ('=', '<>', '<', '>', '<=', '>=')
+
+
+def tokenize(text):
+    """Split a formula (without the leading '=') into (kind, value) tokens"""
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if not match:
+            raise FormulaSyntaxError(f'Unexpected input at {position}: {text[position:position + 20]!r}')
+        kind = match.lastgroup
+        if kind != 'ws':
+            tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+def _parse_reference(text, sheet):
+    """Build a cell or range AST node from a reference token"""
+    if '!' in text:
+        prefix, text = text.rsplit('!', 1)
+        sheet = prefix[1:-1].replace("''", "'") if prefix.startswith("'") else prefix
+    if text == '#REF!':
+        return ('err', REF_ERROR)
+
+    first, _, last = text.partition(':')
+    if not last:
+        row, col = parse_cell(first)
+        return ('cell', sheet, row, col)
+    if first.strip('$').isalpha():
+        first_col, last_col = sorted((column_index(first.strip('$')), column_index(last.strip('$'))))
+        return ('range', sheet, 1, first_col, None, last_col)
+
+    first_row, first_col = parse_cell(first)
+    last_row, last_col = parse_cell(last)
+    return ('range', sheet, min(first_row, last_row), min(first_col, last_col),
+            max(first_row, last_row), max(first_col, last_col))
+
+
+class _Parser:
+    """Recursive descent parser producing a tuple-based AST"""
+
+    def __init__(self, text, sheet):
+        self.tokens = tokenize(text)
+        self.position = 0
+        self.sheet = sheet
+
+    def parse(self):
+        node = self.comparison()
+        if self.position != len(self.tokens):
+            raise FormulaSyntaxError(f'Unexpected token {self.tokens[self.position][1]!r}')
+        return node
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1] != value):
+            raise FormulaSyntaxError(f'Expected {value or kind}, got {token[1]!r}')
+        self.position += 1
+        return token
+
+    def binary(self, operators, operand):
+        node = operand()
+        while self.peek()[0] == 'op' and self.peek()[1] in operators:
+            operator = self.take()[1]
+            node = ('bin', operator, node, operand())
+        return node
+
+    def comparison(self):
+        return self.binary(_COMPARISONS, self.concatenation)
+
+    def concatenation(self):
+        return self.binary(('&',), self.additive)
+
+    def additive(self):
+        return self.binary(('+', '-'), self.multiplicative)
+
+    def multiplicative(self):
+        return self.binary(('*', '/'), self.power)
+
+    def power(self):
+        return self.binary(('^',), self.unary)
+
+    def unary(self):
+        kind, value = self.peek()
+        if kind == 'op' and value in ('-', '+'):
+            self.take()
+            operand = self.unary()
+            return ('neg', operand) if value == '-' else ('pos', operand)
+        return self.postfix()
+
+    def postfix(self):
+        node = self.primary()
+        while self.peek() == ('op', '%'):
+            self.take()
+            node = ('bin', '/', node, ('num', 100.0))
+        return node
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return ('num', float(value))
+        if kind == 'string':
+            return ('str', value[1:-1].replace('""', '"'))
+        if kind == 'bool':
+            return ('bool', value == 'TRUE')
+        if kind == 'error':
+            return ('err', _ERRORS[value])
+        if kind == 'ref':
+            return _parse_reference(value, self.sheet)
+        if kind == 'lparen':
+            node = self.comparison()
+            self.take('rparen')
+            return node
+        if kind == 'func':
+            self.take('lparen')
+            args = []
+            if self.peek()[0] != 'rparen':
+                args.append(self.argument())
+                while self.peek()[0] == 'comma':
+                    self.take()
+                    args.append(self.argument())
+            self.take('rparen')
+            return ('call', value.upper(), args)
+        raise FormulaSyntaxError(f'Unexpected token {value!r}')
+
+    def argument(self):
+        # Empty arguments such as IF(A1,,1) evaluate as blank
+        if self.peek()[0] in ('comma', 'rparen'):
+            return ('blank',)
+        return self.comparison()
+
+
+def parse_formula(text, sheet):
+    """Parse a formula (with or without the leading '=') into an AST"""
+    return _Parser(text[1:] if text.startswith('=') else text, sheet).parse()
+
+
+def _references(node, cells, ranges):
+    """Collect the cells and ranges an AST reads, return True if volatile"""
+    kind = node[0]
+    if kind == 'cell':
+        cells.add((node[1], node[2], node[3]))
+        return False
+    if kind == 'range':
+        ranges.append(RangeRef(*node[1:]))
+        return False
+    volatile = False
+    if kind == 'call':
+        volatile = node[1] == 'INDIRECT'
+        children = node[2]
+    elif kind == 'bin':
+        children = node[2:]
+    elif kind in ('neg', 'pos'):
+        children = node[1:]
+    else:
+        children = ()
+    for child in children:
+        volatile = _references(child, cells, ranges) or volatile
+    return volatile
+
+
+# ---------------------------------------------------------------------------
+# Value semantics
+# ---------------------------------------------------------------------------
+
+def _to_number(value):
+    """Coerce a scalar to a number the way Excel arithmetic does"""
+    if value is None:
+        return 0.0
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, ExcelError):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return VALUE_ERROR
+    return VALUE_ERROR
+
+
+def _to_text(value):
+    """Coerce a scalar to text the way Excel concatenation does"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else f'{value:.15g}'
+    return str(value)
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        upper = value.upper()
+        if upper in ('TRUE', 'FALSE'):
+            return upper == 'TRUE'
+        return VALUE_ERROR
+    number = _to_number(value)
+    return number if isinstance(number, ExcelError) else number != 0
+
+
+def _compare_key(value):
+    """Sort key following Excel ordering: numbers < text < booleans"""
+    if isinstance(value, bool):
+        return (2, value)
+    if isinstance(value, str):
+        return (1, value.lower())
+    return (0, value)
+
+
+def _compare(operator, left, right):
+    if isinstance(left, ExcelError):
+        return left
+    if isinstance(right, ExcelError):
+        return right
+    # A blank cell compares as 0 against numbers and as "" against text
+    if left is None:
+        left = '' if isinstance(right, str) else (False if isinstance(right, bool) else 0.0)
+    if right is None:
+        right = '' if isinstance(left, str) else (False if isinstance(left, bool) else 0.0)
+    a, b = _compare_key(left), _compare_key(right)
+    if operator == '=':
+        return a == b
+    if operator == '<>':
+        return a != b
+    if operator == '<':
+        return a < b
+    if operator == '>':
+        return a > b
+    if operator == '<=':
+        return a <= b
+    return a >= b
+
+
+def _arithmetic(operator, left, right):
+    left, right = _to_number(left), _to_number(right)
+    if isinstance(left, ExcelError):
+        return left
+    if isinstance(right, ExcelError):
+        return right
+    if operator == '+':
+        return left + right
+    if operator == '-':
+        return left - right
+    if operator == '*':
+        return left * right
+    if operator == '/':
+        return DIV_ERROR if right == 0 else left / right
+    try:
+        return float(left) ** right
+    except (OverflowError, ZeroDivisionError):
+        return NUM_ERROR
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def _numbers(engine, args, count_text=False):
+    """
+    Numbers taken from function arguments
+
+    Inside ranges text and booleans are skipped (or counted as 0 and 1 when
+    count_text is True, like the A-suffixed functions); direct arguments are
+    coerced. Returns an ExcelError if any argument is an error.
+    """
+    numbers = []
+    for arg in args:
+        if isinstance(arg, RangeRef):
+            for value in engine.range_values(arg):
+                if isinstance(value, ExcelError):
+                    return value
+                if isinstance(value, bool):
+                    if count_text:
+                        numbers.append(float(value))
+                elif isinstance(value, (int, float)):
+                    numbers.append(value)
+                elif count_text and isinstance(value, str):
+                    numbers.append(0.0)
+        elif arg is not None:
+            number = _to_number(arg)
+            if isinstance(number, ExcelError):
+                return number
+            numbers.append(number)
+    return numbers
+
+
+def _aggregate(reducer, count_text=False, empty=0.0):
+    def function(engine, args):
+        numbers = _numbers(engine, args, count_text)
+        if isinstance(numbers, ExcelError):
+            return numbers
+        return reducer(numbers) if numbers else empty
+    return function
+
+
+def _scalar(function):
+    """Wrap a function of plain numbers with coercion and error propagation"""
+    def wrapper(engine, args):
+        numbers = []
+        for arg in args:
+            if isinstance(arg, RangeRef):
+                return VALUE_ERROR
+            number = _to_number(arg)
+            if isinstance(number, ExcelError):
+                return number
+            numbers.append(number)
+        try:
+            return function(*numbers)
+        except (TypeError, ValueError, OverflowError):
+            return VALUE_ERROR
+    return wrapper
+
+
+def _round(number, digits=0):
+    """ROUND rounds half away from zero"""
+    factor = 10 ** int(digits)
+    return math.copysign(math.floor(abs(number) * factor + 0.5) / factor, number)
+
+
+def _imabs(engine, args):
+    if len(args) != 1 or isinstance(args[0], RangeRef):
+        return VALUE_ERROR
+    value = args[0]
+    if isinstance(value, ExcelError):
+        return value
+    if isinstance(value, str):
+        try:
+            return abs(complex(value.replace('i', 'j')))
+        except ValueError:
+            return NUM_ERROR
+    return abs(_to_number(value))
+
+
+def _and(engine, args):
+    result = True
+    for arg in args:
+        values = engine.range_values(arg) if isinstance(arg, RangeRef) else [arg]
+        for value in values:
+            if value is None:
+                continue
+            flag = _to_bool(value)
+            if isinstance(flag, ExcelError):
+                return flag
+            result = result and flag
+    return result
+
+
+def _or(engine, args):
+    result = False
+    for arg in args:
+        values = engine.range_values(arg) if isinstance(arg, RangeRef) else [arg]
+        for value in values:
+            if value is None:
+                continue
+            flag = _to_bool(value)
+            if isinstance(flag, ExcelError):
+                return flag
+            result = result or flag
+    return result
+
+
+def _vlookup(engine, args):
+    if len(args) not in (3, 4) or not isinstance(args[1], RangeRef):
+        return VALUE_ERROR
+    lookup, table, index = args[0], args[1], _to_number(args[2])
+    if isinstance(lookup, ExcelError):
+        return lookup
+    if isinstance(index, ExcelError):
+        return index
+    approximate = len(args) == 3 or _to_bool(args[3]) is True
+    col = table.first_col + int(index) - 1
+    if index < 1 or col > table.last_col:
+        return REF_ERROR
+
+    match_row = None
+    for row, value in engine.column_values(table.sheet, table.first_col, table.first_row, table.last_row):
+        if approximate:
+            if value is not None and _compare_key(value)[0] == _compare_key(lookup)[0] \
+                    and _compare('<=', value, lookup) is True:
+                match_row = row
+        elif value is not None and _compare('=', value, lookup) is True:
+            match_row = row
+            break
+    if match_row is None:
+        return NA_ERROR
+    return engine.cell_value(table.sheet, match_row, col)
+
+
+def _match(engine, args):
+    if len(args) not in (2, 3) or not isinstance(args[1], RangeRef):
+        return NA_ERROR
+    lookup, table = args[0], args[1]
+    if isinstance(lookup, ExcelError):
+        return lookup
+    match_type = 1 if len(args) == 2 else _to_number(args[2])
+    if isinstance(match_type, ExcelError):
+        return match_type
+
+    # Sorted-lookup modes behave like Excel's binary search on well formed
+    # data: the last value of the same type on the right side of the lookup
+    position = None
+    for row, value in engine.column_values(table.sheet, table.first_col, table.first_row, table.last_row):
+        if value is None or isinstance(value, ExcelError):
+            continue
+        same_type = _compare_key(value)[0] == _compare_key(lookup)[0]
+        if match_type == 0:
+            if _compare('=', value, lookup) is True:
+                position = row
+                break
+        elif same_type and _compare('<=' if match_type > 0 else '>=', value, lookup) is True:
+            position = row
+    if position is None:
+        return NA_ERROR
+    return float(position - table.first_row + 1)
+
+
+def _indirect(engine, args, sheet):
+    if not args or isinstance(args[0], ExcelError):
+        return args[0] if args else REF_ERROR
+    try:
+        node = _parse_reference(_to_text(args[0]).strip(), sheet)
+    except FormulaSyntaxError:
+        return REF_ERROR
+    if node[0] == 'cell':
+        if engine._indirect_reads is not None:
+            engine._indirect_reads.append(RangeRef(node[1], node[2], node[3], node[2], node[3]))
+        return engine.cell_value(node[1], node[2], node[3])
+    if node[0] == 'range':
+        ref = RangeRef(*node[1:])
+        if engine._indirect_reads is not None:
+            engine._indirect_reads.append(ref)
+        return ref
+    return node[1]
+
+
+def _reads(refs, key):
+    """True when a cell key lies in one of the ranges"""
+    sheet, row, col = key
+    return any(ref.sheet == sheet and ref.first_col <= col <= ref.last_col and ref.first_row <= row
+               and (ref.last_row is None or row <= ref.last_row) for ref in refs)
+
+
+def _char(number):
+    return chr(int(number))
+
+
+FUNCTIONS = {
+    'SUM': _aggregate(sum),
+    'AVERAGE': _aggregate(lambda numbers: sum(numbers) / len(numbers), empty=DIV_ERROR),
+    'MAX': _aggregate(max),
+    'MIN': _aggregate(min),
+    'MAXA': _aggregate(max, count_text=True),
+    'MINA': _aggregate(min, count_text=True),
+    'COUNT': _aggregate(len),
+    'ABS': _scalar(abs),
+    'ROUND': _scalar(_round),
+    'TIME': _scalar(lambda hours, minutes, seconds: (hours * 3600 + minutes * 60 + seconds) % 86400 / 86400),
+    'CHAR': _scalar(_char),
+    'IMABS': _imabs,
+    'AND': _and,
+    'OR': _or,
+    'VLOOKUP': _vlookup,
+    'MATCH': _match,
+}
+
+# Functions that treat referenced cells like ranges rather than direct values
+REFERENCE_AGGREGATES = {'SUM', 'AVERAGE', 'MAX', 'MIN', 'MAXA', 'MINA', 'COUNT'}
+
+
+# ---------------------------------------------------------------------------
+# Compilation
+# ---------------------------------------------------------------------------
+
+def _compile(node, engine, sheet):
+    """Turn an AST into a closure returning the node's value"""
+    kind = node[0]
+
+    if kind in ('num', 'str', 'bool', 'err'):
+        value = node[1]
+        return lambda: value
+    if kind == 'blank':
+        return lambda: None
+    if kind == 'cell':
+        key = (node[1], node[2], node[3])
+        values = engine.values
+        return lambda: values.get(key)
+    if kind == 'range':
+        ref = RangeRef(*node[1:])
+        return lambda: ref
+    if kind == 'neg':
+        operand = _compile(node[1], engine, sheet)
+        return lambda: _arithmetic('-', 0.0, operand())
+    if kind == 'pos':
+        return _compile(node[1], engine, sheet)
+
+    if kind == 'bin':
+        operator = node[1]
+        left = _compile(node[2], engine, sheet)
+        right = _compile(node[3], engine, sheet)
+        if operator in _COMPARISONS:
+            return lambda: _compare(operator, _scalar_value(left()), _scalar_value(right()))
+        if operator == '&':
+            def concatenate():
+                a, b = _scalar_value(left()), _scalar_value(right())
+                if isinstance(a, ExcelError):
+                    return a
+                if isinstance(b, ExcelError):
+                    return b
+                return _to_text(a) + _to_text(b)
+            return concatenate
+        return lambda: _arithmetic(operator, _scalar_value(left()), _scalar_value(right()))
+
+    name, arg_nodes = node[1], node[2]
+    if name in REFERENCE_AGGREGATES:
+        # A cell passed by reference is read like a one-cell range, so text
+        # and booleans in it are skipped as Excel does
+        arg_nodes = [('range', arg[1], arg[2], arg[3], arg[2], arg[3]) if arg[0] == 'cell' else arg
+                     for arg in arg_nodes]
+    args = [_compile(arg, engine, sheet) for arg in arg_nodes]
+
+    if name == 'IF':
+        if not 1 < len(args) < 4:
+            return lambda: VALUE_ERROR
+        condition = args[0]
+        when_true = args[1]
+        when_false = args[2] if len(args) == 3 else (lambda: False)
+
+        def if_function():
+            flag = _to_bool(_scalar_value(condition()))
+            if isinstance(flag, ExcelError):
+                return flag
+            return when_true() if flag else when_false()
+        return if_function
+    if name == 'IFERROR':
+        if len(args) != 2:
+            return lambda: VALUE_ERROR
+        value, fallback = args
+
+        def iferror_function():
+            result = value()
+            return fallback() if isinstance(result, ExcelError) else result
+        return iferror_function
+    if name == 'ISBLANK':
+        if len(args) != 1:
+            return lambda: VALUE_ERROR
+        operand = args[0]
+        return lambda: operand() is None
+    if name == 'NOT':
+        if len(args) != 1:
+            return lambda: VALUE_ERROR
+        operand = args[0]
+
+        def not_function():
+            flag = _to_bool(_scalar_value(operand()))
+            return flag if isinstance(flag, ExcelError) else not flag
+        return not_function
+    if name == 'INDIRECT':
+        return lambda: _indirect(engine, [arg() for arg in args], sheet)
+
+    function = FUNCTIONS.get(name)
+    if function is None:
+        return lambda: NAME_ERROR
+    return lambda: function(engine, [arg() for arg in args])
+
+
+def _scalar_value(value):
+    """A range used where a single value is expected is an error"""
+    return VALUE_ERROR if isinstance(value, RangeRef) else value
+
+
+class Formula:
+    """A parsed formula with its precedents"""
+
+    __slots__ = ('text', 'function', 'cells', 'ranges', 'volatile', 'error')
+
+    def __init__(self, text, function, cells, ranges, volatile, error=None):
+        self.text = text
+        self.function = function
+        self.cells = cells
+        self.ranges = ranges
+        self.volatile = volatile
+        self.error = error
+
+
+# ---------------------------------------------------------------------------
+# Engine
+# ---------------------------------------------------------------------------
+
+class FormulaEngine:
+    """
+    Cell dependency graph with incremental recalculation
+
+    Cells are keyed by (sheet, row, col). Changing a value marks the formulas
+    reading it as pending; recalculate() then evaluates pending formulas in
+    topological order and only propagates further when a result changes.
+    INDIRECT makes a formula volatile, so it is evaluated on every recalc,
+    and again when a cell it read changes later in the same recalc.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.formulas = {}
+        self.parse_errors = {}
+        self.circular = set()
+        self.last_recalc_count = 0
+        self._dependents = {}
+        self._column_dependents = {}
+        self._columns = {}
+        self._order = {}
+        self._pending = set()
+        self._graph_stale = True
+        # What INDIRECT reads while a volatile formula is being evaluated
+        self._indirect_reads = None
+
+    @classmethod
+    def from_file(cls, path=FORMULAS_FILE):
+        """Build an engine from the formule_estratte.txt dump"""
+        engine = cls()
+        sheet = None
+        with open(path, encoding='utf-8') as handle:
+            for line in handle:
+                line = line.strip()
+                if line.startswith('--- Foglio:'):
+                    sheet = line[len('--- Foglio:'):].rstrip('-').strip()
+                elif line.startswith('Cella ') and sheet is not None:
+                    ref, _, text = line[len('Cella '):].partition(': ')
+                    engine.set_formula(sheet, ref, text)
+        return engine
+
+    # -- editing -------------------------------------------------------------
+
+    def set_formula(self, sheet, ref, text):
+        """Add or replace the formula of a cell"""
+        key = (sheet, *parse_cell(ref))
+        self._remove_formula(key)
+        cells, ranges = set(), []
+        try:
+            ast = parse_formula(text, sheet)
+            volatile = _references(ast, cells, ranges)
+            formula = Formula(text, _compile(ast, self, sheet), cells, ranges, volatile)
+        except FormulaSyntaxError as e:
+            self.parse_errors[key] = str(e)
+            formula = Formula(text, lambda: NAME_ERROR, set(), [], False, error=str(e))
+
+        self.formulas[key] = formula
+        self._track(key)
+        for cell in cells:
+            self._dependents.setdefault(cell, set()).add(key)
+            self._track(cell)
+        for ref_range in ranges:
+            for column in range(ref_range.first_col, ref_range.last_col + 1):
+                if ref_range.last_row is None:
+                    self._column_dependents.setdefault((ref_range.sheet, column), set()).add(key)
+                else:
+                    for row in range(ref_range.first_row, ref_range.last_row + 1):
+                        self._dependents.setdefault((ref_range.sheet, row, column), set()).add(key)
+        self._graph_stale = True
+
+    def set_value(self, sheet, ref, value):
+        """Set an input value, replacing any formula in the cell"""
+        key = (sheet, *parse_cell(ref))
+        if key in self.formulas:
+            self._remove_formula(key)
+            self._graph_stale = True
+        if self.values.get(key) == value and type(self.values.get(key)) is type(value):
+            return
+        if value is None:
+            self.values.pop(key, None)
+        else:
+            self.values[key] = value
+        self._track(key)
+        self._pending.update(self._dependents_of(key))
+
+    def set_values(self, values):
+        """Set several inputs at once from a {'Sheet!A1': value} mapping"""
+        for name, value in values.items():
+            sheet, ref = name.rsplit('!', 1)
+            self.set_value(sheet, ref, value)
+
+    # -- reading -------------------------------------------------------------
+
+    def get_value(self, sheet, ref):
+        """Value of a cell, recalculating pending formulas first"""
+        self.recalculate()
+        return self.values.get((sheet, *parse_cell(ref)))
+
+    def get_sheet(self, sheet):
+        """All known values of a sheet as an {'A1': value} mapping"""
+        self.recalculate()
+        return {cell_name(row, col): value for (name, row, col), value in self.values.items()
+                if name == sheet}
+
+    def cell_value(self, sheet, row, col):
+        """Current value of a cell without recalculating (used by functions)"""
+        return self.values.get((sheet, row, col))
+
+    def range_values(self, ref_range):
+        """Values of the known cells of a range, row by row"""
+        if ref_range.last_row is None:
+            return [value for col in range(ref_range.first_col, ref_range.last_col + 1)
+                    for _, value in self.column_values(ref_range.sheet, col, 1, None)]
+        get = self.values.get
+        return [get((ref_range.sheet, row, col))
+                for row in range(ref_range.first_row, ref_range.last_row + 1)
+                for col in range(ref_range.first_col, ref_range.last_col + 1)]
+
+    def column_values(self, sheet, col, first_row, last_row):
+        """(row, value) pairs of the known cells of a column, in row order"""
+        rows = self._columns.get((sheet, col), ())
+        get = self.values.get
+        return [(row, get((sheet, row, col))) for row in sorted(rows)
+                if row >= first_row and (last_row is None or row <= last_row)]
+
+    # -- evaluation ----------------------------------------------------------
+
+    def recalculate(self):
+        """
+        Evaluate pending formulas and everything that changes downstream
+
+        Returns the number of formulas evaluated.
+        """
+        if self._graph_stale:
+            self._build_order()
+            self._pending.update(self.formulas)
+        self._pending.update(key for key, formula in self.formulas.items() if formula.volatile)
+        if not self._pending:
+            self.last_recalc_count = 0
+            return 0
+
+        order = self._order
+        queue = [(order[key], key) for key in self._pending if key in self.formulas]
+        heapq.heapify(queue)
+        queued = set(self._pending)
+        self._pending = set()
+        evaluated = 0
+        # Cells and ranges INDIRECT read in this pass, per volatile formula,
+        # and how often each was evaluated. They are not in the graph, so a
+        # volatile formula is queued again when one of them changes later.
+        targets = {}
+        runs = {}
+
+        while queue:
+            _, key = heapq.heappop(queue)
+            queued.discard(key)
+            formula = self.formulas[key]
+            if formula.volatile and key not in self.circular:
+                self._indirect_reads = targets[key] = []
+                runs[key] = runs.get(key, 0) + 1
+            value = CIRCULAR_ERROR if key in self.circular else formula.function()
+            self._indirect_reads = None
+            if isinstance(value, RangeRef):
+                value = VALUE_ERROR
+            elif value is None:
+                # A formula pointing at a blank cell shows 0
+                value = 0.0
+            evaluated += 1
+
+            previous = self.values.get(key)
+            if previous == value and type(previous) is type(value):
+                continue
+            self.values[key] = value
+            readers = [reader for reader, reads in targets.items()
+                       if reader != key and runs[reader] < MAX_VOLATILE_RUNS and _reads(reads, key)]
+            for dependent in self._dependents_of(key).union(readers):
+                if dependent not in queued and dependent in self.formulas:
+                    queued.add(dependent)
+                    heapq.heappush(queue, (order[dependent], dependent))
+
+        self.last_recalc_count = evaluated
+        return evaluated
+
+    # -- graph ---------------------------------------------------------------
+
+    def _track(self, key):
+        self._columns.setdefault((key[0], key[2]), set()).add(key[1])
+
+    def _dependents_of(self, key):
+        dependents = self._dependents.get(key, set())
+        column = self._column_dependents.get((key[0], key[2]))
+        return dependents | column if column else dependents
+
+    def _remove_formula(self, key):
+        formula = self.formulas.pop(key, None)
+        if formula is None:
+            return
+        self.parse_errors.pop(key, None)
+        for cell in formula.cells:
+            self._dependents.get(cell, set()).discard(key)
+        for ref_range in formula.ranges:
+            for column in range(ref_range.first_col, ref_range.last_col + 1):
+                if ref_range.last_row is None:
+                    self._column_dependents.get((ref_range.sheet, column), set()).discard(key)
+                else:
+                    for row in range(ref_range.first_row, ref_range.last_row + 1):
+                        self._dependents.get((ref_range.sheet, row, column), set()).discard(key)
+
+    def _build_order(self):
+        """Topologically sort the formulas (Kahn's algorithm)"""
+        indegree = {key: 0 for key in self.formulas}
+        edges = {}
+        for key in self.formulas:
+            for dependent in self._dependents_of(key):
+                if dependent in indegree:
+                    edges.setdefault(key, []).append(dependent)
+                    indegree[dependent] += 1
+
+        ready = [key for key, degree in indegree.items() if degree == 0]
+        order = {}
+        while ready:
+            key = ready.pop()
+            order[key] = len(order)
+            for dependent in edges.get(key, ()):
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    ready.append(dependent)
+
+        # Whatever is left sits on a circular reference
+        self.circular = {key for key in self.formulas if key not in order}
+        for key in self.circular:
+            order[key] = len(order)
+        self._order = order
+        self._graph_stale = False
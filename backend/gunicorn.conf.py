@@ -0,0 +1,79 @@
+"""
+Gunicorn configuration for the team server
+  gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is imported once in the master (schema creation and migrations run
+a single time), then forked into workers. Every setting can be overridden
+from the environment:
+  WEB_CONCURRENCY      worker processes (default: 2 x CPU cores + 1 on
+                       PostgreSQL, 1 on SQLite)
+  GUNICORN_THREADS     threads per worker for ordinary requests (default 8)
+  LIVE_MAX_STREAMS     live (SSE) streams per worker (default 32); each open
+                       page holds a thread, so a worker runs
+                       GUNICORN_THREADS + LIVE_MAX_STREAMS threads and
+                       answers 503 to further /live requests
+  GUNICORN_TIMEOUT     seconds a worker may stop responding before it is restarted
+  GUNICORN_GRACEFUL_TIMEOUT  seconds to finish requests on reload / stop
+Individual requests are bounded by DB_STATEMENT_TIMEOUT_MS (PostgreSQL) and
+the reverse proxy's read timeout.
+
+Restart the workers without dropping requests: kill -HUP <master pid>.
+The app is preloaded, so new code needs a new master: kill -USR2 <master pid>,
+then kill -TERM <old master pid> once the new workers are up.
+"""
+
+import multiprocessing
+import os
+
+from config import database_url
+from live import LIVE_MAX_STREAMS
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '5000')}"
+# SQLite serializes writes and live events cannot cross processes without
+# PostgreSQL, so a SQLite server gets one (threaded) worker by default
+_sqlite = database_url().startswith('sqlite')
+workers = _env_int('WEB_CONCURRENCY', 1 if _sqlite else multiprocessing.cpu_count() * 2 + 1)
+# Threaded workers; a Server-Sent Events stream keeps its thread while the
+# page is open, so the live streams get threads of their own and can never
+# take the ones ordinary requests are served from
+worker_class = 'gthread'
+threads = _env_int('GUNICORN_THREADS', 8) + LIVE_MAX_STREAMS
+
+preload_app = True
+timeout = _env_int('GUNICORN_TIMEOUT', 60)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+
+# Recycle workers now and then to bound memory growth
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 10000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 1000)
+
+pidfile = os.environ.get('GUNICORN_PIDFILE') or None
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def when_ready(server):
+    """Create tables and apply migrations in the master, before any worker starts"""
+    from app import init_database
+
+    init_database()
+
+
+def post_fork(server, worker):
+    """Give each worker its own database connections and live event state"""
+    from app import app
+    from models import db
+    from live import broker, start_relay
+
+    with app.app_context():
+        # Connections opened by the master must not be shared across processes
+        db.engine.dispose(close=False)
+        broker.after_fork()
+        start_relay(db.engine)
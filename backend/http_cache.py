@@ -0,0 +1,120 @@
+"""
+HTTP caching for GET routes
+Each cached route declares the rows its response is built from. Before the
+view runs, one aggregate query reads the latest updated_at and the row
+count of each part. Those values give a strong ETag:
+- A request whose If-None-Match still matches gets 304 Not Modified,
+  without running the view.
+- Otherwise a server-side cache keyed on the ETag returns the encoded body
+  without running the view.
+- Writes drop the cached responses built from the tables they touch.
+
+There is no Last-Modified: deleting a row leaves the latest updated_at
+unchanged, so If-Modified-Since would answer 304 for a changed response.
+"""
+
+import hashlib
+import os
+from functools import wraps
+
+from flask import Response, make_response, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+
+from cache import LRUCache
+from models import db
+
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 256))
+# Larger (streamed) responses still get validators but are not stored
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 1024 * 1024))
+
+response_cache = LRUCache(RESPONSE_CACHE_SIZE)
+
+
+def subtree_state(parts):
+    """
+    Latest updated_at and row count of each part, in a single query
+
+    Args:
+        parts: List of (model, [where clauses]) the response is built from
+
+    Returns:
+        Fingerprint string that changes with any insert, update or delete
+    """
+    columns = []
+    for model, filters in parts:
+        columns.append(db.select(db.func.max(model.updated_at)).where(*filters).scalar_subquery())
+        columns.append(db.select(db.func.count()).select_from(model).where(*filters).scalar_subquery())
+    values = db.session.execute(db.select(*columns)).one()
+    return '|'.join(
+        f'{model.__tablename__}:{latest}:{count}'
+        for (model, _), latest, count in zip(parts, values[0::2], values[1::2])
+    )
+
+
+def conditional(parts_for):
+    """
+    Decorate a route so its GET responses carry an ETag and are answered
+    with 304, or from the response cache, when unchanged
+
+    Args:
+        parts_for: Function of the route arguments returning the
+            (model, [where clauses]) parts the response is built from
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if request.method != 'GET':
+                return view(**kwargs)
+
+            parts = parts_for(**kwargs)
+            fingerprint = subtree_state(parts)
+            etag = hashlib.sha1(f'{request.full_path}|{fingerprint}'.encode()).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                cached = response_cache.get(etag)
+                if cached is not None:
+                    response = Response(cached[0], mimetype=cached[1])
+                else:
+                    response = _store(etag, parts, view(**kwargs))
+
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def _store(etag, parts, result):
+    """Cache a successful view result small enough to keep in memory"""
+    response = make_response(result)
+    if response.status_code == 200 and not response.is_streamed:
+        body = response.get_data()
+        if len(body) <= RESPONSE_CACHE_MAX_BYTES:
+            tags = {model.__tablename__ for model, _ in parts}
+            response_cache.set(etag, (body, response.mimetype), tags)
+    return response
+
+
+def _invalidate_tables(tables):
+    for table in tables:
+        response_cache.invalidate(table)
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def _invalidate_after_flush(session, flush_context):
+    tables = {instance.__tablename__ for instance in session.new}
+    tables.update(instance.__tablename__ for instance in session.dirty if session.is_modified(instance))
+    tables.update(instance.__tablename__ for instance in session.deleted)
+    _invalidate_tables(tables)
+
+
+@event.listens_for(OrmSession, 'do_orm_execute')
+def _invalidate_after_statement(orm_execute_state):
+    # Bulk INSERT / UPDATE / DELETE statements bypass the flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            _invalidate_tables([table.name])
@@ -0,0 +1,132 @@
+"""
+Bulk lap import
+Validates lap records one by one and inserts the valid ones in chunked
+executemany batches, all inside the caller's transaction
+"""
+
+import json
+from datetime import datetime
+
+from calculations import RacingCalculations
+from models import db, Lap, SessionLapSummary
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+TEXT_FIELDS = ('tire_set', 'lap_status', 'notes')
+
+# Range of an Integer column (32-bit on PostgreSQL); larger values fail in
+# the driver and would abort the whole batch
+INTEGER_MIN, INTEGER_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def lap_row(session_id, data):
+    """
+    Build a laps table row from a lap record
+
+    Args:
+        session_id: Session the lap belongs to
+        data: Lap fields as sent to POST /api/sessions/<id>/laps
+
+    Returns:
+        Dictionary of column values, including the millisecond columns
+    """
+    if not isinstance(data, dict):
+        raise ValueError('lap must be an object')
+    lap_number = data.get('lap_number')
+    if isinstance(lap_number, bool) or not isinstance(lap_number, int):
+        raise ValueError('lap_number must be an integer')
+    if not INTEGER_MIN <= lap_number <= INTEGER_MAX:
+        raise ValueError('lap_number is out of range')
+
+    row = {'session_id': session_id, 'lap_number': lap_number, 'created_at': datetime.utcnow()}
+    for field, ms_field in Lap.TIME_COLUMNS.items():
+        value = data.get(field)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f'{field} must be a string')
+        row[field] = value
+        row[ms_field] = RacingCalculations.time_to_ms(value)
+        if row[ms_field] is not None and not INTEGER_MIN <= row[ms_field] <= INTEGER_MAX:
+            raise ValueError(f'{field} is out of range')
+
+    fuel = data.get('fuel_consumed')
+    if fuel is not None and (isinstance(fuel, bool) or not isinstance(fuel, (int, float))):
+        raise ValueError('fuel_consumed must be a number')
+    row['fuel_consumed'] = fuel
+    for field in TEXT_FIELDS:
+        value = data.get(field)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f'{field} must be a string')
+        row[field] = value
+    return row
+
+
+def _lines(stream, block_size=1 << 16):
+    """Split a binary stream into lines, reading it in large blocks"""
+    pending = b''
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+def parse_ndjson(stream):
+    """Yield one lap record per non-empty line of a binary stream, or the ValueError raised parsing it"""
+    for line in _lines(stream):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f'invalid JSON: {e}')
+
+
+def insert_laps(session_id, records, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Insert lap records without committing
+
+    Invalid records are reported and skipped; the others are inserted.
+    The session summary is rebuilt once at the end.
+
+    Args:
+        session_id: Session the laps belong to
+        records: Iterable of lap dictionaries (or exceptions for records that
+            could not be decoded); consumed lazily, so it may be a stream
+        chunk_size: Rows per executemany batch
+
+    Returns:
+        (laps inserted, records rejected, list of {'index', 'error'} for
+        the first MAX_REPORTED_ERRORS rejected records)
+    """
+    statement = Lap.__table__.insert()
+    inserted = rejected = 0
+    errors = []
+    chunk = []
+
+    for index, record in enumerate(records):
+        try:
+            if isinstance(record, Exception):
+                raise record
+            chunk.append(lap_row(session_id, record))
+        except ValueError as e:
+            rejected += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'index': index, 'error': str(e)})
+            continue
+        if len(chunk) >= chunk_size:
+            db.session.execute(statement, chunk)
+            inserted += len(chunk)
+            chunk = []
+
+    if chunk:
+        db.session.execute(statement, chunk)
+        inserted += len(chunk)
+
+    if inserted:
+        SessionLapSummary.for_session(session_id).rebuild()
+    return inserted, rejected, errors
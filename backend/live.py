@@ -0,0 +1,274 @@
+"""
+Live session updates over Server-Sent Events
+Write routes publish each change once (a lap created, updated or deleted,
+tire readings added) to the session's channel. The event is encoded a
+single time and kept in a small ring buffer; every connected client is fed
+from that buffer, so the number of subscribers never adds database queries.
+
+Event ids are "<epoch>-<sequence>". A client reconnecting with
+Last-Event-ID gets the events it missed replayed from the buffer; when they
+are no longer there (or the server restarted) it gets a "reset" event and
+should reload the session.
+
+Each worker process has its own broker; on PostgreSQL, start_relay shares
+the events of every worker through LISTEN/NOTIFY.
+"""
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from collections import deque
+
+from sqlalchemy import text
+
+import serializers
+
+logger = logging.getLogger(__name__)
+
+LIVE_BUFFER_SIZE = int(os.environ.get('LIVE_BUFFER_SIZE', 256))
+LIVE_HEARTBEAT_SECONDS = float(os.environ.get('LIVE_HEARTBEAT_SECONDS', 15))
+# Bulk inserts larger than this publish "laps.reload" instead of the rows
+LIVE_BULK_MAX_ROWS = int(os.environ.get('LIVE_BULK_MAX_ROWS', 500))
+# Open streams per worker process. Each one holds a server thread for as long
+# as the page is open, so gunicorn.conf.py adds this many threads on top of
+# GUNICORN_THREADS; further pages get 503 and retry later
+LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', 32))
+
+# Client reconnect delay, sent once per connection
+RETRY_MS = 3000
+# Retry-After of the 503 sent when every stream slot is taken
+RETRY_WHEN_FULL_SECONDS = 30
+
+# PostgreSQL channel relaying events between worker processes
+RELAY_CHANNEL = 'live_events'
+# NOTIFY payloads must stay under 8000 bytes
+RELAY_MAX_BYTES = 7000
+
+
+class Channel:
+    """Ring buffer of encoded events for one session"""
+
+    def __init__(self, size):
+        self.events = deque(maxlen=size)
+        self.sequence = 0
+        self.subscribers = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+
+class LiveBroker:
+    """
+    In-process fan-out of session events
+
+    Args:
+        buffer_size: Events kept per session for resumption
+        heartbeat: Seconds between keep-alive comments on an idle stream
+        max_streams: Streams open at once in this process
+    """
+
+    def __init__(self, buffer_size=LIVE_BUFFER_SIZE, heartbeat=LIVE_HEARTBEAT_SECONDS,
+                 max_streams=LIVE_MAX_STREAMS):
+        self.buffer_size = buffer_size
+        self.heartbeat = heartbeat
+        self.max_streams = max_streams
+        self.streams = 0
+        # Changes on every start, so ids from before a restart are detected
+        self.epoch = uuid.uuid4().hex[:8]
+        self.channels = {}
+        self.lock = threading.Lock()
+        # Called with (session_id, kind, payload) to share events with other processes
+        self.forward = None
+
+    def after_fork(self):
+        """Start a worker process with its own ids and no inherited channels"""
+        self.epoch = uuid.uuid4().hex[:8]
+        self.channels = {}
+        self.lock = threading.Lock()
+        self.forward = None
+        self.streams = 0
+
+    def reserve_stream(self):
+        """Claim a stream slot; False when max_streams are already open"""
+        with self.lock:
+            if self.streams >= self.max_streams:
+                return False
+            self.streams += 1
+            return True
+
+    def release_stream(self):
+        """Give back a slot taken by reserve_stream"""
+        with self.lock:
+            self.streams -= 1
+
+    def _channel(self, session_id):
+        with self.lock:
+            channel = self.channels.get(session_id)
+            if channel is None:
+                channel = self.channels[session_id] = Channel(self.buffer_size)
+            return channel
+
+    def publish(self, session_id, kind, data):
+        """
+        Send an event to everyone following a session
+
+        Args:
+            session_id: Session the change belongs to
+            kind: Event name (lap.created, lap.deleted, ...)
+            data: JSON-serializable payload
+        """
+        payload = serializers.dumps(data)
+        self._append(session_id, kind, payload)
+        if self.forward is not None:
+            self.forward(session_id, kind, payload)
+
+    def receive(self, session_id, kind, payload):
+        """Deliver an event published by another process"""
+        self._append(session_id, kind, payload)
+        if kind == 'session.deleted':
+            self._drop(session_id)
+
+    def _append(self, session_id, kind, payload):
+        channel = self._channel(session_id)
+        with channel.condition:
+            channel.sequence += 1
+            frame = (f'id: {self.epoch}-{channel.sequence}\nevent: {kind}\ndata: '.encode()
+                     + payload + b'\n\n')
+            channel.events.append((channel.sequence, frame))
+            channel.condition.notify_all()
+
+    def close(self, session_id):
+        """Tell subscribers a session is gone and drop its channel"""
+        self.publish(session_id, 'session.deleted', {'session_id': session_id})
+        self._drop(session_id)
+
+    def _drop(self, session_id):
+        with self.lock:
+            channel = self.channels.pop(session_id, None)
+        if channel is not None:
+            with channel.condition:
+                channel.closed = True
+                channel.condition.notify_all()
+
+    def _resume_point(self, channel, last_event_id):
+        """Sequence to continue after, or None when the client must reload"""
+        epoch, _, sequence = (last_event_id or '').partition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        oldest = channel.events[0][0] if channel.events else channel.sequence + 1
+        if sequence > channel.sequence or sequence < oldest - 1:
+            return None
+        return sequence
+
+    def _reset(self, channel):
+        return (f'id: {self.epoch}-{channel.sequence}\nevent: reset\ndata: {{}}\n\n').encode()
+
+    def subscribe(self, session_id, last_event_id=None):
+        """
+        Event stream for one client
+
+        Args:
+            session_id: Session to follow
+            last_event_id: Last-Event-ID sent by a reconnecting client
+
+        Yields:
+            Server-Sent Events frames as bytes
+        """
+        channel = self._channel(session_id)
+        with channel.condition:
+            channel.subscribers += 1
+            cursor = channel.sequence
+            first = f'retry: {RETRY_MS}\n\n'.encode()
+            if last_event_id:
+                resume = self._resume_point(channel, last_event_id)
+                if resume is None:
+                    first += self._reset(channel)
+                else:
+                    cursor = resume
+        try:
+            yield first
+            while True:
+                with channel.condition:
+                    if channel.sequence == cursor:
+                        channel.condition.wait(self.heartbeat)
+                    if channel.events and channel.events[0][0] > cursor + 1:
+                        # Fell behind the ring buffer
+                        pending = [self._reset(channel)]
+                    else:
+                        pending = [frame for sequence, frame in channel.events if sequence > cursor]
+                    cursor = channel.sequence
+                    closed = channel.closed
+                yield b''.join(pending) if pending else b': keepalive\n\n'
+                if closed:
+                    return
+        finally:
+            with channel.condition:
+                channel.subscribers -= 1
+
+
+broker = LiveBroker()
+
+
+def start_relay(engine, live_broker=broker):
+    """
+    Share events between worker processes through PostgreSQL LISTEN/NOTIFY
+
+    Without a relay each worker only pushes the writes it served itself.
+    SQLite has no equivalent, so a SQLite server should run one threaded
+    worker. Subscribers resuming on another worker get a reset event.
+
+    Args:
+        engine: SQLAlchemy engine of the app database
+        live_broker: Broker to relay for
+    """
+    if engine.dialect.name != 'postgresql':
+        return None
+    origin = live_broker.epoch
+
+    def forward(session_id, kind, payload):
+        if len(payload) > RELAY_MAX_BYTES:
+            kind, payload = 'laps.reload', serializers.dumps({'session_id': session_id})
+        message = serializers.dumps({'origin': origin, 'session_id': session_id, 'kind': kind})
+        message = message[:-1] + b',"data":' + payload + b'}'
+        with engine.connect() as connection:
+            connection.execute(text('SELECT pg_notify(:channel, :message)'),
+                               {'channel': RELAY_CHANNEL, 'message': message.decode()})
+            connection.commit()
+
+    def listen():
+        while True:
+            try:
+                # A dedicated connection, kept out of the pool while it listens
+                connection = engine.raw_connection()
+                connection.detach()
+                driver = connection.driver_connection
+                try:
+                    driver.autocommit = True
+                    cursor = driver.cursor()
+                    cursor.execute(f'LISTEN {RELAY_CHANNEL}')
+                    cursor.close()
+                    while True:
+                        if select.select([driver], [], [], 30)[0]:
+                            driver.poll()
+                            while driver.notifies:
+                                _relay_receive(live_broker, origin, driver.notifies.pop(0).payload)
+                finally:
+                    connection.close()
+            except Exception:
+                logger.exception('Live event relay lost its connection, retrying')
+                time.sleep(5)
+
+    live_broker.forward = forward
+    thread = threading.Thread(target=listen, name='live-relay', daemon=True)
+    thread.start()
+    return thread
+
+
+def _relay_receive(live_broker, origin, message):
+    message = json.loads(message)
+    if message['origin'] != origin:
+        live_broker.receive(message['session_id'], message['kind'], serializers.dumps(message['data']))
@@ -0,0 +1,134 @@
+"""
+Schema migrations
+db.create_all() only creates missing tables; columns and indexes added to
+existing tables are applied here. Each migration runs once and is recorded
+in the schema_migrations table.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from calculations import RacingCalculations
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def _add_missing_columns(connection, table, columns):
+    """Add columns (name -> SQL type) that the table does not have yet"""
+    existing = {column['name'] for column in inspect(connection).get_columns(table)}
+    for name, column_type in columns.items():
+        if name not in existing:
+            connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}'))
+
+
+def _lap_time_milliseconds(connection):
+    """Integer millisecond copies of the lap and sector times"""
+    from models import Lap
+
+    _add_missing_columns(connection, 'laps', {column: 'INTEGER' for column in Lap.TIME_COLUMNS.values()})
+
+    # Backfill in batches so large histories do not have to fit in memory
+    text_columns = list(Lap.TIME_COLUMNS)
+    select = text(
+        f"SELECT id, {', '.join(text_columns)} FROM laps "
+        f"WHERE id > :after AND lap_time_ms IS NULL ORDER BY id LIMIT :limit"
+    )
+    update = text(
+        'UPDATE laps SET '
+        + ', '.join(f'{column} = :{column}' for column in Lap.TIME_COLUMNS.values())
+        + ' WHERE id = :id'
+    )
+    after = 0
+    while True:
+        rows = connection.execute(select, {'after': after, 'limit': BACKFILL_BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        connection.execute(update, [
+            dict({ms_column: RacingCalculations.time_to_ms(value)
+                  for ms_column, value in zip(Lap.TIME_COLUMNS.values(), row[1:])}, id=row[0])
+            for row in rows
+        ])
+        after = rows[-1][0]
+
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_laps_session_lap_time_ms ON laps (session_id, lap_time_ms)'
+    ))
+
+
+def _lap_keyset_index(connection):
+    """Index serving the (lap_number, id) keyset pages of a session's laps"""
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_laps_session_lap_number ON laps (session_id, lap_number, id)'
+    ))
+
+
+def _create_model_indexes(connection, names):
+    """Create the named indexes, as declared in models.py, if they are missing"""
+    from models import db
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in names:
+                index.create(connection, checkfirst=True)
+
+
+def _foreign_key_indexes(connection):
+    """Indexes for the per-event and per-session filters and tire set lookups"""
+    _create_model_indexes(connection, {
+        'ix_sessions_event_id', 'ix_laps_tire_set', 'ix_tire_data_session_id',
+        'ix_tire_data_tire_set', 'ix_engine_data_session_id', 'ix_setup_data_session_id'
+    })
+
+
+def _updated_at_columns(connection):
+    """updated_at on lap, tire, engine and setup rows, backfilled from created_at"""
+    for table in ('laps', 'tire_data', 'engine_data', 'setup_data'):
+        _add_missing_columns(connection, table, {'updated_at': 'TIMESTAMP'})
+        connection.execute(text(f'UPDATE {table} SET updated_at = created_at WHERE updated_at IS NULL'))
+    _create_model_indexes(connection, {'ix_laps_session_updated_at', 'ix_tire_data_session_updated_at'})
+
+
+def _session_closed_at(connection):
+    """closed_at on sessions, set when a session is closed and its telemetry pyramids built"""
+    _add_missing_columns(connection, 'sessions', {'closed_at': 'TIMESTAMP'})
+
+
+# (version, description, function) in the order they must run
+MIGRATIONS = [
+    (1, 'lap and sector times in milliseconds', _lap_time_milliseconds),
+    (2, 'lap keyset pagination index', _lap_keyset_index),
+    (3, 'indexes for foreign key filters and tire set lookups', _foreign_key_indexes),
+    (4, 'updated_at on lap, tire, engine and setup data', _updated_at_columns),
+    (5, 'session closed_at', _session_closed_at),
+]
+
+
+def run_migrations(db):
+    """
+    Apply every migration that has not run yet
+
+    Args:
+        db: Flask-SQLAlchemy instance (inside an app context)
+
+    Returns:
+        List of the versions applied
+    """
+    applied = []
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations '
+            '(version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at TIMESTAMP)'
+        ))
+        done = {row[0] for row in connection.execute(text('SELECT version FROM schema_migrations'))}
+        for version, description, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            migrate(connection)
+            connection.execute(
+                text('INSERT INTO schema_migrations (version, description, applied_at) '
+                     'VALUES (:version, :description, :applied_at)'),
+                {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+            )
+            applied.append(version)
+    return applied
@@ -1,5 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import validates
 from datetime import datetime
+from calculations import RacingCalculations
 
 db = SQLAlchemy()
 
@@ -51,14 +54,20 @@ class Session(db.Model):
     best_lap_time = db.Column(db.String(20))  # Best lap time
     session_status = db.Column(db.String(10))  # RF, FCY, SC, TFC
     notes = db.Column(db.Text)
+    closed_at = db.Column(db.DateTime)  # Set once the session is over; telemetry is then read-only
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_sessions_event_id', 'event_id', 'id'),
+    )
+    
     # Relationships
     tire_data = db.relationship('TireData', backref='session', lazy=True, cascade='all, delete-orphan')
     engine_data = db.relationship('EngineData', backref='session', lazy=True, cascade='all, delete-orphan')
     setup_data = db.relationship('SetupData', backref='session', lazy=True, cascade='all, delete-orphan')
     laps = db.relationship('Lap', backref='session', lazy=True, cascade='all, delete-orphan')
+    lap_summary = db.relationship('SessionLapSummary', uselist=False, lazy=True, cascade='all, delete-orphan')
     
     def to_dict(self):
         return {
@@ -74,6 +83,7 @@ class Session(db.Model):
             'best_lap_time': self.best_lap_time,
             'session_status': self.session_status,
             'notes': self.notes,
+            'closed_at': self.closed_at.isoformat() if self.closed_at else None,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
@@ -90,11 +100,40 @@ class Lap(db.Model):
     sector2 = db.Column(db.String(20))  # Sector 2 time in format SS.mmm
     sector3 = db.Column(db.String(20))  # Sector 3 time in format SS.mmm
     sector4 = db.Column(db.String(20))  # Sector 4 time in format SS.mmm
+    # Numeric copies of the times above in milliseconds, kept in sync on write
+    lap_time_ms = db.Column(db.Integer)
+    sector1_ms = db.Column(db.Integer)
+    sector2_ms = db.Column(db.Integer)
+    sector3_ms = db.Column(db.Integer)
+    sector4_ms = db.Column(db.Integer)
     fuel_consumed = db.Column(db.Float)  # Fuel consumed in this lap
     tire_set = db.Column(db.String(50))  # Tire set identifier
     lap_status = db.Column(db.String(10))  # RF, FCY, SC, TFC, or null for normal
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_laps_session_lap_time_ms', 'session_id', 'lap_time_ms'),
+        db.Index('ix_laps_session_lap_number', 'session_id', 'lap_number', 'id'),
+        db.Index('ix_laps_tire_set', 'tire_set'),
+        db.Index('ix_laps_session_updated_at', 'session_id', 'updated_at'),
+    )
+    
+    # Formatted time column -> millisecond column
+    TIME_COLUMNS = {
+        'lap_time': 'lap_time_ms',
+        'sector1': 'sector1_ms',
+        'sector2': 'sector2_ms',
+        'sector3': 'sector3_ms',
+        'sector4': 'sector4_ms'
+    }
+    
+    @validates(*TIME_COLUMNS)
+    def _sync_milliseconds(self, key, value):
+        """Keep the millisecond columns in sync with the formatted times"""
+        setattr(self, self.TIME_COLUMNS[key], RacingCalculations.time_to_ms(value))
+        return value
     
     def to_dict(self):
         return {
@@ -106,11 +145,204 @@ class Lap(db.Model):
             'sector2': self.sector2,
             'sector3': self.sector3,
             'sector4': self.sector4,
+            'lap_time_ms': self.lap_time_ms,
+            'sector1_ms': self.sector1_ms,
+            'sector2_ms': self.sector2_ms,
+            'sector3_ms': self.sector3_ms,
+            'sector4_ms': self.sector4_ms,
             'fuel_consumed': self.fuel_consumed,
             'tire_set': self.tire_set,
             'lap_status': self.lap_status,
             'notes': self.notes,
-            'created_at': self.created_at.isoformat()
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class SessionLapSummary(db.Model):
+    """Running lap totals of a session, updated on every lap write"""
+    __tablename__ = 'session_lap_summaries'
+    
+    SECTORS = ('sector1_ms', 'sector2_ms', 'sector3_ms', 'sector4_ms')
+    
+    session_id = db.Column(db.Integer, db.ForeignKey('sessions.id'), primary_key=True)
+    lap_count = db.Column(db.Integer, nullable=False, default=0)
+    timed_lap_count = db.Column(db.Integer, nullable=False, default=0)  # Laps with a valid lap time
+    total_lap_time_ms = db.Column(db.Integer, nullable=False, default=0)
+    total_fuel = db.Column(db.Float, nullable=False, default=0.0)
+    best_lap_ms = db.Column(db.Integer)
+    best_lap_id = db.Column(db.Integer)
+    best_lap_number = db.Column(db.Integer)
+    best_sector1_ms = db.Column(db.Integer)
+    best_sector2_ms = db.Column(db.Integer)
+    best_sector3_ms = db.Column(db.Integer)
+    best_sector4_ms = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @staticmethod
+    def lap_values(lap):
+        """Snapshot of the lap fields the summary depends on"""
+        values = {name: getattr(lap, name) for name in ('id', 'lap_number', 'lap_time_ms', 'fuel_consumed')}
+        values.update({name: getattr(lap, name) for name in SessionLapSummary.SECTORS})
+        return values
+    
+    @classmethod
+    def for_session(cls, session_id):
+        """Summary of a session, built from its laps the first time it is needed"""
+        summary = db.session.get(cls, session_id)
+        if summary is None:
+            # Two writers may both find no summary; only one insert wins
+            if db.session.get_bind().dialect.name == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            created = db.session.execute(
+                insert(cls).values(session_id=session_id).on_conflict_do_nothing()
+            ).rowcount
+            summary = db.session.get(cls, session_id)
+            if created:
+                summary.rebuild()
+        return summary
+    
+    # Every change below is a single UPDATE computed from the stored row, so
+    # concurrent lap writes to the same session cannot lose each other's
+    # changes. UPDATE ... SET evaluates every expression on the old row.
+    
+    @classmethod
+    def computed(cls, session_id):
+        """Summary of a session computed from its laps in one query, without storing it"""
+        summary = cls(session_id=session_id)
+        totals = summary._totals()
+        row = db.session.execute(db.select(*[value.label(name) for name, value in totals.items()])).one()
+        for name, value in zip(totals, row):
+            setattr(summary, name, value)
+        return summary
+    
+    def rebuild(self):
+        """Recompute every total from the laps table"""
+        self._update(self._totals())
+    
+    def _totals(self):
+        """Every stored total as a subquery over the session's laps"""
+        def laps(*columns):
+            return db.select(*columns).where(Lap.session_id == self.session_id).scalar_subquery()
+        
+        changes = {
+            'lap_count': laps(db.func.count(Lap.id)),
+            'timed_lap_count': laps(db.func.count(Lap.lap_time_ms)),
+            'total_lap_time_ms': laps(db.func.coalesce(db.func.sum(Lap.lap_time_ms), 0)),
+            'total_fuel': laps(db.func.coalesce(db.func.sum(Lap.fuel_consumed), 0.0)),
+            'best_lap_ms': self._best_lap(Lap.lap_time_ms),
+            'best_lap_id': self._best_lap(Lap.id),
+            'best_lap_number': self._best_lap(Lap.lap_number)
+        }
+        for sector in self.SECTORS:
+            changes[f'best_{sector}'] = self._best_sector(sector)
+        return changes
+    
+    def add_lap(self, values):
+        """Account for a new lap (values from lap_values)"""
+        cls = SessionLapSummary
+        changes = {
+            'lap_count': cls.lap_count + 1,
+            'total_fuel': cls.total_fuel + (values['fuel_consumed'] or 0.0)
+        }
+        lap_time = values['lap_time_ms']
+        if lap_time is not None:
+            better = db.or_(cls.best_lap_ms.is_(None), cls.best_lap_ms > lap_time)
+            changes.update({
+                'timed_lap_count': cls.timed_lap_count + 1,
+                'total_lap_time_ms': cls.total_lap_time_ms + lap_time,
+                'best_lap_ms': db.case((better, lap_time), else_=cls.best_lap_ms),
+                'best_lap_id': db.case((better, values['id']), else_=cls.best_lap_id),
+                'best_lap_number': db.case((better, values['lap_number']), else_=cls.best_lap_number)
+            })
+        for sector in self.SECTORS:
+            if values[sector] is not None:
+                best = getattr(cls, f'best_{sector}')
+                better = db.or_(best.is_(None), best > values[sector])
+                changes[f'best_{sector}'] = db.case((better, values[sector]), else_=best)
+        self._update(changes)
+    
+    def remove_lap(self, values):
+        """
+        Account for a deleted lap (values from lap_values, taken before the
+        change). Only removing a best time needs a lookup, served by an index.
+        """
+        cls = SessionLapSummary
+        changes = {
+            'lap_count': cls.lap_count - 1,
+            'total_fuel': cls.total_fuel - (values['fuel_consumed'] or 0.0)
+        }
+        lap_time = values['lap_time_ms']
+        if lap_time is not None:
+            stale = db.or_(cls.best_lap_id == values['id'], cls.best_lap_ms >= lap_time)
+            changes.update({
+                'timed_lap_count': cls.timed_lap_count - 1,
+                'total_lap_time_ms': cls.total_lap_time_ms - lap_time,
+                'best_lap_ms': db.case((stale, self._best_lap(Lap.lap_time_ms)), else_=cls.best_lap_ms),
+                'best_lap_id': db.case((stale, self._best_lap(Lap.id)), else_=cls.best_lap_id),
+                'best_lap_number': db.case((stale, self._best_lap(Lap.lap_number)), else_=cls.best_lap_number)
+            })
+        for sector in self.SECTORS:
+            if values[sector] is not None:
+                best = getattr(cls, f'best_{sector}')
+                changes[f'best_{sector}'] = db.case(
+                    (best >= values[sector], self._best_sector(sector)), else_=best
+                )
+        self._update(changes)
+    
+    def update_lap(self, old_values, new_values):
+        """Account for an edited lap"""
+        self.remove_lap(old_values)
+        self.add_lap(new_values)
+    
+    def _update(self, changes):
+        # Executing flushes pending lap changes first, so lookups see them
+        changes['updated_at'] = datetime.utcnow()
+        db.session.execute(
+            db.update(SessionLapSummary)
+            .where(SessionLapSummary.session_id == self.session_id)
+            .values(changes)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.expire(self)
+    
+    def _best_lap(self, column):
+        """Column of the session's fastest lap, as a subquery"""
+        return db.select(column).where(
+            Lap.session_id == self.session_id, Lap.lap_time_ms.isnot(None)
+        ).order_by(Lap.lap_time_ms, Lap.lap_number).limit(1).scalar_subquery()
+    
+    def _best_sector(self, sector):
+        """Best time of a sector column, as a subquery"""
+        return db.select(db.func.min(getattr(Lap, sector))).where(
+            Lap.session_id == self.session_id
+        ).scalar_subquery()
+    
+    def to_dict(self):
+        sectors = [getattr(self, f'best_{sector}') for sector in self.SECTORS]
+        present = [ms for ms in sectors if ms is not None]
+        theoretical = sum(present) if present else None
+        average = self.total_lap_time_ms / self.timed_lap_count if self.timed_lap_count else None
+        
+        def formatted(ms):
+            return RacingCalculations.format_time(ms / 1000) if ms is not None else None
+        
+        return {
+            'session_id': self.session_id,
+            'lap_count': self.lap_count,
+            'timed_lap_count': self.timed_lap_count,
+            'best_lap_ms': self.best_lap_ms,
+            'best_lap': formatted(self.best_lap_ms),
+            'best_lap_id': self.best_lap_id,
+            'best_lap_number': self.best_lap_number,
+            'best_sectors_ms': sectors,
+            'theoretical_best_ms': theoretical,
+            'theoretical_best': formatted(theoretical),
+            'average_lap_ms': round(average, 1) if average is not None else None,
+            'average_lap': formatted(average),
+            'total_fuel': round(self.total_fuel, 3),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
 class TireData(db.Model):
@@ -129,6 +361,13 @@ class TireData(db.Model):
     wear_level = db.Column(db.Float)  # Wear level percentage
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_tire_data_session_id', 'session_id', 'id'),
+        db.Index('ix_tire_data_tire_set', 'tire_set'),
+        db.Index('ix_tire_data_session_updated_at', 'session_id', 'updated_at'),
+    )
     
     def to_dict(self):
         return {
@@ -143,7 +382,8 @@ class TireData(db.Model):
             'temp_outer': self.temp_outer,
             'wear_level': self.wear_level,
             'notes': self.notes,
-            'created_at': self.created_at.isoformat()
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
         }
 
 class EngineData(db.Model):
@@ -159,6 +399,11 @@ class EngineData(db.Model):
     fuel_consumption_rate = db.Column(db.Float)  # Liters per lap
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_engine_data_session_id', 'session_id'),
+    )
     
     def to_dict(self):
         return {
@@ -170,7 +415,8 @@ class EngineData(db.Model):
             'water_temp': self.water_temp,
             'fuel_consumption_rate': self.fuel_consumption_rate,
             'notes': self.notes,
-            'created_at': self.created_at.isoformat()
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
         }
 
 class SetupData(db.Model):
@@ -200,6 +446,11 @@ class SetupData(db.Model):
     brake_balance = db.Column(db.Float)
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_setup_data_session_id', 'session_id'),
+    )
     
     def to_dict(self):
         return {
@@ -225,5 +476,96 @@ class SetupData(db.Model):
             'toe_rear': self.toe_rear,
             'brake_balance': self.brake_balance,
             'notes': self.notes,
-            'created_at': self.created_at.isoformat()
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class TelemetryChannel(db.Model):
+    """A logged channel of a session (oil temp, tire temps, fuel rate, ...)"""
+    __tablename__ = 'telemetry_channels'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('sessions.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    unit = db.Column(db.String(20))
+    dtype = db.Column(db.String(10), nullable=False)  # float32, float64, int16, int32
+    sample_rate = db.Column(db.Float)  # Nominal rate in Hz
+    chunk_size = db.Column(db.Integer, nullable=False)  # Samples per chunk
+    sample_count = db.Column(db.Integer, nullable=False, default=0)
+    chunk_count = db.Column(db.Integer, nullable=False, default=0)
+    start_ms = db.Column(db.BigInteger)  # Time of the first sample
+    end_ms = db.Column(db.BigInteger)  # Time of the last sample
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('session_id', 'name', name='uq_telemetry_channels_session_name'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'session_id': self.session_id,
+            'name': self.name,
+            'unit': self.unit,
+            'dtype': self.dtype,
+            'sample_rate': self.sample_rate,
+            'chunk_size': self.chunk_size,
+            'sample_count': self.sample_count,
+            'chunk_count': self.chunk_count,
+            'start_ms': self.start_ms,
+            'end_ms': self.end_ms,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
         }
+
+class TelemetryChunk(db.Model):
+    """
+    Up to chunk_size consecutive samples of a channel, compressed together
+    (see telemetry.py for the layout of data)
+    """
+    __tablename__ = 'telemetry_chunks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    channel_id = db.Column(db.Integer, db.ForeignKey('telemetry_channels.id'), nullable=False)
+    sequence = db.Column(db.Integer, nullable=False)  # 0, 1, 2, ... in time order
+    start_ms = db.Column(db.BigInteger, nullable=False)
+    end_ms = db.Column(db.BigInteger, nullable=False)
+    sample_count = db.Column(db.Integer, nullable=False)
+    min_value = db.Column(db.Float)
+    max_value = db.Column(db.Float)
+    data = db.Column(db.LargeBinary, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_telemetry_chunks_channel_end', 'channel_id', 'end_ms'),
+        db.UniqueConstraint('channel_id', 'sequence', name='uq_telemetry_chunks_channel_sequence'),
+    )
+
+class TelemetryLevel(db.Model):
+    """
+    Part of a precomputed min/max pyramid level of a channel: the minimum and
+    maximum (with their times) of consecutive buckets of bucket_size samples
+    """
+    __tablename__ = 'telemetry_levels'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    channel_id = db.Column(db.Integer, db.ForeignKey('telemetry_channels.id'), nullable=False)
+    level = db.Column(db.Integer, nullable=False)  # 1 is the finest
+    bucket_size = db.Column(db.Integer, nullable=False)  # Raw samples per bucket
+    sequence = db.Column(db.Integer, nullable=False)
+    start_ms = db.Column(db.BigInteger, nullable=False)
+    end_ms = db.Column(db.BigInteger, nullable=False)
+    bucket_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_telemetry_levels_channel_level_end', 'channel_id', 'level', 'end_ms'),
+    )
+
+@event.listens_for(Session, 'before_delete')
+def _delete_session_telemetry(mapper, connection, session):
+    """Delete telemetry with bulk statements instead of loading every chunk"""
+    channel_ids = db.select(TelemetryChannel.id).where(TelemetryChannel.session_id == session.id)
+    connection.execute(db.delete(TelemetryChunk).where(TelemetryChunk.channel_id.in_(channel_ids)))
+    connection.execute(db.delete(TelemetryLevel).where(TelemetryLevel.channel_id.in_(channel_ids)))
+    connection.execute(db.delete(TelemetryChannel).where(TelemetryChannel.session_id == session.id))
@@ -0,0 +1,155 @@
+"""
+List endpoint helpers
+Keyset (cursor) pagination and field projection for the GET list routes.
+
+Without a limit a route returns every row as before. With ?limit=N it
+returns at most N rows ordered by the route's key columns, and when more
+rows follow the X-Next-Cursor and Link headers carry the cursor to pass as
+?after= for the next page. The body stays a plain JSON array either way.
+?fields=a,b,c selects only those columns.
+"""
+
+import base64
+import json
+from urllib.parse import urlencode
+
+from flask import Response, jsonify, request, stream_with_context
+from sqlalchemy import and_, or_
+
+import serializers
+from models import db
+
+MAX_PAGE_SIZE = 1000
+
+# Rows fetched from the database at a time while streaming an unpaginated list
+STREAM_BATCH_ROWS = 1000
+
+
+class PaginationError(ValueError):
+    """Raised for invalid limit, after or fields parameters"""
+
+
+def encode_cursor(values):
+    """Opaque cursor for the key values of the last row of a page"""
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Key values encoded by encode_cursor"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise PaginationError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise PaginationError('Invalid cursor')
+    return values
+
+
+def _after(key_columns, values):
+    """Row-value comparison (k1, k2, ...) > (v1, v2, ...) written out for every backend"""
+    clauses = []
+    for i, column in enumerate(key_columns):
+        equal = [key_columns[j] == values[j] for j in range(i)]
+        clauses.append(and_(*equal, column > values[i]))
+    return or_(*clauses)
+
+
+def _parse_fields(model):
+    """Columns to return: ?fields= in the order given, or every column of the table"""
+    columns = model.__table__.columns
+    fields = request.args.get('fields')
+    if not fields:
+        return list(columns)
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        raise PaginationError(f"Unknown fields: {', '.join(unknown)}")
+    return [columns[field] for field in fields]
+
+
+def paginate(statement, key_columns, key_positions):
+    """
+    Apply ?limit= and ?after= to a select of tuples
+
+    Args:
+        statement: Select statement
+        key_columns: Columns giving a unique, indexed order, e.g. (Lap.lap_number, Lap.id)
+        key_positions: Index of each key column in the selected tuples
+
+    Returns:
+        (rows, next cursor or None); without a limit rows is a lazy iterator
+    """
+    key_columns = list(key_columns)
+    statement = statement.order_by(*key_columns)
+
+    limit = request.args.get('limit')
+    if limit is None:
+        if request.args.get('after'):
+            raise PaginationError('after requires limit')
+        return db.session.execute(statement.execution_options(yield_per=STREAM_BATCH_ROWS)), None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise PaginationError('limit must be an integer')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise PaginationError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+
+    after = request.args.get('after')
+    if after:
+        statement = statement.where(_after(key_columns, decode_cursor(after, len(key_columns))))
+
+    # One extra row tells whether another page follows
+    rows = db.session.execute(statement.limit(limit + 1)).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([last[position] for position in key_positions])
+
+
+def list_response(model, filters, key_columns):
+    """
+    JSON response for a list route: paginated, projected and streamed
+
+    Rows are read as tuples and encoded by serializers, never loaded as
+    model instances. ?shape=columnar returns {"count", "columns"} instead
+    of an array of objects.
+
+    Args:
+        model: Model whose table columns are listed
+        filters: Where clauses, e.g. [Lap.session_id == session_id]
+        key_columns: Keyset order (see paginate)
+
+    Returns:
+        Flask response; 400 for invalid parameters
+    """
+    try:
+        columns = _parse_fields(model)
+        shape = request.args.get('shape', serializers.ROW_SHAPE)
+        if shape not in serializers.SHAPES:
+            raise PaginationError(f"shape must be one of {', '.join(serializers.SHAPES)}")
+        # Key columns are selected even when not projected, to build the cursor
+        names = [column.key for column in columns]
+        selected = columns + [column for column in key_columns if column.key not in names]
+        key_positions = [[column.key for column in selected].index(column.key) for column in key_columns]
+        rows, cursor = paginate(db.select(*selected).where(*filters), key_columns, key_positions)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    width = len(columns)
+    if len(selected) > width:
+        rows = [row[:width] for row in rows] if isinstance(rows, list) else (row[:width] for row in rows)
+
+    if shape == serializers.COLUMNAR_SHAPE:
+        response = Response(serializers.dumps(serializers.columnar(names, rows)), mimetype='application/json')
+    elif isinstance(rows, list):
+        # A page is small enough to send (and cache) in one piece
+        response = Response(b''.join(serializers.iter_rows(names, rows)), mimetype='application/json')
+    else:
+        response = Response(stream_with_context(serializers.iter_rows(names, rows)), mimetype='application/json')
+    if cursor:
+        response.headers['X-Next-Cursor'] = cursor
+        next_args = request.args.to_dict()
+        next_args['after'] = cursor
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(next_args)}>; rel="next"'
+    return response
@@ -0,0 +1,365 @@
+"""
+Event export / import in the .rcme format
+(see EVENT_EXPORT_IMPORT_README.md; the v3 binary container is in rcme_v3)
+
+Exports are streamed: the event and sessions are written first and each
+session's laps are encoded in chunks from a server-side cursor, so memory
+does not grow with the size of the event. Imports are parsed incrementally
+from the request stream and the laps of each session are fed straight into
+the bulk lap insert, all in the caller's transaction.
+"""
+
+import codecs
+import json
+import shutil
+import tempfile
+from datetime import datetime
+
+import serializers
+from lap_import import insert_laps
+from models import db, RaceEvent, Session, Lap
+from rcme_v3 import MAGIC, RcmeV3Error, RcmeV3Reader, RcmeV3Writer, is_v3
+
+RCME_VERSION = '2.0'
+
+EVENT_FIELDS = ('name', 'track', 'track_length', 'date_start', 'date_end', 'weather', 'notes')
+SESSION_FIELDS = ('session_type', 'session_number', 'duration', 'fuel_start', 'fuel_per_lap',
+                  'fuel_consumed', 'tire_set', 'best_lap_time', 'session_status', 'notes')
+
+# Characters a JSON number can continue with
+NUMBER_CHARS = frozenset('0123456789+-.eE')
+
+# Rows fetched from the database at a time while exporting laps
+EXPORT_BATCH_ROWS = 2000
+
+
+class RcmeError(ValueError):
+    """Raised when an .rcme file cannot be imported"""
+
+
+def _sessions(event_id):
+    """(column names, session rows) of an event in id order"""
+    columns = list(Session.__table__.columns)
+    rows = db.session.execute(
+        db.select(*columns).where(Session.event_id == event_id).order_by(Session.id)
+    ).all()
+    return [column.key for column in columns], rows
+
+
+def _laps(session_id):
+    """(column names, lap rows) of a session, fetched in batches"""
+    columns = list(Lap.__table__.columns)
+    rows = db.session.execute(
+        db.select(*columns)
+        .where(Lap.session_id == session_id)
+        .order_by(Lap.lap_number, Lap.id)
+        .execution_options(yield_per=EXPORT_BATCH_ROWS)
+    )
+    return [column.key for column in columns], rows
+
+
+def export_event(event_id, run_plans=(), tire_pressure_database=(), version=RCME_VERSION):
+    """
+    Encode an event as .rcme, piece by piece
+
+    Args:
+        event_id: Event to export
+        run_plans: RunPlan history to embed (kept by the frontend)
+        tire_pressure_database: Tire pressure entries to embed (kept by the frontend)
+        version: '2.0' for JSON or '3.0' for the binary columnar container
+
+    Yields:
+        Pieces of the document as bytes
+    """
+    event = db.session.get(RaceEvent, event_id)
+    export_date = datetime.utcnow().isoformat(timespec='milliseconds') + 'Z'
+    if str(version).startswith('3'):
+        yield from _export_v3(event, list(run_plans), list(tire_pressure_database), export_date)
+        return
+
+    yield b'{"event":' + serializers.dumps(event.to_dict()) + b',"sessions":['
+    session_names, sessions = _sessions(event_id)
+    for index, session in enumerate(sessions):
+        header = serializers.dumps(dict(zip(session_names, session)))
+        yield (b',' if index else b'') + header[:-1] + b',"laps":'
+        yield from serializers.iter_rows(*_laps(session.id))
+        yield b'}'
+
+    yield (b'],"runPlans":' + serializers.dumps(list(run_plans))
+           + b',"tirePressureDatabase":' + serializers.dumps(list(tire_pressure_database))
+           + b',"exportDate":' + serializers.dumps(export_date)
+           + b',"version":' + serializers.dumps(RCME_VERSION) + b'}')
+
+
+def _export_v3(event, run_plans, tire_pressure_database, export_date):
+    """The same document in the v3 container, one session in memory at a time"""
+    writer = RcmeV3Writer()
+    yield writer.header()
+    session_names, sessions = _sessions(event.id)
+    for session in sessions:
+        lap_names, laps = _laps(session.id)
+        document = dict(zip(session_names, session))
+        document['laps'] = [dict(zip(lap_names, lap)) for lap in laps]
+        yield writer.session(document)
+    yield writer.finish({
+        'event': event.to_dict(),
+        'sessions': None,
+        'runPlans': run_plans,
+        'tirePressureDatabase': tire_pressure_database,
+        'exportDate': export_date,
+        'version': RCME_VERSION
+    })
+
+
+class JsonReader:
+    """
+    Pull parser over a binary JSON stream
+
+    Containers are walked with iter_object / iter_array; any other value is
+    decoded whole with value(). Only the part of the document being parsed
+    is held in memory.
+    """
+
+    def __init__(self, stream, block_size=1 << 16, head=b''):
+        self.stream = stream
+        self.block_size = block_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        # Bytes already read from the stream
+        self.buffer = self.decoder.decode(head)
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Read another block; False at the end of the stream"""
+        if self.eof:
+            return False
+        block = self.stream.read(self.block_size)
+        if not block:
+            self.eof = True
+            self.buffer = self.buffer[self.pos:] + self.decoder.decode(b'', final=True)
+        else:
+            self.buffer = self.buffer[self.pos:] + self.decoder.decode(block)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character ('' at the end of the stream)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise RcmeError(f'Invalid JSON: expected {char!r}, found {found or "end of file"!r}')
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue
+                raise RcmeError(f'Invalid JSON: {e}')
+            # A number cut at the end of the buffer continues in the next block
+            if not self.eof and (end == len(self.buffer) or (
+                    isinstance(value, (int, float)) and self.buffer[end] in NUMBER_CHARS)):
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def iter_object(self):
+        """Yield the keys of an object; the caller consumes each value"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise RcmeError('Invalid JSON: object keys must be strings')
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+    def iter_array(self):
+        """Yield once per item of an array; the caller consumes each item"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+
+def _parse_datetime(value, field):
+    """ISO 8601 timestamp, accepting the trailing Z written by browsers"""
+    if not isinstance(value, str):
+        raise RcmeError(f'event.{field} must be a date string')
+    try:
+        parsed = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        raise RcmeError(f'event.{field} is not a valid date: {value!r}')
+    return parsed.replace(tzinfo=None)
+
+
+def _create_event(data, name=None):
+    if not isinstance(data, dict):
+        raise RcmeError('event must be an object')
+    missing = [field for field in ('name', 'track', 'date_start', 'date_end') if not data.get(field)]
+    if missing:
+        raise RcmeError(f"event is missing {', '.join(missing)}")
+    event = RaceEvent(**{field: data.get(field) for field in EVENT_FIELDS})
+    event.date_start = _parse_datetime(data['date_start'], 'date_start')
+    event.date_end = _parse_datetime(data['date_end'], 'date_end')
+    if name:
+        event.name = name
+    db.session.add(event)
+    db.session.flush()
+    return event
+
+
+def _create_session(event, fields):
+    session = Session(event_id=event.id, **{field: fields.get(field) for field in SESSION_FIELDS})
+    # Checked once the whole session object has been read
+    session.session_type = session.session_type or ''
+    if session.session_number is None:
+        session.session_number = 1
+    db.session.add(session)
+    db.session.flush()
+    return session
+
+
+def _import_session(reader, event, index, result):
+    """Import one session object, streaming its laps into bulk inserts"""
+    if reader.peek() != '{':
+        raise RcmeError(f'sessions[{index}] must be an object')
+    fields = {}
+    session = None
+    for key in reader.iter_object():
+        if key == 'laps' and reader.peek() == '[':
+            # Laps may come before the remaining session fields
+            if session is None:
+                session = _create_session(event, fields)
+            laps = (reader.value() for _ in reader.iter_array())
+            inserted, rejected, errors = insert_laps(session.id, laps)
+            result['laps'] += inserted
+            result['rejected'] += rejected
+            result['errors'].extend(dict(error, session=index) for error in errors)
+        else:
+            fields[key] = reader.value()
+            if session is not None and key in SESSION_FIELDS:
+                setattr(session, key, fields[key])
+    if session is None:
+        session = _create_session(event, fields)
+    if not session.session_type:
+        raise RcmeError(f'sessions[{index}] is missing session_type')
+    result['sessions'] += 1
+
+
+def import_event(stream, name=None):
+    """
+    Import an .rcme document (v2 JSON or v3 binary) as a new event, without
+    committing
+
+    Args:
+        stream: Binary stream of the document
+        name: Name for the new event (default: the name in the file)
+
+    Returns:
+        Dictionary with the new event id and import counts; laps that fail
+        validation are reported in errors and skipped
+    """
+    result = {'event_id': None, 'sessions': 0, 'laps': 0, 'rejected': 0, 'errors': [],
+              'run_plans': 0, 'tire_pressure_entries': 0}
+    head = stream.read(len(MAGIC))
+    if is_v3(head):
+        # v3 is read by random access, so spool the upload to a file first
+        with tempfile.TemporaryFile() as spool:
+            spool.write(head)
+            shutil.copyfileobj(stream, spool)
+            spool.flush()
+            try:
+                with RcmeV3Reader(spool) as reader:
+                    _import_v3(reader, name, result)
+            except RcmeV3Error as e:
+                raise RcmeError(str(e))
+        return result
+
+    reader = JsonReader(stream, head=head)
+    event = None
+    for key in reader.iter_object():
+        if key == 'event':
+            event = _create_event(reader.value(), name)
+            result['event_id'] = event.id
+        elif key == 'sessions':
+            if event is None:
+                raise RcmeError('"event" must come before "sessions"')
+            for index, _ in enumerate(reader.iter_array()):
+                _import_session(reader, event, index, result)
+        elif key == 'version':
+            _check_version(reader.value())
+        elif key in ('runPlans', 'tirePressureDatabase'):
+            # Kept by the frontend in localStorage; only counted here
+            _count_entries(key, reader.value(), result)
+        else:
+            reader.value()
+
+    if reader.peek():
+        raise RcmeError('Invalid JSON: unexpected data after the document')
+    if event is None:
+        raise RcmeError('File has no event')
+    return result
+
+
+def _check_version(version):
+    if not str(version).startswith('2'):
+        raise RcmeError(f'Unsupported .rcme version: {version}')
+
+
+def _count_entries(key, entries, result):
+    count = len(entries) if isinstance(entries, list) else 0
+    result['run_plans' if key == 'runPlans' else 'tire_pressure_entries'] = count
+
+
+def _import_v3(reader, name, result):
+    """Import a v3 file, decoding one session's laps at a time"""
+    document = reader.document
+    if 'version' in document:
+        _check_version(document['version'])
+    if 'event' not in document:
+        raise RcmeError('File has no event')
+    event = _create_event(document['event'], name)
+    result['event_id'] = event.id
+    for key in ('runPlans', 'tirePressureDatabase'):
+        _count_entries(key, document.get(key), result)
+
+    for index, entry in enumerate(reader.session_index):
+        fields = entry['fields']
+        session = _create_session(event, fields)
+        if not session.session_type:
+            raise RcmeError(f'sessions[{index}] is missing session_type')
+        if 'laps' in entry['tables']:
+            inserted, rejected, errors = insert_laps(session.id, reader.table(index, 'laps'))
+            result['laps'] += inserted
+            result['rejected'] += rejected
+            result['errors'].extend(dict(error, session=index) for error in errors)
+        result['sessions'] += 1
@@ -0,0 +1,453 @@
+"""
+.rcme v3: binary columnar event container
+
+A v2 document stores every lap as a JSON object. v3 stores each list of
+objects in a session (laps, tire_data, setup_data, ...) as a table of typed
+columns, one zlib block per column:
+- int        smallest of int8/16/32/64 (ids, lap numbers, *_ms)
+- time       int32 milliseconds of "M:SS.mmm" or "SS.mmm" strings
+- datetime   int64 microseconds of naive ISO timestamps
+- float32    when every value survives the round trip, float64 otherwise
+- bool       uint8
+- dict       codes into a per-column dictionary of distinct values
+             (tire_set, lap_status, notes, and anything that fits no type)
+Nulls and missing keys are kept in a separate mask block, so decoding gives
+back exactly the v2 document.
+
+Layout: MAGIC, the column blocks, a zlib-compressed JSON index, then a
+trailer with the index position and MAGIC again. The index holds the
+document, the session fields and where each column block is; a reader
+memory-maps the file and only decompresses the blocks it is asked for, so
+reading one session does not decode the rest of the file.
+"""
+
+import json
+import mmap
+import struct
+import zlib
+from datetime import datetime, timedelta
+
+# numpy is imported by the column codecs, keeping it off the backend's startup path
+from calculations import RacingCalculations
+
+RCME_V3_VERSION = '3.0'
+
+# First byte is not ASCII so a v3 file can never be mistaken for JSON
+MAGIC = b'\x89RCME3\r\n'
+TRAILER = struct.Struct('<QQ')
+
+COMPRESSION_LEVEL = 6
+
+# Mask values
+VALUE, NULL, MISSING = 0, 1, 2
+
+INT_DTYPES = ('<i1', '<i2', '<i4', '<i8')
+CODE_DTYPES = ('<u1', '<u2', '<u4')
+
+EPOCH = datetime(1970, 1, 1)
+
+HASHABLE = (str, int, float, datetime)
+
+# What malformed index metadata or a block of the wrong length raises while decoding
+DECODE_ERRORS = (KeyError, IndexError, TypeError, ValueError, StopIteration)
+
+
+class RcmeV3Error(ValueError):
+    """Raised when data is not a valid .rcme v3 file"""
+
+
+def is_v3(head):
+    """True when bytes start like an .rcme v3 file"""
+    return bytes(head[:len(MAGIC)]) == MAGIC
+
+
+# Time strings are kept in the style they were written in
+TIME_STYLES = {
+    'minutes': lambda ms: f'{ms // 60000}:{ms % 60000 // 1000:02d}.{ms % 1000:03d}',
+    'seconds': lambda ms: f'{ms // 1000}.{ms % 1000:03d}'
+}
+
+
+def _time_column(values):
+    """(style, milliseconds) when every string is a time in one style"""
+    ms = []
+    formatter = style = None
+    for value in values:
+        milliseconds = RacingCalculations.time_to_ms(value) if isinstance(value, str) else None
+        if milliseconds is None or milliseconds >= 2 ** 31:
+            return None
+        if formatter is None:
+            style = 'minutes' if ':' in value else 'seconds'
+            formatter = TIME_STYLES[style]
+        if formatter(milliseconds) != value:
+            return None
+        ms.append(milliseconds)
+    return style, ms
+
+
+def _datetime_column(values):
+    """Microseconds since the epoch when every value is a naive ISO timestamp"""
+    micros = []
+    for value in values:
+        if isinstance(value, str):
+            try:
+                parsed = datetime.fromisoformat(value)
+            except ValueError:
+                return None
+            if parsed.isoformat() != value:
+                return None
+            value = parsed
+        elif not isinstance(value, datetime):
+            return None
+        if value.tzinfo is not None:
+            return None
+        delta = value - EPOCH
+        micros.append((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+    return micros
+
+
+def _json_text(value):
+    # The standard encoder also takes integers beyond 64 bits
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'),
+                      default=lambda value: value.isoformat())
+
+
+def _int_dtype(values):
+    import numpy as np
+
+    low, high = min(values), max(values)
+    for dtype in INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return None
+
+
+def _encode_column(values):
+    """
+    Pick the most compact lossless type for a column
+
+    Args:
+        values: Non-null values of the column
+
+    Returns:
+        (metadata, raw column bytes, raw dictionary bytes or None)
+    """
+    import numpy as np
+
+    if values and all(type(value) is bool for value in values):
+        return {'type': 'bool'}, np.array(values, dtype='<u1').tobytes(), None
+    if values and all(type(value) is int for value in values):
+        dtype = _int_dtype(values)
+        if dtype is not None:
+            return {'type': 'int', 'dtype': dtype}, np.array(values, dtype=dtype).tobytes(), None
+    if values and all(type(value) is float for value in values):
+        with np.errstate(over='ignore'):
+            single = np.array(values, dtype='<f4')
+        if all(float(str(number)) == value for number, value in zip(single, values)):
+            return {'type': 'float32'}, single.tobytes(), None
+        return {'type': 'float64'}, np.array(values, dtype='<f8').tobytes(), None
+    if values:
+        time = _time_column(values)
+        if time is not None:
+            return {'type': 'time', 'style': time[0]}, np.array(time[1], dtype='<i4').tobytes(), None
+        micros = _datetime_column(values)
+        if micros is not None:
+            return {'type': 'datetime'}, np.array(micros, dtype='<i8').tobytes(), None
+
+    # Dictionary of distinct values (1, 1.0 and True stay apart)
+    codes = {}
+    dictionary = []
+    column = []
+    for value in values:
+        key = (type(value), value if isinstance(value, HASHABLE) else _json_text(value))
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = len(dictionary)
+            dictionary.append(value)
+        column.append(code)
+    dtype = next(dtype for dtype in CODE_DTYPES if len(dictionary) <= np.iinfo(dtype).max + 1)
+    return ({'type': 'dict', 'dtype': dtype}, np.array(column, dtype=dtype).tobytes(),
+            _json_text(dictionary).encode())
+
+
+def _decode_column(meta, raw, dictionary):
+    """Inverse of _encode_column: the list of non-null values"""
+    import numpy as np
+
+    kind = meta['type']
+    if kind == 'bool':
+        return [bool(value) for value in np.frombuffer(raw, dtype='<u1')]
+    if kind == 'int':
+        return np.frombuffer(raw, dtype=meta['dtype']).tolist()
+    if kind == 'float32':
+        return [float(str(value)) for value in np.frombuffer(raw, dtype='<f4')]
+    if kind == 'float64':
+        return np.frombuffer(raw, dtype='<f8').tolist()
+    if kind == 'time':
+        formatter = TIME_STYLES[meta['style']]
+        return [formatter(ms) for ms in np.frombuffer(raw, dtype='<i4').tolist()]
+    if kind == 'datetime':
+        return [(EPOCH + timedelta(microseconds=us)).isoformat()
+                for us in np.frombuffer(raw, dtype='<i8').tolist()]
+    if kind == 'dict':
+        values = json.loads(dictionary)
+        return [values[code] for code in np.frombuffer(raw, dtype=meta['dtype']).tolist()]
+    raise RcmeV3Error(f'Unknown column type: {kind}')
+
+
+def _is_table(value):
+    return isinstance(value, list) and value and all(isinstance(row, dict) for row in value)
+
+
+class RcmeV3Writer:
+    """
+    Incremental .rcme v3 encoder
+
+    Each method returns the bytes to append to the output, so a file can be
+    streamed session by session: header(), session() for every session,
+    then finish() with the rest of the document.
+    """
+
+    def __init__(self, level=COMPRESSION_LEVEL):
+        self.level = level
+        self.offset = 0
+        self.sessions = []
+
+    def header(self):
+        self.offset = len(MAGIC)
+        return MAGIC
+
+    def _block(self, raw, pieces):
+        data = zlib.compress(raw, self.level)
+        pieces.append(data)
+        location = [self.offset, len(data)]
+        self.offset += len(data)
+        return location
+
+    def _table(self, rows, pieces):
+        names = []
+        for row in rows:
+            for name in row:
+                if name not in names:
+                    names.append(name)
+
+        columns = []
+        for name in names:
+            mask = [VALUE if row.get(name) is not None else (NULL if name in row else MISSING)
+                    for row in rows]
+            meta, raw, dictionary = _encode_column([row[name] for row in rows if row.get(name) is not None])
+            meta['name'] = name
+            meta['data'] = self._block(raw, pieces)
+            if dictionary is not None:
+                meta['dictionary'] = self._block(dictionary, pieces)
+            if any(mask):
+                meta['mask'] = self._block(bytes(mask), pieces)
+            columns.append(meta)
+        return {'rows': len(rows), 'columns': columns}
+
+    def session(self, session):
+        """
+        Encode one v2 session object
+
+        Args:
+            session: Session dictionary; every list of objects in it (laps,
+                tire_data, ...) is stored as a columnar table
+
+        Returns:
+            Bytes to append
+        """
+        if not isinstance(session, dict):
+            raise RcmeV3Error('Every session must be an object')
+        pieces = []
+        fields = {}
+        tables = {}
+        for key, value in session.items():
+            if _is_table(value):
+                fields[key] = None
+                tables[key] = self._table(value, pieces)
+            else:
+                fields[key] = value
+        self.sessions.append({'fields': fields, 'tables': tables})
+        return b''.join(pieces)
+
+    def finish(self, document):
+        """
+        Encode the index and trailer
+
+        Args:
+            document: The v2 document without its sessions (a 'sessions'
+                key, if present, only fixes their position)
+
+        Returns:
+            Bytes to append
+        """
+        document = dict(document)
+        if 'sessions' in document:
+            document['sessions'] = None
+        index = _json_text({'version': RCME_V3_VERSION, 'document': document, 'sessions': self.sessions})
+        index = zlib.compress(index.encode(), self.level)
+        return index + TRAILER.pack(self.offset, len(index)) + MAGIC
+
+
+def encode(document):
+    """Encode a whole v2 document as .rcme v3 bytes"""
+    if not isinstance(document, dict) or not isinstance(document.get('sessions', []), list):
+        raise RcmeV3Error('Expected an .rcme document with a list of sessions')
+    writer = RcmeV3Writer()
+    pieces = [writer.header()]
+    pieces.extend(writer.session(session) for session in document.get('sessions', []))
+    pieces.append(writer.finish(document))
+    return b''.join(pieces)
+
+
+class RcmeV3Reader:
+    """
+    Random-access reader over a memory-mapped .rcme v3 file
+
+    Args:
+        source: Path, open binary file, or bytes-like object
+    """
+
+    def __init__(self, source):
+        self._file = None
+        self._map = None
+        self.data = None
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.data = memoryview(source)
+        else:
+            if isinstance(source, str):
+                source = self._file = open(source, 'rb')
+            try:
+                self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                self.close()
+                raise RcmeV3Error('Not an .rcme v3 file')
+            self.data = memoryview(self._map)
+
+        size = len(self.data)
+        if size < len(MAGIC) + TRAILER.size + len(MAGIC) or not is_v3(self.data) or \
+                bytes(self.data[size - len(MAGIC):]) != MAGIC:
+            self.close()
+            raise RcmeV3Error('Not an .rcme v3 file')
+        offset, length = TRAILER.unpack(self.data[size - len(MAGIC) - TRAILER.size:size - len(MAGIC)])
+        try:
+            index = json.loads(self._inflate([offset, length]))
+            if not str(index.get('version', '')).startswith('3'):
+                raise RcmeV3Error(f"Unsupported .rcme version: {index.get('version')}")
+            # The v2 document without its sessions
+            self.document = index['document']
+            self.session_index = index['sessions']
+            if not isinstance(self.document, dict) or not all(
+                    isinstance(entry['fields'], dict) and isinstance(entry['tables'], dict)
+                    for entry in self.session_index):
+                raise RcmeV3Error('Corrupt .rcme v3 index')
+        except RcmeV3Error:
+            self.close()
+            raise
+        except (AttributeError,) + DECODE_ERRORS as e:
+            self.close()
+            raise RcmeV3Error(f'Corrupt .rcme v3 index: {e!r}')
+
+    def close(self):
+        if self.data is not None:
+            self.data.release()
+            self.data = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _inflate(self, location):
+        offset, length = location
+        if offset + length > len(self.data):
+            raise RcmeV3Error('Truncated .rcme v3 file')
+        try:
+            return zlib.decompress(self.data[offset:offset + length])
+        except zlib.error as e:
+            raise RcmeV3Error(f'Corrupt .rcme v3 block: {e}')
+
+    def __len__(self):
+        return len(self.session_index)
+
+    def _column(self, meta, rows):
+        try:
+            dictionary = self._inflate(meta['dictionary']) if 'dictionary' in meta else None
+            values = _decode_column(meta, self._inflate(meta['data']), dictionary)
+            mask = None
+            if 'mask' in meta:
+                mask = self._inflate(meta['mask'])
+                flags = iter(values)
+                values = [next(flags) if flag == VALUE else None for flag in mask]
+        except RcmeV3Error:
+            raise
+        except DECODE_ERRORS as e:
+            raise RcmeV3Error(f'Corrupt .rcme v3 column {meta.get("name")!r}: {e!r}')
+        if len(values) != rows:
+            raise RcmeV3Error(f'Corrupt .rcme v3 column {meta.get("name")!r}: '
+                              f'{len(values)} values for {rows} rows')
+        return values, mask
+
+    def _table_meta(self, index, table):
+        """Row count and column metadata of one table"""
+        try:
+            meta = self.session_index[index]['tables'][table]
+            columns = list(meta['columns'])
+            if not all(isinstance(column, dict) and isinstance(column['name'], str) for column in columns):
+                raise TypeError('column without a name')
+            return int(meta['rows']), columns
+        except DECODE_ERRORS as e:
+            raise RcmeV3Error(f'Corrupt .rcme v3 table {table!r}: {e!r}')
+
+    def columns(self, index, table, names=None):
+        """
+        Decode columns of one table without building row objects
+
+        Args:
+            index: Session position in the file
+            table: Table key in the session ('laps', 'tire_data', ...)
+            names: Columns to decode (default: all)
+
+        Returns:
+            {name: [values]} with None for nulls and missing keys
+        """
+        rows, columns = self._table_meta(index, table)
+        return {
+            column['name']: self._column(column, rows)[0]
+            for column in columns if names is None or column['name'] in names
+        }
+
+    def table(self, index, table):
+        """Rows of one table as v2 objects"""
+        count, columns = self._table_meta(index, table)
+        rows = [{} for _ in range(count)]
+        for column in columns:
+            values, mask = self._column(column, count)
+            name = column['name']
+            for position, (row, value) in enumerate(zip(rows, values)):
+                if mask is None or mask[position] != MISSING:
+                    row[name] = value
+        return rows
+
+    def session(self, index):
+        """One session as a v2 object, decoding only its own blocks"""
+        entry = self.session_index[index]
+        return {
+            key: self.table(index, key) if key in entry['tables'] else value
+            for key, value in entry['fields'].items()
+        }
+
+    def to_v2(self):
+        """The whole file as the v2 document it was written from"""
+        document = dict(self.document)
+        if 'sessions' in document:
+            document['sessions'] = [self.session(index) for index in range(len(self))]
+        return document
@@ -0,0 +1,82 @@
+"""
+Row serialization
+Encodes query results fetched as plain tuples, skipping ORM objects and
+to_dict(). Uses orjson when it is installed and the standard library
+encoder otherwise; the output is the same either way (timestamps in ISO
+8601, as to_dict() writes them).
+
+Large arrays are streamed in chunks so memory stays flat whatever the
+number of rows. The columnar shape returns {"count": n, "columns": {name:
+[values]}} for chart consumers.
+"""
+
+import json
+from datetime import date, datetime
+
+try:
+    import orjson
+except ImportError:  # optional, faster encoder
+    orjson = None
+
+ROW_SHAPE = 'rows'
+COLUMNAR_SHAPE = 'columnar'
+SHAPES = (ROW_SHAPE, COLUMNAR_SHAPE)
+
+# Rows encoded per chunk of a streamed array
+CHUNK_ROWS = 500
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    def dumps(value):
+        """Encode a value as compact JSON bytes"""
+        return orjson.dumps(value, default=_default)
+else:
+    _encoder = json.JSONEncoder(separators=(',', ':'), default=_default)
+
+    def dumps(value):
+        """Encode a value as compact JSON bytes"""
+        return _encoder.encode(value).encode()
+
+
+def iter_rows(names, rows, chunk_rows=CHUNK_ROWS):
+    """
+    Encode rows as a JSON array of objects, chunk by chunk
+
+    Args:
+        names: Key of each tuple position
+        rows: Iterable of tuples, consumed lazily
+        chunk_rows: Rows per yielded chunk
+
+    Yields:
+        Pieces of the JSON document as bytes
+    """
+    yield b'['
+    first = True
+    chunk = []
+    for row in rows:
+        chunk.append(dict(zip(names, row)))
+        if len(chunk) >= chunk_rows:
+            body = dumps(chunk)[1:-1]
+            yield body if first else b',' + body
+            first = False
+            chunk = []
+    if chunk:
+        body = dumps(chunk)[1:-1]
+        yield body if first else b',' + body
+    yield b']'
+
+
+def columnar(names, rows):
+    """Rows as {"count": n, "columns": {name: [values]}}"""
+    rows = list(rows)
+    columns = zip(*rows) if rows else [()] * len(names)
+    return {
+        'count': len(rows),
+        'columns': {name: list(values) for name, values in zip(names, columns)}
+    }
@@ -0,0 +1,298 @@
+"""
+Monte Carlo race simulation
+Runs the calculate_race_time model many times with caution periods,
+pit-loss variation and lap-time noise drawn at random
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from calculations import RacingCalculations
+
+# Caution states recorded in Session.session_status / Lap.lap_status.
+# probability: chance that a caution of this type starts on a green lap
+# mean_laps: average caution length in laps
+# lap_time_factor: lap time multiplier while the caution is out
+# pit_loss_factor: pit stop time multiplier when pitting under the caution
+DEFAULT_CAUTIONS = {
+    'FCY': {'probability': 0.010, 'mean_laps': 2, 'lap_time_factor': 1.35, 'pit_loss_factor': 0.6},
+    'SC': {'probability': 0.008, 'mean_laps': 4, 'lap_time_factor': 1.50, 'pit_loss_factor': 0.5},
+}
+
+# Races simulated per task sent to the process pool. The chunking only
+# depends on the number of races, so results are reproducible for a given
+# seed whatever the number of workers.
+DEFAULT_CHUNK_SIZE = 5000
+
+# Seeds drawn when none is given stay below 2**53, so a JSON client can send
+# the reported seed back exactly (a JavaScript number holds 53 bits)
+MAX_DRAWN_SEED = 2 ** 53
+
+# Largest simulation run for one request. Every race keeps a finishing time
+# per candidate first pit lap, so memory grows as n_races x candidates.
+MAX_RACES = 200000
+MAX_RACE_TIMES = 10000000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def simulate_race(laps, base_lap_time, fuel_per_lap, initial_fuel, fuel_effect=0.035,
+                  pit_stop_time=25, n_races=100000, lap_time_sigma=0.4, pit_time_sigma=2.0,
+                  cautions=None, seed=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Simulate a race many times and compare every possible first pit lap
+
+    The car follows the calculate_race_time rule (full tank, pit before
+    the fuel drops below the refuel threshold) but may take its first stop
+    earlier; later stops follow at full-stint intervals. Each simulated race
+    draws its own caution periods, pit stop times and lap-time noise, and
+    every candidate first pit lap is evaluated against the same draws.
+
+    Args:
+        laps: Total race laps
+        base_lap_time: Base lap time in seconds
+        fuel_per_lap: Fuel consumption per lap in liters
+        initial_fuel: Starting fuel in liters
+        fuel_effect: Time penalty per kg of fuel
+        pit_stop_time: Mean pit stop duration in seconds
+        n_races: Number of simulated races
+        lap_time_sigma: Standard deviation of a single lap time in seconds
+        pit_time_sigma: Standard deviation of a pit stop in seconds
+        cautions: Caution model keyed by status (see DEFAULT_CAUTIONS)
+        seed: Seed for reproducible results (drawn at random when None;
+            the seed used is returned with the results)
+        workers: Worker processes (defaults to the number of CPUs); above
+            one, chunks run on the shared pool of one process per CPU
+        chunk_size: Races simulated per worker task
+
+    Returns:
+        Dictionary with finishing time distributions and the best pit lap
+    """
+    if laps < 1 or n_races < 1:
+        raise ValueError('laps and n_races must be positive')
+    if n_races > MAX_RACES:
+        raise ValueError(f'n_races must be at most {MAX_RACES}')
+
+    cautions = DEFAULT_CAUTIONS if cautions is None else cautions
+    if seed is None:
+        seed = int(np.random.default_rng().integers(MAX_DRAWN_SEED))
+    seed_sequence = np.random.SeedSequence(seed)
+
+    stint_laps = RacingCalculations._laps_per_stint(initial_fuel, fuel_per_lap, laps)
+    if stint_laps >= laps:
+        # The fuel lasts the whole race: the only plan is not to stop
+        candidates = np.array([laps])
+    else:
+        # Candidate first stops: lap 1 up to the last lap the fuel allows
+        candidates = np.arange(1, stint_laps + 1)
+    if n_races * len(candidates) > MAX_RACE_TIMES:
+        raise ValueError(f'n_races x candidate pit laps ({len(candidates)}) '
+                         f'must be at most {MAX_RACE_TIMES}')
+    fuel_times = np.array([
+        _fuel_limited_time(laps, first_stop, stint_laps, base_lap_time, fuel_per_lap,
+                           initial_fuel, fuel_effect)
+        for first_stop in candidates
+    ])
+
+    params = {
+        'laps': int(laps),
+        'base_lap_time': float(base_lap_time),
+        'pit_stop_time': float(pit_stop_time),
+        'lap_time_sigma': float(lap_time_sigma),
+        'pit_time_sigma': float(pit_time_sigma),
+        'stint_laps': int(stint_laps),
+        'candidates': candidates,
+        'cautions': cautions,
+    }
+
+    sizes = [chunk_size] * (n_races // chunk_size)
+    if n_races % chunk_size:
+        sizes.append(n_races % chunk_size)
+    tasks = list(zip(sizes, seed_sequence.spawn(len(sizes))))
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers > 1:
+        executor = _get_executor()
+        chunks = list(executor.map(_simulate_chunk, [params] * len(tasks), *zip(*tasks)))
+    else:
+        chunks = [_simulate_chunk(params, size, child) for size, child in tasks]
+
+    # Per-race totals for every candidate, relative to the fuel-free green race
+    totals = np.concatenate([chunk[0] for chunk in chunks]).astype(float) + fuel_times
+    caution_laps = np.concatenate([chunk[1] for chunk in chunks])
+    reference = laps * base_lap_time
+
+    mean_by_candidate = totals.mean(axis=0)
+    best = int(np.argmin(mean_by_candidate))
+    baseline = len(candidates) - 1
+    hindsight_best = candidates[np.argmin(totals, axis=1)]
+    lap_values, lap_counts = np.unique(hindsight_best, return_counts=True)
+
+    return {
+        'n_races': int(n_races),
+        'seed': seed,
+        'stint_laps': int(stint_laps),
+        'best_pit_lap': int(candidates[best]) if stint_laps < laps else None,
+        'baseline_pit_lap': int(candidates[baseline]) if stint_laps < laps else None,
+        'finishing_time': _distribution(totals[:, best] + reference),
+        'baseline_finishing_time': _distribution(totals[:, baseline] + reference),
+        'mean_time_by_pit_lap': {
+            int(lap): round(float(value + reference), 2)
+            for lap, value in zip(candidates, mean_by_candidate)
+        },
+        'hindsight_best_pit_lap': {
+            int(lap): round(float(count) / n_races, 4)
+            for lap, count in zip(lap_values, lap_counts)
+        },
+        'average_caution_laps': round(float(caution_laps.mean()), 2)
+    }
+
+
+def estimate_cautions(lap_status_sequences, defaults=None):
+    """
+    Estimate caution probabilities from recorded lap statuses
+
+    Only the statuses in the caution model (FCY and SC by default) are
+    estimated. Other statuses (RF, TFC) are ignored rather than simulated,
+    except that their laps do not count as green laps.
+
+    Args:
+        lap_status_sequences: One list of Lap.lap_status values per session,
+            in lap order (None for green laps)
+        defaults: Caution model providing the lap time and pit loss factors
+
+    Returns:
+        Caution model suitable for simulate_race
+    """
+    defaults = DEFAULT_CAUTIONS if defaults is None else defaults
+    green_laps = 0
+    starts = {}
+    lengths = {}
+
+    for statuses in lap_status_sequences:
+        previous = None
+        for status in statuses:
+            status = status or None
+            if previous is None:
+                green_laps += 1
+            if status is not None and status != previous:
+                starts[status] = starts.get(status, 0) + 1
+            if status is not None:
+                lengths[status] = lengths.get(status, 0) + 1
+            previous = status
+
+    cautions = {}
+    for status, template in defaults.items():
+        count = starts.get(status, 0)
+        cautions[status] = dict(
+            template,
+            probability=count / green_laps if green_laps else 0.0,
+            mean_laps=lengths[status] / count if count else template['mean_laps']
+        )
+    return cautions
+
+
+def _fuel_limited_time(laps, first_stop, stint_laps, base_lap_time, fuel_per_lap,
+                       initial_fuel, fuel_effect):
+    """Fuel weight penalty over the whole race for a given first stop lap"""
+    if first_stop >= laps:
+        return RacingCalculations._stint_time(laps, 0, fuel_per_lap, initial_fuel, fuel_effect)
+
+    remaining = laps - first_stop
+    full_stints = (remaining - 1) // stint_laps
+    last_stint = remaining - full_stints * stint_laps
+    return (
+        RacingCalculations._stint_time(first_stop, 0, fuel_per_lap, initial_fuel, fuel_effect)
+        + full_stints * RacingCalculations._stint_time(stint_laps, 0, fuel_per_lap, initial_fuel, fuel_effect)
+        + RacingCalculations._stint_time(last_stint, 0, fuel_per_lap, initial_fuel, fuel_effect)
+    )
+
+
+def _simulate_chunk(params, n_races, seed_sequence):
+    """
+    Simulate one chunk of races
+
+    Returns the time of every race and candidate on top of the green,
+    fuel-free race (float32), and the number of caution laps per race.
+    """
+    rng = np.random.default_rng(seed_sequence)
+    laps = params['laps']
+    base_lap_time = params['base_lap_time']
+
+    # Laps run along the first axis so every lap is one contiguous row
+    lap_factor = np.ones((laps, n_races), dtype=np.float32)
+    pit_factor = np.ones((laps, n_races), dtype=np.float32)
+
+    cautions = list(params['cautions'].values())
+    if cautions:
+        bounds = np.cumsum([c['probability'] for c in cautions])
+        mean_laps = np.maximum([c['mean_laps'] for c in cautions], 1)
+        # Index len(cautions) stands for a green lap
+        lap_factors = np.array([c['lap_time_factor'] for c in cautions] + [1.0], dtype=np.float32)
+        pit_factors = np.array([c['pit_loss_factor'] for c in cautions] + [1.0], dtype=np.float32)
+
+        remaining = np.zeros(n_races, dtype=np.int64)
+        active = np.full(n_races, len(cautions), dtype=np.int64)
+        for lap in range(laps):
+            remaining = np.maximum(remaining - 1, 0)
+            kind = np.searchsorted(bounds, rng.random(n_races), side='right')
+            new = (remaining == 0) & (kind < len(cautions))
+            if new.any():
+                active[new] = kind[new]
+                remaining[new] = rng.geometric(1.0 / mean_laps[kind[new]])
+            current = np.where(remaining > 0, active, len(cautions))
+            lap_factor[lap] = lap_factors[current]
+            pit_factor[lap] = pit_factors[current]
+
+    caution_laps = (lap_factor != 1).sum(axis=0)
+    common = (
+        (lap_factor.sum(axis=0, dtype=float) - laps) * base_lap_time
+        + rng.normal(0.0, params['lap_time_sigma'] * np.sqrt(laps), n_races)
+    )
+
+    pit_cost = np.maximum(
+        rng.normal(params['pit_stop_time'], params['pit_time_sigma'], (laps, n_races)), 0
+    ) * pit_factor
+
+    # Stopping at the end of lap n costs pit_cost[n - 1]; no stop on the last lap
+    candidates = params['candidates']
+    totals = np.empty((n_races, len(candidates)), dtype=np.float32)
+    for i, first_stop in enumerate(candidates):
+        stops = np.arange(first_stop - 1, laps - 1, params['stint_laps'])
+        totals[:, i] = common + pit_cost[stops].sum(axis=0)
+
+    return totals, caution_laps
+
+
+def _distribution(values):
+    """Summary statistics of a sample of finishing times"""
+    percentiles = np.percentile(values, [5, 25, 50, 75, 95])
+    return {
+        'mean': round(float(values.mean()), 2),
+        'std': round(float(values.std()), 2),
+        'min': round(float(values.min()), 2),
+        'max': round(float(values.max()), 2),
+        'p5': round(float(percentiles[0]), 2),
+        'p25': round(float(percentiles[1]), 2),
+        'p50': round(float(percentiles[2]), 2),
+        'p75': round(float(percentiles[3]), 2),
+        'p95': round(float(percentiles[4]), 2)
+    }
+
+
+def _get_executor():
+    """
+    Process pool shared by all simulations
+
+    Created once with one process per CPU and never replaced, since other
+    request threads may be mapping on it.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        return _executor
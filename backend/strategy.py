@@ -0,0 +1,205 @@
+"""
+Pit strategy optimizer
+Searches pit laps, fuel loads and tire changes with dynamic programming,
+combining the fuel-weight penalty of calculate_lap_time_with_fuel with the
+tire wear model of calculate_tire_wear
+"""
+
+import heapq
+
+import numpy as np
+
+from calculations import RacingCalculations
+
+# The search does about laps x stint window x top_k work; larger problems are
+# refused rather than tying up a worker
+MAX_SEARCH_SIZE = 250000
+
+
+def optimize_pit_strategy(laps, base_lap_time, fuel_per_lap, fuel_tank_capacity,
+                          tire_life_laps, pit_stop_time=25, tire_change_time=0,
+                          refuel_rate=None, fuel_effect=0.035, tire_degradation=2.0,
+                          wear_rate=1.0, minimum_fuel=5, initial_tire_age=0, top_k=5):
+    """
+    Find the fastest pit strategy and the next best alternatives
+
+    Every stint carries exactly the fuel it needs plus minimum_fuel. Lap
+    time grows with the fuel load and with tire wear: a tire worn to 100%
+    (calculate_tire_wear) costs tire_degradation seconds per lap, and no
+    tire may be run beyond 100% wear. At each stop the team may change
+    tires or not.
+
+    The search walks the race lap by lap. A state is the end of a stint:
+    (lap, tire age, time). For each lap only the states that fewer than
+    top_k other states beat on both tire age and time are kept; every other
+    state can only lead to slower plans. Each stint is costed in closed form.
+
+    Args:
+        laps: Total race laps
+        base_lap_time: Lap time in seconds on new tires with no fuel
+        fuel_per_lap: Fuel consumption per lap in liters
+        fuel_tank_capacity: Maximum fuel capacity in liters
+        tire_life_laps: Expected tire life in laps
+        pit_stop_time: Pit stop time loss in seconds
+        tire_change_time: Extra time in seconds when tires are changed
+        refuel_rate: Refuel speed in liters per second (None: included in pit_stop_time)
+        fuel_effect: Time penalty per kg of fuel (seconds)
+        tire_degradation: Lap time loss in seconds at 100% tire wear
+        wear_rate: Wear multiplier (1.0 = normal, >1 = faster wear)
+        minimum_fuel: Fuel left in the tank at the end of every stint (liters)
+        initial_tire_age: Laps already on the starting tires
+        top_k: Number of plans to return
+
+    Returns:
+        Dictionary with the best plan and the alternatives
+    """
+    laps = int(laps)
+    top_k = max(1, int(top_k))
+    max_fuel_laps = int((fuel_tank_capacity - minimum_fuel) // fuel_per_lap) if fuel_per_lap > 0 else laps
+    max_tire_age = int(tire_life_laps / wear_rate) if wear_rate > 0 else laps + initial_tire_age
+    if laps < 1:
+        raise ValueError('laps must be positive')
+    if max_fuel_laps < 1:
+        raise ValueError('The tank cannot hold enough fuel for a single lap')
+    if max_tire_age < 1 or initial_tire_age > max_tire_age:
+        raise ValueError('The tires cannot last a single lap')
+
+    # No stint can outlast the tank or the tires
+    window = min(max_fuel_laps, max_tire_age, laps)
+    if laps * window * top_k > MAX_SEARCH_SIZE:
+        raise ValueError(f'Search too large: laps x longest stint x top_k is '
+                         f'{laps * window * top_k}, at most {MAX_SEARCH_SIZE}')
+    fuel_cost = RacingCalculations.FUEL_DENSITY * fuel_effect
+    wear_cost = tire_degradation * wear_rate / tire_life_laps if tire_life_laps > 0 else 0.0
+
+    def stint_time(n, age):
+        # Lap j of the stint starts with (n - j) laps of fuel plus the reserve
+        # on board and tires that have done age + j laps
+        fuel_liters = n * minimum_fuel + fuel_per_lap * n * (n + 1) / 2
+        tire_laps = n * age + n * (n - 1) / 2
+        return n * base_lap_time + fuel_liters * fuel_cost + tire_laps * wear_cost
+
+    def pit_time(n):
+        return pit_stop_time + (n * fuel_per_lap / refuel_rate if refuel_rate else 0)
+
+    # States reached at the end of each lap, as parallel arrays. Every state
+    # has a global id so plans can be rebuilt from the parent links.
+    times = [np.array([0.0])]
+    ages = [np.array([initial_tire_age])]
+    ids = [np.array([0])]
+    origins = [np.array([0])]
+    parents, stints, tire_changes = [np.array([-1])], [np.array([0])], [np.array([False])]
+    next_id = 1
+
+    for lap in range(1, laps + 1):
+        # Every state a single stint away can end its stint on this lap
+        first = max(0, lap - window)
+        source_time = np.concatenate(times[first:lap])
+        source_age = np.concatenate(ages[first:lap])
+        source_id = np.concatenate(ids[first:lap])
+        n = lap - np.concatenate(origins[first:lap])
+        from_start = n == lap
+        pit = np.where(from_start, 0.0, pit_time(n))
+
+        keep = source_age + n <= max_tire_age
+        change = ~from_start & (n <= max_tire_age)
+        time = np.concatenate([
+            (source_time + stint_time(n, source_age) + pit)[keep],
+            (source_time + stint_time(n, 0) + pit + tire_change_time)[change]
+        ])
+        age = np.concatenate([(source_age + n)[keep], n[change]])
+        parent = np.concatenate([source_id[keep], source_id[change]])
+        length = np.concatenate([n[keep], n[change]])
+        changed = np.concatenate([np.zeros(keep.sum(), dtype=bool), np.ones(change.sum(), dtype=bool)])
+
+        if lap == laps:
+            # Tire age no longer matters once the race is over
+            selected = np.argsort(time, kind='stable')[:top_k]
+        else:
+            selected = _prune(time, age, top_k)
+
+        count = len(selected)
+        times.append(time[selected])
+        ages.append(age[selected])
+        ids.append(np.arange(next_id, next_id + count))
+        origins.append(np.full(count, lap))
+        parents.append(parent[selected])
+        stints.append(length[selected])
+        tire_changes.append(changed[selected])
+        next_id += count
+
+    if not len(times[laps]):
+        raise ValueError('No strategy can finish the race')
+
+    links = {
+        'parent': np.concatenate(parents),
+        'laps': np.concatenate(stints),
+        'new_tires': np.concatenate(tire_changes),
+        'age': np.concatenate(ages)
+    }
+    plans = [
+        _plan(int(state_id), float(total), links, fuel_per_lap, minimum_fuel)
+        for state_id, total in zip(ids[laps], times[laps])
+    ]
+    return dict(plans[0], alternatives=plans[1:])
+
+
+def _prune(times, ages, top_k):
+    """
+    Indices of the states that fewer than top_k others beat on both tire
+    age and time
+
+    Any other state cannot be part of the top_k plans: every way to finish
+    the race from it finishes at least as fast from each of those others.
+    """
+    order = np.lexsort((times, ages))
+    if not len(order):
+        return order
+
+    # Only the top_k fastest states of each tire age can survive
+    sorted_ages = ages[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_ages[1:] != sorted_ages[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(order)])
+    rank = np.arange(len(order)) - np.repeat(group_starts, group_sizes)
+    order = order[rank < top_k]
+
+    kept = []
+    fastest = []  # max-heap (negated) of the top_k fastest times seen so far
+    for index, time in zip(order.tolist(), times[order].tolist()):
+        if len(fastest) < top_k or time < -fastest[0]:
+            kept.append(index)
+            heapq.heappush(fastest, -time)
+            if len(fastest) > top_k:
+                heapq.heappop(fastest)
+    return np.array(kept, dtype=np.int64)
+
+
+def _plan(state_id, total_time, links, fuel_per_lap, minimum_fuel):
+    """Rebuild the stints of a finished state from the parent links"""
+    chain = []
+    while links['parent'][state_id] >= 0:
+        chain.append(state_id)
+        state_id = links['parent'][state_id]
+    chain.reverse()
+
+    result = []
+    lap = 0
+    for state_id in chain:
+        n = int(links['laps'][state_id])
+        result.append({
+            'start_lap': lap + 1,
+            'end_lap': lap + n,
+            'laps': n,
+            'fuel_load': round(n * fuel_per_lap + minimum_fuel, 2),
+            'new_tires': bool(links['new_tires'][state_id]),
+            'tire_age_start': int(links['age'][state_id]) - n
+        })
+        lap += n
+
+    return {
+        'total_time_seconds': round(total_time, 2),
+        'total_time_formatted': RacingCalculations.format_time(total_time),
+        'pit_stops': len(result) - 1,
+        'pit_laps': [stint['end_lap'] for stint in result[:-1]],
+        'stints': result
+    }
@@ -0,0 +1,448 @@
+"""
+High-frequency telemetry storage
+Each channel of a session is stored as a sequence of chunks of up to
+chunk_size samples. A chunk row carries its time range, sample count and
+min/max value, and one zlib block holding:
+- the sample times as unsigned 32-bit deltas in milliseconds (the first
+  one from the chunk's start_ms, so it is 0), and
+- the values in the channel's dtype, byte-shuffled (all first bytes, then
+  all second bytes, ...) so slowly changing signals compress well.
+
+Samples are only ever appended after the channel's last sample: new
+samples top up the last chunk until it is full, then start new ones. A
+range read selects the chunks overlapping the range through the
+(channel_id, end_ms) index and decodes only those.
+
+When a session is closed, build_pyramid stores min/max pyramid levels of
+each channel (buckets of PYRAMID_BASE samples, then PYRAMID_FACTOR times
+larger at each level), so downsampled reads of long ranges decode a few
+thousand buckets instead of every sample.
+
+Times are integer milliseconds on the logger's clock (typically from the
+start of the session).
+"""
+
+import os
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+from downsampling import lttb, minmax, minmax_points, minmax_reduce
+from models import db, TelemetryChannel, TelemetryChunk, TelemetryLevel
+
+TELEMETRY_CHUNK_SIZE = int(os.environ.get('TELEMETRY_CHUNK_SIZE', 4096))
+# Raw range reads over more samples than this are refused
+TELEMETRY_MAX_RANGE_SAMPLES = int(os.environ.get('TELEMETRY_MAX_RANGE_SAMPLES', 1000000))
+
+# Points a downsampled read may return
+TELEMETRY_MAX_POINTS = int(os.environ.get('TELEMETRY_MAX_POINTS', 20000))
+
+COMPRESSION_LEVEL = 6
+
+# Raw samples per bucket of pyramid level 1, and the growth per level
+PYRAMID_BASE = 64
+PYRAMID_FACTOR = 8
+# The coarsest level stored has fewer buckets than this
+PYRAMID_MIN_BUCKETS = 512
+# Buckets per stored row of a level
+LEVEL_CHUNK_BUCKETS = 4096
+# LTTB picks from at least this many candidate points per output point
+LTTB_OVERSAMPLING = 4
+
+METHODS = ('minmax', 'lttb')
+
+DTYPES = {
+    'float32': '<f4',
+    'float64': '<f8',
+    'int16': '<i2',
+    'int32': '<i4',
+}
+
+MAX_NAME_LENGTH = 100
+
+
+class TelemetryError(ValueError):
+    """Raised for telemetry that cannot be stored or read as requested"""
+
+
+def _shuffle(values):
+    """Bytes of an array, all first bytes first, then all second bytes, ..."""
+    return values.view(np.uint8).reshape(len(values), values.itemsize).T.tobytes()
+
+
+def _unshuffle(raw, offset, count, dtype):
+    itemsize = np.dtype(dtype).itemsize
+    shuffled = np.frombuffer(raw, dtype=np.uint8, count=count * itemsize, offset=offset)
+    return np.ascontiguousarray(shuffled.reshape(itemsize, count).T).view(dtype).ravel()
+
+
+def encode_chunk(times, values):
+    """
+    Compress the samples of one chunk
+
+    Args:
+        times: int64 array of strictly increasing times (ms)
+        values: Array in the channel's storage dtype
+
+    Returns:
+        zlib-compressed bytes
+    """
+    deltas = np.diff(times, prepend=times[0]).astype('<u4')
+    return zlib.compress(deltas.tobytes() + _shuffle(values), COMPRESSION_LEVEL)
+
+
+def decode_chunk(data, start_ms, sample_count, dtype):
+    """
+    Inverse of encode_chunk
+
+    Returns:
+        (int64 times, values in the storage dtype)
+    """
+    raw = zlib.decompress(data)
+    deltas = np.frombuffer(raw, dtype='<u4', count=sample_count)
+    times = np.cumsum(deltas, dtype=np.int64) + start_ms
+    return times, _unshuffle(raw, deltas.nbytes, sample_count, dtype)
+
+
+def _chunk_row(channel, sequence, times, values):
+    row = {
+        'channel_id': channel.id,
+        'sequence': sequence,
+        'start_ms': int(times[0]),
+        'end_ms': int(times[-1]),
+        'sample_count': len(times),
+        'min_value': None,
+        'max_value': None,
+        'data': encode_chunk(times, values),
+    }
+    finite = values[np.isfinite(values)] if values.dtype.kind == 'f' else values
+    if len(finite):
+        row['min_value'] = float(finite.min())
+        row['max_value'] = float(finite.max())
+    return row
+
+
+def get_or_create_channel(session_id, name, unit=None, dtype='float32', sample_rate=None):
+    """
+    Channel of a session, created on the first append
+
+    Args:
+        session_id: Session the channel belongs to
+        name: Channel name, unique within the session
+        unit: Unit label (only used when the channel is created)
+        dtype: Storage type, one of DTYPES
+        sample_rate: Nominal sample rate in Hz
+
+    Returns:
+        TelemetryChannel
+    """
+    if not isinstance(name, str) or not name.strip() or len(name) > MAX_NAME_LENGTH:
+        raise TelemetryError(f'name must be a non-empty string of at most {MAX_NAME_LENGTH} characters')
+    if dtype not in DTYPES:
+        raise TelemetryError(f"dtype must be one of {', '.join(DTYPES)}")
+    channel = db.session.execute(
+        db.select(TelemetryChannel).where(TelemetryChannel.session_id == session_id,
+                                          TelemetryChannel.name == name)
+    ).scalar_one_or_none()
+    if channel is None:
+        channel = TelemetryChannel(session_id=session_id, name=name, unit=unit, dtype=dtype,
+                                   sample_rate=sample_rate, chunk_size=TELEMETRY_CHUNK_SIZE,
+                                   sample_count=0, chunk_count=0)
+        db.session.add(channel)
+        db.session.flush()
+    elif channel.dtype != dtype:
+        raise TelemetryError(f'channel {name} stores {channel.dtype}, not {dtype}')
+    return channel
+
+
+def sample_arrays(channel, times, values):
+    """
+    Validate samples sent for a channel and convert them to arrays
+
+    Args:
+        channel: TelemetryChannel the samples are for
+        times: Sample times in ms, strictly increasing and after the channel's last sample
+        values: One value per time (null for a missing float reading)
+
+    Returns:
+        (int64 times, values in the storage dtype)
+    """
+    if not isinstance(times, list) or not isinstance(values, list) or len(times) != len(values):
+        raise TelemetryError('t and v must be lists of the same length')
+    try:
+        # Without a dtype numpy keeps fractions and numbers beyond int64 out
+        # of the integer kind instead of truncating them
+        times = np.array(times)
+        if len(times) and times.dtype.kind != 'i':
+            raise TypeError(times.dtype)
+        times = times.astype(np.int64)
+        values = np.array(values, dtype=DTYPES[channel.dtype])
+    except (TypeError, ValueError, OverflowError):
+        raise TelemetryError(f'{channel.name}: t must be integers and v {channel.dtype} values')
+    if len(times) and np.any(np.diff(times) <= 0):
+        raise TelemetryError(f'{channel.name}: times must be strictly increasing')
+    if len(times) and channel.end_ms is not None and times[0] <= channel.end_ms:
+        raise TelemetryError(f'{channel.name}: samples must come after {channel.end_ms} ms (append only)')
+    if len(times) > 1 and np.diff(times).max() > 0xFFFFFFFF:
+        raise TelemetryError(f'{channel.name}: gap between samples is too large')
+    return times, values
+
+
+def append_samples(channel, times, values):
+    """
+    Append samples to a channel, inside the caller's transaction
+
+    Args:
+        channel: TelemetryChannel to append to
+        times, values: Arrays from sample_arrays
+
+    Returns:
+        Number of samples appended
+    """
+    count = len(times)
+    if not count:
+        return 0
+    sequence = channel.chunk_count
+    if channel.chunk_count and channel.sample_count % channel.chunk_size:
+        # Top up the last chunk, which is not full yet
+        tail = db.session.execute(
+            db.select(TelemetryChunk).where(TelemetryChunk.channel_id == channel.id,
+                                            TelemetryChunk.sequence == channel.chunk_count - 1)
+        ).scalar_one()
+        tail_times, tail_values = decode_chunk(tail.data, tail.start_ms, tail.sample_count,
+                                               DTYPES[channel.dtype])
+        times = np.concatenate([tail_times, times])
+        values = np.concatenate([tail_values, values])
+        sequence = tail.sequence
+        db.session.delete(tail)
+        db.session.flush()
+
+    rows = [
+        _chunk_row(channel, sequence + index, times[offset:offset + channel.chunk_size],
+                   values[offset:offset + channel.chunk_size])
+        for index, offset in enumerate(range(0, len(times), channel.chunk_size))
+    ]
+    db.session.execute(db.insert(TelemetryChunk), rows)
+
+    channel.sample_count += count
+    channel.chunk_count = sequence + len(rows)
+    if channel.start_ms is None:
+        channel.start_ms = rows[0]['start_ms']
+    channel.end_ms = rows[-1]['end_ms']
+    channel.updated_at = datetime.utcnow()
+    return count
+
+
+def _overlapping(model, channel, start_ms, end_ms):
+    """Filters selecting the rows of a chunked table that overlap a time range"""
+    return [model.channel_id == channel.id, model.end_ms >= start_ms, model.start_ms <= end_ms]
+
+
+def range_sample_count(channel, start_ms, end_ms):
+    """Samples in the chunks overlapping a range, without reading the chunks"""
+    return db.session.execute(
+        db.select(db.func.coalesce(db.func.sum(TelemetryChunk.sample_count), 0))
+        .where(*_overlapping(TelemetryChunk, channel, start_ms, end_ms))
+    ).scalar()
+
+
+def read_range(channel, start_ms=None, end_ms=None, max_samples=TELEMETRY_MAX_RANGE_SAMPLES):
+    """
+    Samples of a channel within [start_ms, end_ms]
+
+    Only the chunks overlapping the range are fetched and decompressed.
+
+    Args:
+        channel: TelemetryChannel to read
+        start_ms, end_ms: Inclusive bounds (None for the channel's start / end)
+        max_samples: Refuse ranges whose chunks hold more samples than this
+
+    Returns:
+        (int64 times, values) arrays
+    """
+    start_ms = channel.start_ms if start_ms is None else start_ms
+    end_ms = channel.end_ms if end_ms is None else end_ms
+    empty = np.array([], dtype=np.int64), np.array([], dtype=DTYPES[channel.dtype])
+    if channel.sample_count == 0 or start_ms > end_ms:
+        return empty
+
+    if max_samples is not None and range_sample_count(channel, start_ms, end_ms) > max_samples:
+        raise TelemetryError(f'the range holds more than {max_samples} samples; '
+                             'narrow it or ask for a downsampled series with points=')
+    chunks = db.session.execute(
+        db.select(TelemetryChunk.start_ms, TelemetryChunk.sample_count, TelemetryChunk.data)
+        .where(*_overlapping(TelemetryChunk, channel, start_ms, end_ms))
+        .order_by(TelemetryChunk.end_ms)
+    ).all()
+    if not chunks:
+        return empty
+
+    decoded = [decode_chunk(chunk.data, chunk.start_ms, chunk.sample_count, DTYPES[channel.dtype])
+               for chunk in chunks]
+    times = np.concatenate([chunk_times for chunk_times, _ in decoded])
+    values = np.concatenate([chunk_values for _, chunk_values in decoded])
+    # Only the first and last chunk can hold samples outside the range
+    first = np.searchsorted(times, start_ms, side='left')
+    last = np.searchsorted(times, end_ms, side='right')
+    return times[first:last], values[first:last]
+
+
+def json_values(values):
+    """Array values as a list, with NaN readings as None"""
+    if values.dtype.kind == 'f' and np.isnan(values).any():
+        return [None if value != value else value for value in values.tolist()]
+    return values.tolist()
+
+
+def _level_rows(channel, level, bucket_size, buckets):
+    """Rows of TelemetryLevel holding the buckets (t_min, v_min, t_max, v_max) of a level"""
+    dtype = DTYPES[channel.dtype]
+    rows = []
+    for sequence, offset in enumerate(range(0, len(buckets[0]), LEVEL_CHUNK_BUCKETS)):
+        t_min, v_min, t_max, v_max = [array[offset:offset + LEVEL_CHUNK_BUCKETS] for array in buckets]
+        start_ms = int(min(t_min[0], t_max[0]))
+        raw = ((t_min - start_ms).astype('<u4').tobytes() + (t_max - start_ms).astype('<u4').tobytes()
+               + _shuffle(v_min.astype(dtype)) + _shuffle(v_max.astype(dtype)))
+        rows.append({
+            'channel_id': channel.id,
+            'level': level,
+            'bucket_size': bucket_size,
+            'sequence': sequence,
+            'start_ms': start_ms,
+            'end_ms': int(max(t_min[-1], t_max[-1])),
+            'bucket_count': len(t_min),
+            'data': zlib.compress(raw, COMPRESSION_LEVEL),
+        })
+    return rows
+
+
+def _decode_level(row, dtype):
+    raw = zlib.decompress(row.data)
+    count = row.bucket_count
+    t_min = np.frombuffer(raw, dtype='<u4', count=count).astype(np.int64) + row.start_ms
+    t_max = np.frombuffer(raw, dtype='<u4', count=count, offset=4 * count).astype(np.int64) + row.start_ms
+    v_min = _unshuffle(raw, 8 * count, count, dtype)
+    v_max = _unshuffle(raw, 8 * count + v_min.nbytes, count, dtype)
+    return t_min, v_min, t_max, v_max
+
+
+def build_pyramid(channel):
+    """
+    Store the min/max pyramid levels of a channel, replacing older ones
+
+    Level 1 is built from the raw chunks one at a time, so memory holds
+    the level rather than the whole channel.
+
+    Args:
+        channel: TelemetryChannel to summarize
+
+    Returns:
+        Number of levels stored
+    """
+    db.session.execute(db.delete(TelemetryLevel).where(TelemetryLevel.channel_id == channel.id))
+    channel.updated_at = datetime.utcnow()
+    if channel.sample_count <= PYRAMID_BASE:
+        return 0
+
+    dtype = DTYPES[channel.dtype]
+    parts = []
+    carry_times, carry_values = np.array([], dtype=np.int64), np.array([], dtype=dtype)
+    chunks = db.session.execute(
+        db.select(TelemetryChunk.start_ms, TelemetryChunk.sample_count, TelemetryChunk.data)
+        .where(TelemetryChunk.channel_id == channel.id)
+        .order_by(TelemetryChunk.sequence)
+        .execution_options(yield_per=16)
+    )
+    for chunk in chunks:
+        times, values = decode_chunk(chunk.data, chunk.start_ms, chunk.sample_count, dtype)
+        times = np.concatenate([carry_times, times])
+        values = np.concatenate([carry_values, values])
+        # Whole buckets now, the rest with the next chunk
+        full = len(times) // PYRAMID_BASE * PYRAMID_BASE
+        if full:
+            parts.append(minmax_reduce(times[:full], values[:full], times[:full], values[:full], PYRAMID_BASE))
+        carry_times, carry_values = times[full:], values[full:]
+    if len(carry_times):
+        parts.append(minmax_reduce(carry_times, carry_values, carry_times, carry_values, PYRAMID_BASE))
+    buckets = [np.concatenate(arrays) for arrays in zip(*parts)]
+
+    level, bucket_size = 1, PYRAMID_BASE
+    while True:
+        db.session.execute(db.insert(TelemetryLevel), _level_rows(channel, level, bucket_size, buckets))
+        if len(buckets[0]) < PYRAMID_MIN_BUCKETS:
+            return level
+        buckets = minmax_reduce(*buckets, PYRAMID_FACTOR)
+        level, bucket_size = level + 1, bucket_size * PYRAMID_FACTOR
+
+
+def _pick_level(channel, wanted_size):
+    """Coarsest stored level whose buckets hold at most wanted_size samples, or None"""
+    return db.session.execute(
+        db.select(TelemetryLevel.level)
+        .where(TelemetryLevel.channel_id == channel.id, TelemetryLevel.bucket_size <= wanted_size)
+        .order_by(TelemetryLevel.level.desc())
+        .limit(1)
+    ).scalar()
+
+
+def _read_level(channel, level, start_ms, end_ms):
+    """Min/max points of a level's buckets within a range"""
+    rows = db.session.execute(
+        db.select(TelemetryLevel.start_ms, TelemetryLevel.bucket_count, TelemetryLevel.data)
+        .where(*_overlapping(TelemetryLevel, channel, start_ms, end_ms), TelemetryLevel.level == level)
+        .order_by(TelemetryLevel.end_ms)
+    ).all()
+    dtype = DTYPES[channel.dtype]
+    decoded = [_decode_level(row, dtype) for row in rows]
+    if not decoded:
+        return np.array([], dtype=np.int64), np.array([], dtype=dtype)
+    times, values = minmax_points(*[np.concatenate(arrays) for arrays in zip(*decoded)])
+    inside = (times >= start_ms) & (times <= end_ms)
+    return times[inside], values[inside]
+
+
+def read_downsampled(channel, start_ms=None, end_ms=None, points=1000, method='minmax'):
+    """
+    At most `points` points of a channel within a range, shape preserved
+
+    Ranges holding no more samples than the budget are returned raw. Larger
+    ones are downsampled from the coarsest pyramid level fine enough for the
+    budget, or from the raw samples when the session has no pyramid yet.
+
+    Args:
+        channel: TelemetryChannel to read
+        start_ms, end_ms: Inclusive bounds (None for the channel's start / end)
+        points: Point budget, typically the chart width in pixels
+        method: 'minmax' (keeps every spike) or 'lttb' (smoother line)
+
+    Returns:
+        (times, values, source) where source is 'raw' or 'level <n>'
+    """
+    if method not in METHODS:
+        raise TelemetryError(f"method must be one of {', '.join(METHODS)}")
+    if not 3 <= points <= TELEMETRY_MAX_POINTS:
+        raise TelemetryError(f'points must be between 3 and {TELEMETRY_MAX_POINTS}')
+    start_ms = channel.start_ms if start_ms is None else start_ms
+    end_ms = channel.end_ms if end_ms is None else end_ms
+    if channel.sample_count == 0 or start_ms > end_ms:
+        return read_range(channel, start_ms, end_ms) + ('raw',)
+
+    samples = range_sample_count(channel, start_ms, end_ms)
+    if samples <= points:
+        return read_range(channel, start_ms, end_ms, max_samples=None) + ('raw',)
+
+    # Buckets needed: one per two points for min/max, several candidates per point for LTTB
+    buckets = points // 2 if method == 'minmax' else points * LTTB_OVERSAMPLING
+    level = _pick_level(channel, samples // buckets)
+    if level is None:
+        times, values = read_range(channel, start_ms, end_ms, max_samples=None)
+        source = 'raw'
+    else:
+        times, values = _read_level(channel, level, start_ms, end_ms)
+        source = f'level {level}'
+    if method == 'minmax':
+        times, values = minmax(times, values, points)
+    else:
+        times, values = lttb(times, values, points)
+    return times, values, source
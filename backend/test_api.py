@@ -1,21 +1,28 @@
 """
 Test script for Racing Car Management API
 """
+import json
+import random
+import subprocess
 import sys
 import os
+import tempfile
 
 # Add backend to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db
-from models import RaceEvent, Session, TireData, EngineData, SetupData
+from app import app, db, init_database as init_app_database
+from excel_import import import_workbook
+from live import broker
+from models import RaceEvent, Session, Lap, SessionLapSummary, TireData, EngineData, SetupData
+from calculations import RacingCalculations
+from formula_engine import FormulaEngine
 from datetime import datetime
 
 def init_database():
     """Initialize database with tables"""
-    with app.app_context():
-        db.create_all()
-        print("✓ Database tables created successfully")
+    init_app_database()
+    print("✓ Database tables created successfully")
 
 def test_create_event():
     """Test creating a race event"""
@@ -97,6 +104,751 @@ def test_api_endpoints():
             sessions = response.json
             print(f"✓ Get sessions endpoint working (found {len(sessions)} sessions)")
 
+def test_lap_stats(session_id):
+    """Test millisecond lap times and the in-database lap statistics"""
+    with app.test_client() as client:
+        for number, lap_time in enumerate(['1:42.345', '1:41.900', '1:43.000', '1:45.500'], start=1):
+            response = client.post(f'/api/sessions/{session_id}/laps', json={
+                'lap_number': number, 'lap_time': lap_time, 'sector1': '25.123'
+            })
+            assert response.status_code == 201
+        assert response.json['lap_time_ms'] == 105500
+        assert response.json['sector1_ms'] == 25123
+        
+        response = client.get(f'/api/sessions/{session_id}/laps/stats?percentiles=50,100')
+        assert response.status_code == 200
+        stats = response.json
+        assert stats['lap_count'] == 4
+        assert stats['best_lap_ms'] == 101900
+        assert stats['average_lap_ms'] == 103186.2
+        assert stats['percentiles_ms'] == {'50': 102345, '100': 105500}
+        
+        parse = RacingCalculations.parse_time
+        assert [parse(text) for text in ('1:42.345', '25.123', '1:02:03.5', ' 59 ')] == [102.345, 25.123, 3723.5, 59]
+        for malformed in ('1:-5', '1e3', '-3.0', '1::5', '1:5.', '+5', 'inf', '1_0:5', '9' * 400):
+            assert parse(malformed) is None, malformed
+        print(f"✓ Lap stats endpoint working (best {stats['best_lap']})")
+
+def test_session_summary(session_id):
+    """Test that lap writes keep the session summary in step with the laps"""
+    def summary():
+        response = client.get(f'/api/sessions/{session_id}/summary')
+        assert response.status_code == 200
+        return response.json
+    
+    with app.test_client() as client:
+        laps = client.get(f'/api/sessions/{session_id}/laps').json
+        best = min(laps, key=lambda lap: lap['lap_time_ms'])
+        assert summary()['best_lap_ms'] == best['lap_time_ms']
+        
+        # Editing and deleting the best lap moves the best to the next one
+        response = client.put(f"/api/laps/{best['id']}", json={'lap_time': '1:50.000', 'fuel_consumed': 3.0})
+        assert response.status_code == 200
+        assert summary()['best_lap_ms'] == 102345
+        response = client.delete(f"/api/laps/{laps[0]['id']}")
+        assert response.status_code == 204
+        
+        result = summary()
+        assert result['lap_count'] == 3
+        assert result['best_lap_ms'] == 103000
+        assert result['best_sectors_ms'][0] == 25123
+        assert result['average_lap_ms'] == round((103000 + 105500 + 110000) / 3, 1)
+        assert result['total_fuel'] == 3.0
+        
+        # Without a stored summary the endpoint computes one and writes nothing
+        with app.app_context():
+            db.session.execute(db.delete(SessionLapSummary).where(SessionLapSummary.session_id == session_id))
+            db.session.commit()
+        computed = summary()
+        assert dict(computed, updated_at=None) == dict(result, updated_at=None)
+        with app.app_context():
+            assert db.session.get(SessionLapSummary, session_id) is None
+        print(f"✓ Session summary endpoint working (best {result['best_lap']}, {result['lap_count']} laps)")
+
+def test_bulk_laps(session_id):
+    """Test bulk lap import from a JSON array and from NDJSON"""
+    with app.test_client() as client:
+        laps = [{'lap_number': 100 + i, 'lap_time': '1:44.000', 'fuel_consumed': 2.5} for i in range(3)]
+        laps.append({'lap_time': '1:44.000'})
+        laps.append({'lap_number': 2 ** 64, 'lap_time': '1:44.000'})
+        response = client.post(f'/api/sessions/{session_id}/laps/bulk', json=laps)
+        assert response.status_code == 201
+        assert response.json['inserted'] == 3
+        assert response.json['errors'] == [{'index': 3, 'error': 'lap_number must be an integer'},
+                                           {'index': 4, 'error': 'lap_number is out of range'}]
+        
+        lines = '{"lap_number": 200, "lap_time": "1:39.000"}\nnot json\n{"lap_number": 201}\n'
+        response = client.post(f'/api/sessions/{session_id}/laps/bulk', data=lines,
+                               content_type='application/x-ndjson')
+        assert response.status_code == 201
+        assert response.json['inserted'] == 2
+        assert response.json['rejected'] == 1
+        
+        summary = client.get(f'/api/sessions/{session_id}/summary').json
+        assert summary['best_lap_ms'] == 99000
+        assert summary['best_lap_number'] == 200
+        print(f"✓ Bulk lap import working ({summary['lap_count']} laps in session)")
+
+def test_pagination(session_id):
+    """Test keyset pagination and field projection of the lap list"""
+    with app.test_client() as client:
+        all_laps = client.get(f'/api/sessions/{session_id}/laps').json
+        
+        pages = []
+        url = f'/api/sessions/{session_id}/laps?limit=3&fields=id,lap_number'
+        while url:
+            response = client.get(url)
+            assert response.status_code == 200
+            pages.append(response.json)
+            cursor = response.headers.get('X-Next-Cursor')
+            url = f'/api/sessions/{session_id}/laps?limit=3&fields=id,lap_number&after={cursor}' if cursor else None
+        
+        assert [lap for page in pages for lap in page] == [
+            {'id': lap['id'], 'lap_number': lap['lap_number']} for lap in all_laps
+        ]
+        assert client.get(f'/api/sessions/{session_id}/laps?fields=nope').status_code == 400
+        assert all_laps[0] == client.get(f"/api/laps/{all_laps[0]['id']}").json
+        
+        result = client.get(f'/api/sessions/{session_id}/laps?shape=columnar&fields=lap_number,lap_time_ms').json
+        assert result['count'] == len(all_laps)
+        assert result['columns']['lap_time_ms'] == [lap['lap_time_ms'] for lap in all_laps]
+        print(f"✓ Lap pagination working ({len(all_laps)} laps in {len(pages)} pages)")
+
+def test_event_full(event_id):
+    """Test that the full event tree loads with a fixed number of queries"""
+    from sqlalchemy import event as sqlalchemy_event
+    
+    statements = []
+    def count(*args):
+        statements.append(args[2])
+    
+    with app.test_client() as client:
+        with app.app_context():
+            engine = db.engine
+        sqlalchemy_event.listen(engine, 'before_cursor_execute', count)
+        try:
+            response = client.get(f'/api/events/{event_id}/full')
+            first = len(statements)
+            client.post(f'/api/events/{event_id}/sessions', json={'session_type': 'FP2'})
+            del statements[:]
+            response = client.get(f'/api/events/{event_id}/full')
+        finally:
+            sqlalchemy_event.remove(engine, 'before_cursor_execute', count)
+        
+        assert response.status_code == 200
+        result = response.json
+        assert len(result['sessions']) == 2
+        assert len(result['sessions'][0]['tire_data']) == 4
+        # One ETag validator query, then one SELECT per relationship level
+        assert len(statements) == first == 8
+        print(f"✓ Full event endpoint working ({len(statements)} queries for {len(result['sessions'])} sessions)")
+
+def test_conditional_requests(session_id):
+    """Test ETag validation and the response cache"""
+    from http_cache import response_cache
+    
+    with app.test_client() as client:
+        url = f'/api/sessions/{session_id}/laps?limit=5'
+        response = client.get(url)
+        etag = response.headers['ETag']
+        assert 'Last-Modified' not in response.headers
+        
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        
+        hits = response_cache.hits
+        response = client.get(url)
+        assert response.status_code == 200 and response_cache.hits == hits + 1
+        
+        # Any lap write changes the validator
+        lap_id = response.json[0]['id']
+        client.put(f'/api/laps/{lap_id}', json={'notes': 'changed'})
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        
+        # Deleting a row leaves the latest updated_at alone but still changes the ETag
+        lap_id = client.post(f'/api/sessions/{session_id}/laps', json={'lap_number': 99}).json['id']
+        etag = client.get(url).headers['ETag']
+        client.delete(f'/api/laps/{lap_id}')
+        response = client.get(url, headers={'If-None-Match': etag,
+                                            'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        assert response.status_code == 200
+        print("✓ Conditional GET working (304 on unchanged laps, new ETag after a write or delete)")
+
+def test_event_export_import(event_id):
+    """Test that a streamed .rcme export imports back as an identical event"""
+    with app.test_client() as client:
+        response = client.post(f'/api/events/{event_id}/export', json={'runPlans': [{'name': 'Plan A'}]})
+        assert response.status_code == 200
+        assert response.headers['Content-Disposition'].endswith('.rcme"')
+        exported = json.loads(response.get_data())
+        assert exported['version'] == '2.0' and exported['runPlans'] == [{'name': 'Plan A'}]
+        
+        response = client.post('/api/events/import?name=Copy', data=response.get_data())
+        assert response.status_code == 201
+        result = response.json
+        assert result['sessions'] == len(exported['sessions']) and result['run_plans'] == 1
+        
+        copy = json.loads(client.get(f"/api/events/{result['event_id']}/export").get_data())
+        assert copy['event']['name'] == 'Copy'
+        ignored = ('id', 'session_id', 'created_at', 'updated_at')
+        laps = lambda document: [[{key: value for key, value in lap.items() if key not in ignored}
+                                  for lap in session['laps']] for session in document['sessions']]
+        assert laps(copy) == laps(exported)
+        
+        # The v3 container carries the same laps
+        response = client.get(f'/api/events/{event_id}/export?version=3')
+        assert response.mimetype == 'application/octet-stream'
+        v3 = response.get_data()
+        response = client.post('/api/events/import', data=v3)
+        assert response.status_code == 201
+        copy = json.loads(client.get(f"/api/events/{response.json['event_id']}/export").get_data())
+        assert laps(copy) == laps(exported)
+        
+        # A broken file leaves nothing behind
+        events = len(client.get('/api/events').json)
+        response = client.post('/api/events/import', data=b'{"event": {"name": "x", "track": "y", '
+                               b'"date_start": "2024-01-01", "date_end": "2024-01-02"}, "sessions": [{')
+        assert response.status_code == 400
+        assert len(client.get('/api/events').json) == events
+        
+        # So does a truncated or corrupted v3 file
+        for broken in [v3[:len(v3) // 2], v3[:len(v3) // 2] + v3[-24:]] + _corrupt_rcme_v3(v3):
+            response = client.post('/api/events/import', data=broken)
+            assert response.status_code == 400, response.get_data()
+            assert len(client.get('/api/events').json) == events
+        print(f"✓ Event export/import round trip working ({result['laps']} laps, v2 and v3)")
+
+def _corrupt_rcme_v3(data):
+    """Copies of a v3 file whose lap columns point at bad or wrongly sized blocks"""
+    import zlib
+    from rcme_v3 import MAGIC, TRAILER
+    end = len(data) - len(MAGIC)
+    offset, length = TRAILER.unpack(data[end - TRAILER.size:end])
+    
+    def rewrite(change):
+        index = json.loads(zlib.decompress(data[offset:offset + length]))
+        columns = next(entry['tables']['laps']['columns'] for entry in index['sessions']
+                       if 'laps' in entry['tables'])
+        change(columns)
+        block = zlib.compress(json.dumps(index).encode())
+        return data[:offset] + block + TRAILER.pack(offset, len(block)) + MAGIC
+    
+    def drop_data(columns):
+        del columns[0]['data']
+    
+    def wrong_dtype(columns):
+        column = next(column for column in columns if column['type'] == 'int')
+        column['dtype'] = '<i8'
+        column['data'] = [offset, length]  # the compressed index, not a multiple of 8 bytes
+    
+    def short_mask(columns):
+        # Half as many values as the mask has rows
+        column = columns[0]
+        column['dtype'] = '<i2' if column['dtype'] == '<i1' else '<i8'
+        column['mask'] = next(other['mask'] for other in columns if 'mask' in other)
+    
+    def unknown_style(columns):
+        column = next(column for column in columns if column['type'] == 'time')
+        column['style'] = 'fortnights'
+    
+    return [rewrite(change) for change in (drop_data, wrong_dtype, short_mask, unknown_style)]
+
+def test_live_updates(session_id):
+    """Test that lap writes are pushed to live subscribers and can be resumed"""
+    with app.test_client() as client:
+        response = client.get(f'/api/sessions/{session_id}/live')
+        assert response.mimetype == 'text/event-stream'
+        stream = iter(response.response)
+        assert next(stream).startswith(b'retry:')
+        
+        client.post(f'/api/sessions/{session_id}/laps', json={'lap_number': 99, 'lap_time': '1:45.000'})
+        lap_id = client.get(f'/api/sessions/{session_id}/laps').json[-1]['id']
+        client.delete(f'/api/laps/{lap_id}')
+        frames = next(stream).decode().split('\n\n')
+        assert 'event: lap.created' in frames[0] and '"lap_number":99' in frames[0]
+        assert 'event: lap.deleted' in frames[1]
+        response.close()
+        
+        # Reconnecting after the first event replays only the second
+        first_id = frames[0].split('\n')[0][len('id: '):]
+        response = client.get(f'/api/sessions/{session_id}/live', headers={'Last-Event-ID': first_id})
+        stream = iter(response.response)
+        replay = next(stream) + next(stream)
+        assert b'lap.deleted' in replay and b'lap.created' not in replay
+        response.close()
+        
+        response = client.get(f'/api/sessions/{session_id}/live', headers={'Last-Event-ID': 'stale-1'})
+        assert b'event: reset' in next(iter(response.response))
+        response.close()
+        
+        # Streams hold a thread each, so past the limit new ones are turned away
+        limit, broker.max_streams = broker.max_streams, 2
+        try:
+            assert broker.streams == 0
+            streams = [client.get(f'/api/sessions/{session_id}/live') for _ in range(2)]
+            response = client.get(f'/api/sessions/{session_id}/live')
+            assert response.status_code == 503 and response.headers['Retry-After']
+            streams.pop().close()
+            assert broker.streams == 1
+            streams.append(client.get(f'/api/sessions/{session_id}/live'))
+            assert streams[-1].status_code == 200
+            for stream in streams:
+                stream.close()
+            assert broker.streams == 0
+        finally:
+            broker.max_streams = limit
+        print("✓ Live lap push working (deltas, resume from Last-Event-ID, stream limit)")
+
+def test_calc_cache(session_id):
+    """Test the calculation cache: LRU bound, counters and invalidation on writes"""
+    from cache import LRUCache
+    lru = LRUCache(maxsize=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+    assert lru.get('b') is None and lru.get('a') == 1 and len(lru) == 2
+    assert lru.stats()['evictions'] == 1
+    
+    with app.test_client() as client:
+        client.delete('/api/calc/cache')
+        params = {'session_id': session_id, 'laps': 30, 'base_lap_time': 100, 'fuel_per_lap': 2.5}
+        client.put(f'/api/sessions/{session_id}', json={'fuel_start': 60.0})
+        first = client.post('/api/calc/race-time', json=params).json
+        assert client.post('/api/calc/race-time', json=params).json == first
+        stats = client.get('/api/calc/cache').json
+        assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 1)
+        
+        # Updating the session drops the cached result
+        client.put(f'/api/sessions/{session_id}', json={'fuel_start': 30.0})
+        second = client.post('/api/calc/race-time', json=params).json
+        assert second != first and second['pit_stops'] > first['pit_stops']
+        stats = client.get('/api/calc/cache').json
+        assert (stats['hits'], stats['misses'], stats['invalidations']) == (1, 2, 1)
+        
+        assert client.post('/api/calc/unknown', json={}).status_code == 404
+        assert client.post('/api/calc/race-time', json={'session_id': 999999}).status_code == 404
+        assert client.post('/api/calc/race-time', json={'laps': 'x'}).status_code == 400
+        client.put(f'/api/sessions/{session_id}', json={'fuel_start': 50.0})
+        print(f"✓ Calculation cache working ({stats['hits']} hit, {stats['misses']} misses, "
+              f"{stats['invalidations']} invalidation)")
+
+def test_calc_cache_other_process(session_id):
+    """Test that cached calculations notice rows changed by another worker process"""
+    with app.test_client() as client:
+        params = {'session_id': session_id, 'lap_time': 100, 'fuel_tank_capacity': 120, 'fuel_per_lap': 2.5}
+        before = client.post('/api/calc/stint-strategy', json=params).json
+        
+        # A raw UPDATE bypasses this process's write listeners, like another worker would
+        with app.app_context(), db.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'UPDATE sessions SET duration = duration * 2, updated_at = ? WHERE id = ?',
+                (datetime.utcnow(), session_id)
+            )
+        after = client.post('/api/calc/stint-strategy', json=params).json
+        assert after['total_laps'] == 2 * before['total_laps']
+        print("✓ Calculation cache follows rows changed by other processes")
+
+def test_telemetry(session_id):
+    """Test chunked telemetry appends and range reads"""
+    import telemetry
+    
+    chunk_size = telemetry.TELEMETRY_CHUNK_SIZE
+    telemetry.TELEMETRY_CHUNK_SIZE = 100
+    try:
+        with app.test_client() as client:
+            url = f'/api/sessions/{session_id}/telemetry'
+            times = list(range(0, 5000, 10))
+            values = [90 + (t % 700) / 100 for t in times]
+            values[123] = None
+            for start in (0, 250):
+                response = client.post(url, json={'channels': [{
+                    'name': 'water_temp', 'unit': 'C', 'sample_rate': 100,
+                    't': times[start:start + 250], 'v': values[start:start + 250]
+                }]})
+                assert response.status_code == 201
+            channel = client.get(url).json[0]
+            assert channel['sample_count'] == 500 and channel['chunk_count'] == 5
+            
+            # Samples must be appended after the last one
+            response = client.post(url, json={'channels': [{'name': 'water_temp', 't': [100], 'v': [1]}]})
+            assert response.status_code == 400
+            # ... and be whole milliseconds
+            for bad in ([5000.5, 5010], [5000, 2 ** 70]):
+                response = client.post(url, json={'channels': [{'name': 'water_temp', 't': bad, 'v': [1, 2]}]})
+                assert response.status_code == 400
+            
+            data = client.get(f'{url}/water_temp?start_ms=1205&end_ms=2500').json
+            expected = [(t, v) for t, v in zip(times, values) if 1205 <= t <= 2500]
+            assert data['t'] == [t for t, _ in expected]
+            assert data['v'][2] is None
+            assert all(a == b or abs(a - b) < 1e-4 for a, b in zip(data['v'], [v for _, v in expected]))
+    finally:
+        telemetry.TELEMETRY_CHUNK_SIZE = chunk_size
+    print(f"✓ Telemetry storage working ({channel['sample_count']} samples in {channel['chunk_count']} chunks)")
+
+def test_telemetry_downsampling(session_id):
+    """Test downsampled telemetry reads before and after the session's pyramids are built"""
+    import telemetry
+    
+    saved = telemetry.PYRAMID_BASE, telemetry.PYRAMID_MIN_BUCKETS
+    telemetry.PYRAMID_BASE, telemetry.PYRAMID_MIN_BUCKETS = 4, 16
+    try:
+        with app.test_client() as client:
+            url = f'/api/sessions/{session_id}/telemetry'
+            times = list(range(0, 20000, 10))
+            values = [80 + (t % 1000) / 100 for t in times]
+            values[777] = 150.0
+            client.post(url, json={'channels': [{'name': 'oil_temp', 't': times, 'v': values}]})
+            
+            before = client.get(f'{url}/oil_temp?points=100').json
+            assert before['source'] == 'raw' and before['count'] <= 100 and max(before['v']) == 150.0
+            
+            response = client.post(f'/api/sessions/{session_id}/close')
+            assert response.status_code == 200 and response.json['levels']['oil_temp'] > 1
+            assert response.json['session']['closed_at'] is not None
+            
+            after = client.get(f'{url}/oil_temp?points=100').json
+            assert after['source'].startswith('level') and after['count'] <= 100
+            assert max(after['v']) == 150.0 and min(after['v']) == 80.0
+            smooth = client.get(f'{url}/oil_temp?points=100&method=lttb').json
+            assert smooth['count'] == 100 and smooth['t'][0] == 0 and smooth['t'][-1] == times[-1]
+            
+            # Closed sessions take no more samples
+            response = client.post(url, json={'channels': [{'name': 'oil_temp', 't': [30000], 'v': [1]}]})
+            assert response.status_code == 400
+    finally:
+        telemetry.PYRAMID_BASE, telemetry.PYRAMID_MIN_BUCKETS = saved
+    print(f"✓ Telemetry downsampling working ({after['count']} points from {after['source']})")
+
+def test_cold_start():
+    """Test that the app imports without numpy and answers /api/health before touching the database"""
+    script = (
+        "import json, sys\n"
+        "from app import app\n"
+        "health = app.test_client().get('/api/health').json\n"
+        "print(json.dumps({'health': health, 'numpy': 'numpy' in sys.modules}))\n"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'cold.db')
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + database)
+        output = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env=env, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        assert result['health']['database'] == 'starting'
+        assert result['health']['startup']['import_ms'] > 0
+        assert not result['numpy']
+        assert not os.path.exists(database)
+    
+    with app.test_client() as client:
+        health = client.get('/api/health').json
+        assert health['database'] == 'ready' and health['startup']['database_ms'] is not None
+    print(f"✓ Cold start defers the database and numpy (import {result['health']['startup']['import_ms']} ms)")
+
+def test_excel_import():
+    """Test importing a race-weekend workbook"""
+    from openpyxl import Workbook
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = 'DatiEvento'
+    sheet['O4'], sheet['D4'], sheet['O5'] = 'Imola Workbook', 'Imola', 'FP1'
+    sheet = workbook.create_sheet('RunPlanFP1')
+    sheet['D5'], sheet['I5'], sheet['H11'] = 80, 2.5, 'Set#2'
+    for name in ('FP1', 'Race1'):
+        sheet = workbook.create_sheet(name)
+        sheet.append(['Lap', None, 'Lap Time', None, 'Sector1', 'Sector2', 'Sector3', 'Sector4'])
+        for lap in range(1, 11):
+            sectors = [25 + lap / 10, 30.5, 20.25, 15.0]
+            sheet.append([lap, None, sum(sectors) / 86400, None] + [s / 86400 for s in sectors])
+        if name == 'Race1':
+            # An in-lap timed to the second sector only
+            sheet.append([11, None, None, None, 27.5 / 86400, 28.4 / 86400])
+        sheet.append([None, None, None])
+    sheet = workbook.create_sheet('Pressioni')
+    sheet['F13'], sheet['G13'], sheet['F16'], sheet['G16'] = 1.35, 1.36, 1.85, 1.86
+    sheet = workbook.create_sheet('Assetto')
+    sheet.append(['asse ant.', 'Workshop', 'Fp1', 'R1'])
+    sheet.append(['camber.[° dec]', None, '-3,5 / -3,4', -3.6])
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'weekend.xlsm')
+        workbook.save(path)
+        with app.app_context():
+            report = import_workbook(path, workers=2)
+            db.session.commit()
+            assert report['sessions'] == 2 and report['laps'] == 21 and report['setups'] == 2
+            fp1 = Session.query.filter_by(event_id=report['event_id'], session_type='FP1').one()
+            assert (fp1.fuel_start, fp1.fuel_per_lap, fp1.tire_set) == (80, 2.5, 'Set#2')
+            lap = Lap.query.filter_by(session_id=fp1.id, lap_number=1).one()
+            assert (lap.lap_time, lap.sector1, lap.sector3) == ('1:30.850', '25.100', '20.250')
+            # Partial sectors are not summed into a (fastest) lap time
+            race = Session.query.filter_by(event_id=report['event_id'], session_type='R1').one()
+            in_lap = Lap.query.filter_by(session_id=race.id, lap_number=11).one()
+            assert (in_lap.lap_time, in_lap.sector2, in_lap.sector3) == (None, '28.400', None)
+            best = db.session.scalar(db.select(db.func.min(Lap.lap_time_ms)).where(Lap.session_id == race.id))
+            assert best == 90850
+            front_left = TireData.query.filter_by(session_id=fp1.id, tire_position='FL').one()
+            assert (front_left.pressure_cold, front_left.pressure_hot) == (1.35, 1.85)
+            setup = SetupData.query.filter_by(session_id=fp1.id).one()
+            assert (setup.camber_front_left, setup.camber_front_right) == (-3.5, -3.4)
+    print(f"✓ Excel workbook import working ({report['laps']} laps, {report['sessions']} sessions)")
+
+def test_stint_strategy_batch():
+    """Test the vectorized stint strategy endpoint against the scalar version"""
+    with app.test_client() as client:
+        response = client.post('/api/calc/stint-strategy/batch', json={
+            'session_duration': [60, 360],
+            'lap_time': [95, 100],
+            'fuel_tank_capacity': 120,
+            'fuel_per_lap': [2.5, 3.0],
+            'grid': True
+        })
+        assert response.status_code == 200
+        result = response.json
+        assert result['count'] == 8
+        
+        columns = result['columns']
+        for i in range(result['count']):
+            expected = RacingCalculations.calculate_stint_strategy(
+                columns['session_duration'][i], columns['lap_time'][i],
+                columns['fuel_tank_capacity'][i], columns['fuel_per_lap'][i]
+            )
+            assert columns['total_laps'][i] == expected['total_laps']
+            assert columns['pit_stops'][i] == expected['pit_stops']
+            assert columns['last_stint_length'][i] == expected['stints'][-1]
+        
+        # Missing body and non-numeric values are client errors
+        assert client.post('/api/calc/stint-strategy/batch').status_code == 400
+        assert client.post('/api/calc/stint-strategy/batch', json=[1, 2]).status_code == 400
+        response = client.post('/api/calc/stint-strategy/batch', json={
+            'session_duration': [{'minutes': 60}], 'lap_time': 95,
+            'fuel_tank_capacity': 120, 'fuel_per_lap': 2.5
+        })
+        assert response.status_code == 400
+        print(f"✓ Stint strategy batch endpoint working ({result['count']} combinations)")
+
+def _race_time_loop(laps, base_lap_time, fuel_per_lap, initial_fuel, fuel_effect=0.035, pit_stop_time=25):
+    """
+    The original lap-by-lap race time loop, kept as the reference
+
+    The fuel left is initial_fuel - n * fuel_per_lap after n laps of a stint
+    rather than a running subtraction, whose rounding used to decide laps
+    that end exactly on the threshold.
+    """
+    total_time = 0
+    stint_lap = 0
+    pit_stops = 0
+    for lap in range(laps):
+        total_time += RacingCalculations.calculate_lap_time_with_fuel(
+            base_lap_time, (initial_fuel - stint_lap * fuel_per_lap) * 0.75, fuel_effect
+        )
+        stint_lap += 1
+        if initial_fuel - stint_lap * fuel_per_lap < 5 and lap < laps - 1:
+            total_time += pit_stop_time
+            stint_lap = 0
+            pit_stops += 1
+    return round(total_time, 2), pit_stops, round(total_time / laps, 2)
+
+def test_race_time_closed_form():
+    """Test that the closed-form race time matches the lap-by-lap loop"""
+    rng = random.Random(2025)
+    races = [
+        (10, 90, 2.5, 27.5),   # would pit after the last lap
+        (10, 90, 2.0, 25.0),   # lands exactly on the 5 L threshold
+        (30, 95, 0.1, 5.3),    # the division lands just short of 3 laps
+        (25, 100, 3.0, 5.0),   # pits after every lap
+        (12, 90, 0.0, 4.0),
+        (12, 90, 0.0, 50.0),
+        (1, 90, 3.0, 2.0),
+    ]
+    for _ in range(2000):
+        races.append((
+            rng.randint(1, 200), rng.uniform(60, 130),
+            rng.choice([rng.uniform(0.5, 5), rng.randint(1, 50) / 10]),
+            rng.choice([rng.uniform(5, 120), rng.randint(50, 1200) / 10])
+        ))
+    
+    batch = RacingCalculations.calculate_race_time_batch(*zip(*races))
+    for i, race in enumerate(races):
+        expected = _race_time_loop(*race)
+        result = RacingCalculations.calculate_race_time(*race)
+        assert (result['total_time_seconds'], result['pit_stops'], result['average_lap_time']) == expected, race
+        assert (batch['total_time_seconds'][i], batch['pit_stops'][i], batch['average_lap_time'][i]) == expected, race
+    
+    # Huge stints on the threshold are settled without replaying them lap by lap
+    for race in [(10 ** 8, 90, 1e-6, 100), (10 ** 9, 90, 2 ** -26, 6)]:
+        result = RacingCalculations.calculate_race_time(*race)
+        assert result['pit_stops'] == RacingCalculations.calculate_race_time_batch(*race)['pit_stops'][0]
+    with app.test_client() as client:
+        response = client.post('/api/calc/race-time', json={'laps': 10 ** 8, 'base_lap_time': 90,
+                                                            'fuel_per_lap': 2.5, 'initial_fuel': 100})
+        assert response.status_code == 400
+    print(f"✓ Closed-form race time matches the lap-by-lap loop ({len(races)} races)")
+
+def test_race_simulation():
+    """Test that a seeded simulation is reproducible whatever the number of workers"""
+    from simulation import simulate_race
+    
+    race = dict(laps=40, base_lap_time=95, fuel_per_lap=3.0, initial_fuel=60, n_races=3000,
+                chunk_size=1000, seed=42)
+    single = simulate_race(**race, workers=1)
+    parallel = simulate_race(**race, workers=2)
+    assert single == parallel
+    assert single['best_pit_lap'] is not None and single['seed'] == 42
+    
+    # Request threads share one pool that is never swapped out under them
+    from concurrent.futures import ThreadPoolExecutor
+    import simulation
+    with ThreadPoolExecutor(max_workers=3) as threads:
+        results = list(threads.map(lambda workers: simulate_race(**race, workers=workers), [2, 3, 4]))
+    assert all(result == single for result in results)
+    pool = simulation._get_executor()
+    simulate_race(**race, workers=8)
+    assert simulation._get_executor() is pool
+    
+    with app.test_client() as client:
+        race = {'laps': 40, 'base_lap_time': 95, 'fuel_per_lap': 3.0, 'initial_fuel': 60, 'n_races': 2000}
+        response = client.post('/api/calc/race-simulation', json=race)
+        assert response.status_code == 200
+        first = response.json
+        # The drawn seed survives a round trip through a JavaScript number
+        assert 0 <= first['seed'] < 2 ** 53
+        again = client.post('/api/calc/race-simulation', json=dict(race, seed=first['seed'])).json
+        assert again == first
+        assert client.post('/api/calc/race-simulation').status_code == 400
+        assert client.post('/api/calc/race-simulation', json={'laps': 40}).status_code == 400
+        # Simulations too large to hold in memory are refused
+        for oversized in [{'n_races': 10 ** 7}, {'laps': 2000, 'fuel_per_lap': 0.05, 'n_races': 10000}]:
+            response = client.post('/api/calc/race-simulation', json=dict(race, **oversized))
+            assert response.status_code == 400
+    print(f"✓ Race simulation reproducible across workers (best pit lap {single['best_pit_lap']})")
+
+def _pit_strategies_brute_force(laps, base_lap_time, fuel_per_lap, fuel_tank_capacity, tire_life_laps,
+                                pit_stop_time, tire_change_time, refuel_rate, fuel_effect,
+                                tire_degradation, wear_rate, minimum_fuel):
+    """Total time of every legal plan, simulated lap by lap"""
+    max_fuel_laps = int((fuel_tank_capacity - minimum_fuel) // fuel_per_lap)
+    max_tire_age = int(tire_life_laps / wear_rate)
+    totals = []
+    
+    def extend(lap, age, total):
+        if lap == laps:
+            totals.append(total)
+            return
+        for n in range(1, min(max_fuel_laps, laps - lap) + 1):
+            for new_tires in ((False, True) if lap else (False,)):
+                start_age = 0 if new_tires else age
+                if start_age + n > max_tire_age:
+                    continue
+                time = 0.0
+                if lap:
+                    time += pit_stop_time + (n * fuel_per_lap / refuel_rate if refuel_rate else 0)
+                    time += tire_change_time if new_tires else 0
+                for j in range(n):
+                    fuel = minimum_fuel + (n - j) * fuel_per_lap
+                    wear = RacingCalculations.calculate_tire_wear(start_age + j, tire_life_laps, wear_rate)
+                    time += RacingCalculations.calculate_lap_time_with_fuel(
+                        base_lap_time, fuel * RacingCalculations.FUEL_DENSITY, fuel_effect
+                    ) + tire_degradation * wear / 100
+                extend(lap + n, start_age + n, total + time)
+    
+    extend(0, 0, 0.0)
+    return sorted(totals)
+
+def test_pit_strategy():
+    """Test the pit strategy optimizer against brute-force enumeration"""
+    from strategy import optimize_pit_strategy
+    rng = random.Random(8)
+    for _ in range(40):
+        race = {
+            'laps': rng.randint(4, 11), 'base_lap_time': rng.uniform(80, 110),
+            'fuel_per_lap': rng.uniform(2, 4), 'fuel_tank_capacity': rng.uniform(12, 20),
+            'tire_life_laps': rng.randint(3, 8), 'pit_stop_time': rng.uniform(15, 30),
+            'tire_change_time': rng.choice([0, rng.uniform(2, 10)]),
+            'refuel_rate': rng.choice([None, rng.uniform(1, 3)]),
+            'fuel_effect': rng.uniform(0.02, 0.2), 'tire_degradation': rng.uniform(0.5, 6),
+            'wear_rate': rng.choice([1.0, 1.5]), 'minimum_fuel': 2
+        }
+        expected = _pit_strategies_brute_force(**race)
+        try:
+            result = optimize_pit_strategy(**race, top_k=4)
+        except ValueError:
+            assert not expected, race
+            continue
+        plans = [result] + result['alternatives']
+        totals = [plan['total_time_seconds'] for plan in plans]
+        assert totals == sorted(totals)
+        assert len(plans) == min(4, len(expected))
+        assert totals == [round(total, 2) for total in expected[:4]], race
+        for plan in plans:
+            assert sum(stint['laps'] for stint in plan['stints']) == race['laps']
+    
+    with app.test_client() as client:
+        race = {'laps': 30, 'base_lap_time': 100, 'fuel_per_lap': 3.0, 'fuel_tank_capacity': 60,
+                'tire_life_laps': 20, 'top_k': 3}
+        response = client.post('/api/calc/pit-strategy', json=race)
+        assert response.status_code == 200
+        result = response.json
+        plans = [result] + result['alternatives']
+        assert len(plans) == 3
+        assert [p['total_time_seconds'] for p in plans] == sorted(p['total_time_seconds'] for p in plans)
+        assert result == json.loads(json.dumps(optimize_pit_strategy(**race)))
+        assert client.post('/api/calc/pit-strategy', json={'laps': 30}).status_code == 400
+        # Searches too costly to run in a request are refused
+        for oversized in [{'laps': 5000}, {'top_k': 100},
+                          {'laps': 900, 'fuel_per_lap': 0.01, 'tire_life_laps': 1000}]:
+            assert client.post('/api/calc/pit-strategy', json=dict(race, **oversized)).status_code == 400
+    print(f"✓ Pit strategy optimizer matches brute force (best {result['total_time_formatted']})")
+
+def test_tire_analysis(session_id):
+    """Test the batch tire analysis endpoint against the scalar optimizer"""
+    with app.test_client() as client:
+        response = client.get(f'/api/tires/analysis?session_ids={session_id}')
+        assert response.status_code == 200
+        result = response.json
+        assert result['count'] == 4
+        
+        expected = RacingCalculations.optimize_tire_pressure(85.0, 88.0, 82.0, 2.3)
+        columns = result['columns']
+        for name, value in expected.items():
+            assert all(column == value for column in columns[name]), name
+        assert client.get('/api/tires/analysis?session_ids=abc').status_code == 400
+        print(f"✓ Tire analysis endpoint working ({result['count']} readings)")
+
+def test_formula_engine():
+    """Test incremental recalculation of the extracted Excel formulas"""
+    engine = FormulaEngine.from_file()
+    total = engine.recalculate()
+    assert total == len(engine.formulas)
+    
+    # RunPlan fuel chain: C13 = B13*$I$9, N13 = D7+C13, N14 = N13+C14, ...
+    engine.set_values({'RunPlanTest1!B13': 3, 'RunPlanTest1!I9': 2.5, 'RunPlanTest1!D7': 100})
+    recomputed = engine.recalculate()
+    assert 0 < recomputed < total
+    assert engine.get_value('RunPlanTest1', 'C13') == 7.5
+    assert engine.get_value('RunPlanTest1', 'N16') == 107.5
+    
+    # INDIRECT sees a target recomputed later in the same pass
+    engine = FormulaEngine()
+    engine.set_formula('S', 'B1', 'C1+1')
+    engine.set_formula('S', 'A1', 'INDIRECT("S!B1")*2')
+    engine.set_value('S', 'C1', 1)
+    assert engine.get_value('S', 'A1') == 4
+    engine.set_value('S', 'C1', 5)
+    assert engine.get_value('S', 'A1') == 12
+    
+    # SUM and COUNT skip text in referenced cells, but not in literal arguments
+    engine.set_values({'S!D1': 'n/a', 'S!D2': 3, 'S!D3': True})
+    for text, expected in [('SUM(D1,D2)', 3), ('COUNT(D1:D3,D1,D2,D3)', 2), ('SUM(D1)', 0)]:
+        engine.set_formula('S', 'E1', text)
+        assert engine.get_value('S', 'E1') == expected, text
+    engine.set_formula('S', 'E1', 'SUM("x")')
+    assert str(engine.get_value('S', 'E1')) == '#VALUE!'
+    print(f"✓ Formula engine working ({total} formulas, {recomputed} recomputed after an input change)")
+
 def run_all_tests():
     """Run all tests"""
     print("\n" + "="*50)
@@ -118,6 +870,30 @@ def run_all_tests():
         
         print("\n5. Testing API endpoints...")
         test_api_endpoints()
+        test_lap_stats(session_id)
+        test_session_summary(session_id)
+        test_bulk_laps(session_id)
+        test_pagination(session_id)
+        test_event_full(event_id)
+        test_conditional_requests(session_id)
+        test_event_export_import(event_id)
+        test_live_updates(session_id)
+        test_calc_cache(session_id)
+        test_calc_cache_other_process(session_id)
+        test_telemetry(session_id)
+        test_telemetry_downsampling(session_id)
+        test_cold_start()
+        test_excel_import()
+        
+        print("\n6. Testing batch calculations...")
+        test_stint_strategy_batch()
+        test_race_time_closed_form()
+        test_race_simulation()
+        test_pit_strategy()
+        test_tire_analysis(session_id)
+        
+        print("\n7. Testing formula engine...")
+        test_formula_engine()
         
         print("\n" + "="*50)
         print("✓ All tests passed successfully!")
@@ -1,11 +1,16 @@
 const { app, BrowserWindow, Menu, shell } = require('electron');
 const path = require('path');
 const { spawn } = require('child_process');
+const http = require('http');
 const isDev = require('electron-is-dev');
 
 let mainWindow;
 let backendProcess;
 
+const BACKEND_HEALTH_URL = 'http://localhost:5000/api/health';
+const BACKEND_POLL_MS = 50;
+const BACKEND_START_TIMEOUT_MS = 30000;
+
 // Auto-start backend server
 function startBackend() {
   const backendPath = path.join(__dirname, '..', '..', 'backend');
@@ -28,6 +33,34 @@ function startBackend() {
   });
 }
 
+// Resolve once the backend answers /api/health (or give up after the timeout)
+function waitForBackend(launchedAt) {
+  return new Promise((resolve) => {
+    const poll = () => {
+      const request = http.get(BACKEND_HEALTH_URL, (response) => {
+        response.resume();
+        if (response.statusCode === 200) {
+          console.log(`Backend healthy ${Date.now() - launchedAt} ms after launch`);
+          resolve(true);
+        } else {
+          retry();
+        }
+      });
+      request.on('error', retry);
+      request.setTimeout(1000, () => request.destroy());
+    };
+    const retry = () => {
+      if (Date.now() - launchedAt > BACKEND_START_TIMEOUT_MS) {
+        console.error('Backend did not become healthy, opening the window anyway');
+        resolve(false);
+      } else {
+        setTimeout(poll, BACKEND_POLL_MS);
+      }
+    };
+    poll();
+  });
+}
+
 // Create main window
 function createWindow() {
   mainWindow = new BrowserWindow({
@@ -175,12 +208,13 @@ function createMenu() {
 // App lifecycle
 app.whenReady().then(() => {
   // Start backend server
+  const launchedAt = Date.now();
   startBackend();
 
-  // Wait a bit for backend to start, then create window
-  setTimeout(() => {
+  // Open the window as soon as the backend answers
+  waitForBackend(launchedAt).then(() => {
     createWindow();
-  }, 2000);
+  });
 
   app.on('activate', () => {
     if (BrowserWindow.getAllWindows().length === 0) {
@@ -1,6 +1,6 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
-import { eventAPI, sessionAPI, lapAPI, archiveAPI } from '../services/api';
+import { eventAPI, sessionAPI, lapAPI, archiveAPI, liveAPI } from '../services/api';
 import {
   calculateBestLapTime,
   calculateLapTimeFromSectors,
@@ -17,6 +17,9 @@ function EventDetail() {
   const [selectedSession, setSelectedSession] = useState(null);
   const [sessionLaps, setSessionLaps] = useState([]);
   const [loading, setLoading] = useState(true);
+  // Laps of each session from the last full event load, used once when the
+  // session is selected (after that the live stream keeps them current)
+  const loadedLaps = useRef({});
   const [showSessionForm, setShowSessionForm] = useState(false);
   const [sessionFormData, setSessionFormData] = useState({
     session_type: 'Test',
@@ -54,14 +57,35 @@ function EventDetail() {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [id]);
 
+  // Apply lap changes pushed by the server to the selected session
+  useEffect(() => {
+    if (!selectedSession) return undefined;
+    const upsertLaps = (laps) => setSessionLaps((current) => {
+      const byId = new Map(current.map((lap) => [lap.id, lap]));
+      laps.forEach((lap) => byId.set(lap.id, lap));
+      return [...byId.values()].sort((a, b) => a.lap_number - b.lap_number || a.id - b.id);
+    });
+    return liveAPI.subscribeSession(selectedSession.id, {
+      'lap.created': (lap) => upsertLaps([lap]),
+      'lap.updated': (lap) => upsertLaps([lap]),
+      'laps.created': (data) => upsertLaps(data.laps),
+      'lap.deleted': (data) => setSessionLaps((current) => current.filter((lap) => lap.id !== data.id)),
+      'laps.reload': () => loadSessionLaps(selectedSession.id),
+      reset: () => loadSessionLaps(selectedSession.id),
+    });
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [selectedSession?.id]);
+
   const loadEventData = async () => {
     try {
-      const [eventResponse, sessionsResponse] = await Promise.all([
-        eventAPI.get(id),
-        eventAPI.getSessions(id),
-      ]);
-      setEvent(eventResponse.data);
-      setSessions(sessionsResponse.data);
+      // The event, its sessions and their laps in one request
+      const { data } = await eventAPI.getFull(id);
+      const { sessions: fullSessions, ...eventData } = data;
+      loadedLaps.current = Object.fromEntries(fullSessions.map((session) => [session.id, session.laps]));
+      setEvent(eventData);
+      setSessions(fullSessions.map(
+        ({ laps, tire_data, engine_data, setup_data, lap_summary, ...session }) => session
+      ));
       setLoading(false);
     } catch (error) {
       console.error('Error loading event data:', error);
@@ -83,7 +107,13 @@ function EventDetail() {
     setSelectedSession(session);
     setShowLapForm(false);
     setEditingLap(null);
-    await loadSessionLaps(session.id);
+    const laps = loadedLaps.current[session.id];
+    if (laps) {
+      delete loadedLaps.current[session.id];
+      setSessionLaps(laps);
+    } else {
+      await loadSessionLaps(session.id);
+    }
   };
 
   const handleSessionSubmit = async (e) => {
@@ -244,17 +274,6 @@ function EventDetail() {
   // Export event with all sessions and laps to file
   const handleExportEvent = async () => {
     try {
-      // Fetch all sessions with their laps
-      const sessionsWithLaps = await Promise.all(
-        sessions.map(async (session) => {
-          const lapsResponse = await sessionAPI.getLaps(session.id);
-          return {
-            ...session,
-            laps: lapsResponse.data
-          };
-        })
-      );
-
       // Get all runplans from localStorage
       const runPlanHistoryData = localStorage.getItem('runPlanSheet_history');
       const runPlans = runPlanHistoryData ? JSON.parse(runPlanHistoryData) : [];
@@ -263,18 +282,11 @@ function EventDetail() {
       const tirePressureData = localStorage.getItem('tirePressureDatabase');
       const tirePressureDatabase = tirePressureData ? JSON.parse(tirePressureData) : [];
 
-      // Create export object with event and all sessions/laps
-      const exportData = {
-        event: event,
-        sessions: sessionsWithLaps,
-        runPlans: runPlans,
-        tirePressureDatabase: tirePressureDatabase,
-        exportDate: new Date().toISOString(),
-        version: '2.0'
-      };
-
-      // Create and download file
-      const blob = new Blob([JSON.stringify(exportData, null, 2)], { type: 'application/json' });
+      // The backend streams the event with all sessions/laps
+      const response = await eventAPI.exportFile(event.id, { runPlans, tirePressureDatabase });
+      const blob = response.data;
+
+      // Download file
       const url = URL.createObjectURL(blob);
       const link = document.createElement('a');
       link.href = url;
@@ -326,55 +338,8 @@ function EventDetail() {
           return;
         }
 
-        // Create new event
-        const newEventData = {
-          name: importData.event.name + ' (Importato)',
-          track: importData.event.track,
-          date_start: importData.event.date_start,
-          date_end: importData.event.date_end,
-          weather: importData.event.weather,
-          notes: importData.event.notes,
-          track_length: importData.event.track_length
-        };
-        
-        const eventResponse = await eventAPI.create(newEventData);
-        const newEventId = eventResponse.data.id;
-
-        // Create sessions and laps
-        for (const session of importData.sessions) {
-          const sessionData = {
-            session_type: session.session_type,
-            session_number: session.session_number,
-            duration: session.duration,
-            fuel_start: session.fuel_start,
-            fuel_per_lap: session.fuel_per_lap,
-            tire_set: session.tire_set,
-            session_status: session.session_status,
-            notes: session.notes
-          };
-
-          const sessionResponse = await eventAPI.createSession(newEventId, sessionData);
-          const newSessionId = sessionResponse.data.id;
-
-          // Create laps for this session
-          if (session.laps && session.laps.length > 0) {
-            for (const lap of session.laps) {
-              const lapData = {
-                lap_number: lap.lap_number,
-                lap_time: lap.lap_time,
-                sector1: lap.sector1,
-                sector2: lap.sector2,
-                sector3: lap.sector3,
-                sector4: lap.sector4,
-                fuel_consumed: lap.fuel_consumed,
-                tire_set: lap.tire_set,
-                lap_status: lap.lap_status,
-                notes: lap.notes
-              };
-              await sessionAPI.createLap(newSessionId, lapData);
-            }
-          }
-        }
+        // Create the event with its sessions and laps in one request
+        await eventAPI.importFile(file, importData.event.name + ' (Importato)');
 
         // Import runplans if present
         if (importData.runPlans && importData.runPlans.length > 0) {
@@ -17,7 +17,14 @@ export const eventAPI = {
   update: (id, data) => apiClient.put(`/events/${id}`, data),
   delete: (id) => apiClient.delete(`/events/${id}`),
   getSessions: (id) => apiClient.get(`/events/${id}/sessions`),
+  // The event with its sessions and their laps, tire, engine and setup data
+  getFull: (id) => apiClient.get(`/events/${id}/full`),
   createSession: (id, data) => apiClient.post(`/events/${id}/sessions`, data),
+  exportFile: (id, data) => apiClient.post(`/events/${id}/export`, data, { responseType: 'blob' }),
+  importFile: (file, name) => apiClient.post('/events/import', file, {
+    params: { name },
+    headers: { 'Content-Type': 'application/json' },
+  }),
 };
 
 // Session API
@@ -25,6 +32,7 @@ export const sessionAPI = {
   get: (id) => apiClient.get(`/sessions/${id}`),
   update: (id, data) => apiClient.put(`/sessions/${id}`, data),
   delete: (id) => apiClient.delete(`/sessions/${id}`),
+  close: (id) => apiClient.post(`/sessions/${id}/close`),
   getTireData: (id) => apiClient.get(`/sessions/${id}/tires`),
   addTireData: (id, data) => apiClient.post(`/sessions/${id}/tires`, data),
   getLaps: (id) => apiClient.get(`/sessions/${id}/laps`),
@@ -38,6 +46,47 @@ export const lapAPI = {
   delete: (id) => apiClient.delete(`/laps/${id}`),
 };
 
+// Telemetry API
+export const telemetryAPI = {
+  getChannels: (sessionId) => apiClient.get(`/sessions/${sessionId}/telemetry`),
+  append: (sessionId, channels) => apiClient.post(`/sessions/${sessionId}/telemetry`, { channels }),
+  // Pass points (e.g. the chart width in pixels) to get a downsampled series
+  getRange: (sessionId, name, startMs, endMs, { points, method } = {}) => apiClient.get(
+    `/sessions/${sessionId}/telemetry/${encodeURIComponent(name)}`,
+    { params: { start_ms: startMs, end_ms: endMs, points, method } }
+  ),
+};
+
+// Live updates (Server-Sent Events); returns a function that unsubscribes
+const LIVE_RETRY_WHEN_FULL_MS = 30000;
+export const liveAPI = {
+  subscribeSession: (sessionId, handlers) => {
+    let source;
+    let retry;
+    const connect = () => {
+      // EventSource reconnects on its own and resumes with Last-Event-ID
+      source = new EventSource(`${API_BASE_URL}/sessions/${sessionId}/live`);
+      Object.entries(handlers).forEach(([type, handler]) => {
+        source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+      });
+      // A full server answers 503, which closes the EventSource for good:
+      // open a new one later and reload, since events may have been missed
+      source.onerror = () => {
+        if (source.readyState !== EventSource.CLOSED) return;
+        retry = setTimeout(() => {
+          connect();
+          if (handlers.reset) handlers.reset({});
+        }, LIVE_RETRY_WHEN_FULL_MS);
+      };
+    };
+    connect();
+    return () => {
+      clearTimeout(retry);
+      source.close();
+    };
+  },
+};
+
 // Archive API
 export const archiveAPI = {
   archiveEvent: (eventId) => apiClient.post('/archive', { event_id: eventId }),
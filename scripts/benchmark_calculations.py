@@ -0,0 +1,231 @@
+"""
+Racing Calculations Benchmarks
+Times every RacingCalculations method, stores the results as JSON and
+flags regressions against a saved baseline
+
+Usage:
+  python scripts/benchmark_calculations.py                      # run and print
+  python scripts/benchmark_calculations.py --save-baseline      # record a baseline
+  python scripts/benchmark_calculations.py --baseline benchmark_baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+from datetime import datetime
+
+import numpy as np
+
+# Add backend to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from calculations import RacingCalculations
+
+DEFAULT_OUTPUT = 'benchmark_results.json'
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+# Number of items per measurement: one call up to large batches
+SCALAR_SIZES = [1, 1000, 10000]
+BATCH_SIZES = [1, 1000, 100000]
+
+# Race lengths in laps: sprint race, 1 hour, 6 hours, 24 hours
+RACE_LAPS = {'sprint': 20, '1h': 40, '6h': 220, '24h': 900}
+
+
+def _random_inputs(size, seed=0):
+    """Deterministic random inputs shared by the scalar and batch cases"""
+    rng = np.random.default_rng(seed)
+    return {
+        'laps': rng.integers(10, 60, size),
+        'lap_time': rng.uniform(85, 110, size),
+        'fuel_per_lap': rng.uniform(2.0, 3.5, size),
+        'fuel': rng.uniform(60, 120, size),
+        'duration': rng.uniform(30, 360, size),
+        'temps': rng.uniform(70, 100, (3, size)),
+        'pressure': rng.uniform(1.8, 2.4, size),
+        'wings': rng.uniform(1, 10, (2, size)),
+        'springs': rng.uniform(60000, 120000, (2, size)),
+    }
+
+
+def _scalar_loop(function, args_list):
+    """Benchmark body calling a scalar method once per set of arguments"""
+    def run():
+        for args in args_list:
+            function(*args)
+    return run
+
+
+def build_cases():
+    """
+    Build every benchmark case
+
+    Returns:
+        Dictionary mapping case name to (method name, items, callable)
+    """
+    cases = {}
+    calc = RacingCalculations
+
+    for size in SCALAR_SIZES:
+        data = _random_inputs(size)
+        laps, lap_time, fuel_per_lap = data['laps'].tolist(), data['lap_time'].tolist(), data['fuel_per_lap'].tolist()
+        fuel, duration, pressure = data['fuel'].tolist(), data['duration'].tolist(), data['pressure'].tolist()
+        inner, middle, outer = data['temps'].tolist()
+        front_wing, rear_wing = data['wings'].tolist()
+        front_spring, rear_spring = data['springs'].tolist()
+
+        scalar_cases = {
+            'calculate_fuel_consumption': (calc.calculate_fuel_consumption, list(zip(laps, fuel_per_lap))),
+            'calculate_fuel_remaining': (calc.calculate_fuel_remaining, list(zip(fuel, fuel_per_lap))),
+            'calculate_stint_strategy': (calc.calculate_stint_strategy,
+                                         [(d, t, 120, f) for d, t, f in zip(duration, lap_time, fuel_per_lap)]),
+            'optimize_tire_pressure': (calc.optimize_tire_pressure, list(zip(inner, middle, outer, pressure))),
+            'calculate_lap_time_with_fuel': (calc.calculate_lap_time_with_fuel, list(zip(lap_time, fuel))),
+            'calculate_tire_wear': (calc.calculate_tire_wear, [(n, 40) for n in laps]),
+            'format_time': (calc.format_time, [(t * 30,) for t in lap_time]),
+            'parse_time': (calc.parse_time, [(calc.format_time(t),) for t in lap_time]),
+            'time_to_ms': (calc.time_to_ms, [(calc.format_time(t),) for t in lap_time]),
+            'calculate_setup_balance': (calc.calculate_setup_balance,
+                                        list(zip(front_wing, rear_wing, front_spring, rear_spring))),
+        }
+        for method, (function, args_list) in scalar_cases.items():
+            cases[f'{method}[n={size}]'] = (method, size, _scalar_loop(function, args_list))
+
+        for label, race_laps in RACE_LAPS.items():
+            args_list = [(race_laps, t, f, fl) for t, f, fl in zip(lap_time, fuel_per_lap, fuel)]
+            cases[f'calculate_race_time[{label},n={size}]'] = (
+                'calculate_race_time', size, _scalar_loop(calc.calculate_race_time, args_list)
+            )
+
+    for size in BATCH_SIZES:
+        data = _random_inputs(size)
+        cases[f'calculate_stint_strategy_batch[n={size}]'] = (
+            'calculate_stint_strategy_batch', size,
+            lambda d=data: calc.calculate_stint_strategy_batch(d['duration'], d['lap_time'], 120, d['fuel_per_lap'])
+        )
+        cases[f'optimize_tire_pressure_batch[n={size}]'] = (
+            'optimize_tire_pressure_batch', size,
+            lambda d=data: calc.optimize_tire_pressure_batch(*d['temps'], d['pressure'])
+        )
+        for label, race_laps in RACE_LAPS.items():
+            cases[f'calculate_race_time_batch[{label},n={size}]'] = (
+                'calculate_race_time_batch', size,
+                lambda d=data, n=race_laps: calc.calculate_race_time_batch(n, d['lap_time'], d['fuel_per_lap'], d['fuel'])
+            )
+
+    return cases
+
+
+def missing_methods(cases):
+    """Public RacingCalculations methods without a benchmark case"""
+    covered = {method for method, _, _ in cases.values()}
+    public = {name for name in dir(RacingCalculations)
+              if not name.startswith('_') and callable(getattr(RacingCalculations, name))}
+    return sorted(public - covered)
+
+
+def run_benchmarks(cases, repeat=5, name_filter=None):
+    """Time every case, keeping the best of several repeats"""
+    results = {}
+    for name, (method, items, function) in cases.items():
+        if name_filter and name_filter not in name:
+            continue
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=repeat, number=number)) / number
+        results[name] = {
+            'method': method,
+            'items': items,
+            'seconds_per_call': best,
+            'microseconds_per_item': best / items * 1e6
+        }
+        print(f"  {name:<50} {best * 1e3:>12.4f} ms {best / items * 1e6:>12.4f} µs/item")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with a baseline
+
+    Returns:
+        (regressions, improvements) as lists of (name, ratio)
+    """
+    regressions, improvements = [], []
+    for name, result in results.items():
+        reference = baseline.get('results', {}).get(name)
+        if not reference:
+            continue
+        ratio = result['seconds_per_call'] / reference['seconds_per_call']
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio))
+        elif ratio < 1 / (1 + threshold):
+            improvements.append((name, ratio))
+    return regressions, improvements
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark RacingCalculations')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='where to write the results JSON')
+    parser.add_argument('--baseline', help='baseline JSON to compare against')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE,
+                        help='also save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative slowdown reported as a regression (default 0.25 = 25%%)')
+    parser.add_argument('--repeat', type=int, default=5, help='repeats per case (best is kept)')
+    parser.add_argument('--filter', help='only run cases whose name contains this text')
+    args = parser.parse_args()
+
+    print("\n" + "="*70)
+    print("RACING CALCULATIONS - BENCHMARKS")
+    print("="*70)
+
+    cases = build_cases()
+    missing = missing_methods(cases)
+    if missing:
+        print(f"\n✗ Methods without a benchmark: {', '.join(missing)}")
+        return 1
+
+    print()
+    results = run_benchmarks(cases, repeat=args.repeat, name_filter=args.filter)
+    report = {
+        'timestamp': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'results': results
+    }
+
+    with open(args.output, 'w') as handle:
+        json.dump(report, handle, indent=2)
+    print(f"\n✓ Results written to {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f"✓ Baseline saved to {args.save_baseline}")
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    regressions, improvements = compare(results, baseline, args.threshold)
+
+    print("\n" + "="*70)
+    print(f"COMPARISON WITH {args.baseline}")
+    print("="*70)
+    for name, ratio in improvements:
+        print(f"  ✓ {name:<50} {1 / ratio:>6.2f}x faster")
+    for name, ratio in regressions:
+        print(f"  ✗ {name:<50} {ratio:>6.2f}x slower")
+    if not regressions:
+        print("\n✓ No regressions")
+        return 0
+    print(f"\n✗ {len(regressions)} regression(s) above {args.threshold:.0%}")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
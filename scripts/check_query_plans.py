@@ -0,0 +1,229 @@
+"""
+Query Plan Check
+Calls every API endpoint against a throwaway SQLite database, runs
+EXPLAIN QUERY PLAN on each statement they issue and fails if any of them
+scans a whole table instead of using an index
+
+Usage:
+  python scripts/check_query_plans.py
+  python scripts/check_query_plans.py --verbose     # print every plan
+"""
+
+import argparse
+import atexit
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+# Use a scratch database before the app is imported
+_db_dir = tempfile.mkdtemp(prefix='query-plans-')
+atexit.register(shutil.rmtree, _db_dir, True)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_db_dir, 'plans.db')
+
+# Add backend to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from sqlalchemy import event
+
+from app import app, db
+from models import EngineData, SetupData
+
+# (endpoint rule, table) pairs where reading the whole table is the point:
+# the unfiltered event list
+ALLOWED_SCANS = {
+    ('/api/events', 'race_events'),
+}
+
+# Statements that never touch user tables
+IGNORED_STATEMENTS = re.compile(r'^\s*(PRAGMA|CREATE|INSERT|COMMIT|ROLLBACK|BEGIN)', re.IGNORECASE)
+
+SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(.*)$')
+
+
+def _requests(ids):
+    """(method, url, json) for every endpoint; url may use {event_id}, {session_id}, {lap_id}"""
+    lap_times = ['1:42.345', '1:41.900', '1:43.000']
+    return [
+        ('GET', '/api/health', None),
+        ('GET', '/api/events', None),
+        ('GET', '/api/events?limit=1', None),
+        ('POST', '/api/events', {'name': 'Plan check 2', 'track': 'Monza',
+                                 'date_start': '2024-05-01T00:00:00', 'date_end': '2024-05-02T00:00:00'}),
+        ('GET', '/api/events/{event_id}', None),
+        ('PUT', '/api/events/{event_id}', {'weather': 'Dry'}),
+        ('GET', '/api/events/{event_id}/full', None),
+        ('GET', '/api/events/{event_id}/export', None),
+        ('GET', '/api/events/{event_id}/export?version=3', None),
+        ('POST', '/api/events/{event_id}/export', {'runPlans': [], 'tirePressureDatabase': []}),
+        ('POST', '/api/events/import', {'event': {'name': 'Plan check 3', 'track': 'Monza',
+                                                  'date_start': '2024-05-01T00:00:00Z',
+                                                  'date_end': '2024-05-02T00:00:00Z'},
+                                        'sessions': [{'session_type': 'FP1', 'laps': [
+                                            {'lap_number': 1, 'lap_time': '1:42.000'}]}],
+                                        'version': '2.0'}),
+        ('GET', '/api/events/{event_id}/sessions', None),
+        ('GET', '/api/events/{event_id}/sessions?limit=1', None),
+        ('POST', '/api/events/{event_id}/sessions', {'session_type': 'FP2'}),
+        ('GET', '/api/sessions/{session_id}', None),
+        ('PUT', '/api/sessions/{session_id}', {'notes': 'checked'}),
+        ('POST', '/api/sessions/{session_id}/laps/bulk',
+         [{'lap_number': n, 'lap_time': lap_times[n % 3], 'tire_set': 'S1'} for n in range(1, 50)]),
+        ('POST', '/api/sessions/{session_id}/laps', {'lap_number': 50, 'lap_time': '1:40.000'}),
+        ('GET', '/api/sessions/{session_id}/laps', None),
+        ('GET', '/api/sessions/{session_id}/laps?limit=10&fields=lap_number,lap_time', None),
+        ('GET', '/api/sessions/{session_id}/laps?limit=10&after={lap_cursor}', None),
+        ('GET', '/api/laps/{lap_id}', None),
+        ('PUT', '/api/laps/{lap_id}', {'lap_time': '1:39.000'}),
+        ('DELETE', '/api/laps/{lap_id}', None),
+        ('GET', '/api/sessions/{session_id}/summary', None),
+        ('GET', '/api/sessions/{session_id}/laps/stats', None),
+        ('GET', '/api/sessions/{session_id}/live', None),
+        ('POST', '/api/sessions/{session_id}/telemetry',
+         {'channels': [{'name': 'oil_temp', 'unit': 'C', 't': list(range(0, 1000, 10)), 'v': [110.5] * 100}]}),
+        ('POST', '/api/sessions/{session_id}/telemetry',
+         {'channels': [{'name': 'oil_temp', 't': list(range(1000, 2000, 10)), 'v': [111.0] * 100}]}),
+        ('GET', '/api/sessions/{session_id}/telemetry', None),
+        ('GET', '/api/sessions/{session_id}/telemetry/oil_temp', None),
+        ('GET', '/api/sessions/{session_id}/telemetry/oil_temp?start_ms=500&end_ms=1500', None),
+        ('GET', '/api/sessions/{session_id}/telemetry/oil_temp?points=10', None),
+        ('POST', '/api/sessions/{session_id}/close', None),
+        ('GET', '/api/sessions/{session_id}/telemetry/oil_temp?points=3&start_ms=500', None),
+        ('GET', '/api/sessions/{session_id}/telemetry/oil_temp?points=10&method=lttb', None),
+        ('GET', '/api/sessions/{session_id}/laps/stats?green_only=true', None),
+        ('POST', '/api/sessions/{session_id}/tires', {'tire_position': 'FL', 'tire_set': 'S1', 'pressure_hot': 2.3,
+                                                      'temp_inner': 85, 'temp_middle': 88, 'temp_outer': 82}),
+        ('GET', '/api/sessions/{session_id}/tires', None),
+        ('GET', '/api/tires/analysis?event_id={event_id}', None),
+        ('GET', '/api/tires/analysis?session_ids={session_id}', None),
+        ('POST', '/api/calc/stint-strategy', {'session_id': '{session_id}', 'session_duration': 60,
+                                              'lap_time': 100, 'fuel_tank_capacity': 120, 'fuel_per_lap': 2.5}),
+        ('GET', '/api/calc/cache', None),
+        ('DELETE', '/api/calc/cache', None),
+        ('POST', '/api/calc/stint-strategy/batch', {'session_duration': [60], 'lap_time': [100],
+                                                    'fuel_tank_capacity': 120, 'fuel_per_lap': [2.5]}),
+        ('POST', '/api/calc/race-simulation', {'laps': 20, 'base_lap_time': 100, 'fuel_per_lap': 2.5,
+                                               'initial_fuel': 60, 'n_races': 100, 'seed': 1,
+                                               'calibration_event_id': '{event_id}'}),
+        ('POST', '/api/archive', {'event_id': '{event_id}'}),
+        ('DELETE', '/api/sessions/{session_id}', None),
+        ('DELETE', '/api/events/{event_id}', None),
+    ]
+
+
+def _fill(value, ids):
+    """Substitute ids into a url or a JSON body"""
+    if isinstance(value, str):
+        filled = value.format(**ids)
+        return int(filled) if value != filled and filled.isdigit() and value.startswith('{') else filled
+    if isinstance(value, list):
+        return [_fill(item, ids) for item in value]
+    if isinstance(value, dict):
+        return {key: _fill(item, ids) for key, item in value.items()}
+    return value
+
+
+def collect_statements(client):
+    """Call every endpoint and return [(rule, statement, parameters)]"""
+    statements = []
+    current = {'rule': None}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and not IGNORED_STATEMENTS.match(statement):
+            statements.append((current['rule'], statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+
+    # Seed an event whose session has engine and setup rows to load
+    response = client.post('/api/events', json={'name': 'Plan check', 'track': 'Monza',
+                                                'date_start': '2024-05-01T00:00:00',
+                                                'date_end': '2024-05-02T00:00:00'})
+    ids = {'event_id': response.json['id']}
+    response = client.post(f"/api/events/{ids['event_id']}/sessions", json={'session_type': 'FP1'})
+    ids['session_id'] = response.json['id']
+    with app.app_context():
+        db.session.add(EngineData(session_id=ids['session_id'], engine_map='1'))
+        db.session.add(SetupData(session_id=ids['session_id'], front_wing=3))
+        db.session.commit()
+    del statements[:]
+
+    covered = set()
+    for method, url, body in _requests(ids):
+        if '{lap_id}' in url and 'lap_id' not in ids:
+            laps = client.get(f"/api/sessions/{ids['session_id']}/laps?limit=10").json
+            ids['lap_id'] = laps[-1]['id']
+        if '{lap_cursor}' in url and 'lap_cursor' not in ids:
+            response = client.get(f"/api/sessions/{ids['session_id']}/laps?limit=10")
+            response.get_data()
+            ids['lap_cursor'] = response.headers['X-Next-Cursor']
+
+        adapter = app.url_map.bind('localhost')
+        current['rule'] = adapter.match(url.split('?')[0].format(**ids), method=method, return_rule=True)[0].rule
+        response = client.open(_fill(url, ids), method=method, json=_fill(body, ids))
+        if response.mimetype == 'text/event-stream':
+            response.close()  # live streams never end
+        else:
+            response.get_data()  # run streamed responses to completion
+        if response.status_code >= 400:
+            raise AssertionError(f'{method} {url} returned {response.status_code}: {response.get_data(as_text=True)}')
+        covered.add((current['rule'], method))
+
+    event.remove(engine, 'before_cursor_execute', record)
+
+    missing = [
+        f'{method} {rule.rule}' for rule in app.url_map.iter_rules() if rule.endpoint != 'static'
+        for method in rule.methods - {'HEAD', 'OPTIONS'} if (rule.rule, method) not in covered
+    ]
+    return statements, missing
+
+
+def full_scans(statements, verbose=False):
+    """EXPLAIN every statement and return [(rule, table, statement)] for full table scans"""
+    problems = []
+    seen = set()
+    with app.app_context(), db.engine.connect() as connection:
+        for rule, statement, parameters in statements:
+            if (rule, statement) in seen:
+                continue
+            seen.add((rule, statement))
+            plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+            if verbose:
+                print(f"\n{rule}\n  {' '.join(statement.split())}")
+                for row in plan:
+                    print(f'    {row[-1]}')
+            for row in plan:
+                match = SCAN.match(row[-1])
+                if match and match.group(1) not in ('CONSTANT',) and (rule, match.group(1)) not in ALLOWED_SCANS:
+                    problems.append((rule, match.group(1), ' '.join(statement.split())))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that API queries use indexes')
+    parser.add_argument('--verbose', action='store_true', help='print every statement and its plan')
+    args = parser.parse_args()
+
+    print("\n" + "="*70)
+    print("QUERY PLAN CHECK")
+    print("="*70)
+
+    with app.test_client() as client:
+        statements, missing = collect_statements(client)
+    problems = full_scans(statements, args.verbose)
+
+    print(f"\n{len(statements)} statements checked")
+    if missing:
+        print(f"\n✗ Endpoints not exercised: {', '.join(sorted(missing))}")
+    for rule, table, statement in problems:
+        print(f"\n✗ Full scan of {table} in {rule}\n    {statement}")
+    if missing or problems:
+        return 1
+    print("✓ Every query uses an index")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+.rcme Converter
+Converts event exports between the v2 JSON format and the v3 binary
+columnar container; the direction follows the input file
+
+Usage:
+  python scripts/convert_rcme.py event.rcme event_v3.rcme       # v2 -> v3
+  python scripts/convert_rcme.py event_v3.rcme event.rcme       # v3 -> v2
+  python scripts/convert_rcme.py event_v3.rcme --session 2      # print one session as JSON
+"""
+
+import argparse
+import json
+import os
+import sys
+
+# Add backend to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from rcme_v3 import MAGIC, RcmeV3Error, RcmeV3Reader, encode, is_v3
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert .rcme files between v2 and v3')
+    parser.add_argument('input', help='.rcme file (v2 or v3)')
+    parser.add_argument('output', nargs='?', help='converted file')
+    parser.add_argument('--session', type=int, help='print one session of a v3 file')
+    args = parser.parse_args()
+
+    with open(args.input, 'rb') as file:
+        v3 = is_v3(file.read(len(MAGIC)))
+
+    try:
+        if args.session is not None:
+            if not v3:
+                parser.error('--session needs a v3 file')
+            with RcmeV3Reader(args.input) as reader:
+                if not 0 <= args.session < len(reader):
+                    parser.error(f'the file has {len(reader)} sessions')
+                print(json.dumps(reader.session(args.session), indent=2, ensure_ascii=False))
+            return 0
+        if not args.output:
+            parser.error('an output file is required')
+
+        if v3:
+            with RcmeV3Reader(args.input) as reader:
+                document = reader.to_v2()
+            with open(args.output, 'w', encoding='utf-8') as file:
+                json.dump(document, file, indent=2, ensure_ascii=False)
+        else:
+            with open(args.input, encoding='utf-8') as file:
+                document = json.load(file)
+            with open(args.output, 'wb') as file:
+                file.write(encode(document))
+    except (RcmeV3Error, ValueError) as e:
+        print(f'✗ {e}')
+        return 1
+
+    size_in, size_out = os.path.getsize(args.input), os.path.getsize(args.output)
+    print(f"✓ {'v3 -> v2' if v3 else 'v2 -> v3'}: {size_in:,} -> {size_out:,} bytes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
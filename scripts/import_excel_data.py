@@ -1,227 +1,125 @@
 """
 Excel Data Import Script
-Import data from the existing Excel file into the web application database
+Import a race-weekend workbook (RunPlan, timing, Pressioni, Tyre Temp
+Optimiser, Assetto and Motore sheets) into the web application database.
+Everything is written in one transaction; see backend/excel_import.py for
+where each value is read from.
+
+Usage:
+  python scripts/import_excel_data.py 03_Race_Imola_25_29_Sett_2025.xlsb.xlsm
+  python scripts/import_excel_data.py weekend.xlsm --name "Imola 2025" --start 2025-09-25 --end 2025-09-29
+  python scripts/import_excel_data.py weekend.xlsm --dry-run      # parse and check, write nothing
+  python scripts/import_excel_data.py --sample                    # demonstration data
+Binary .xlsb workbooks need pyxlsb (pip install pyxlsb).
 """
 
-import sys
+import argparse
 import os
-import pandas as pd
+import sys
+import time
 from datetime import datetime
 
 # Add backend to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
 
-from app import app, db
-from models import RaceEvent, Session, TireData, EngineData, SetupData
-
-EXCEL_FILE = '../03_Race_Imola_25_29_Sett_2025.xlsb.xlsm'
+from excel_import import ExcelImportError, import_workbook
 
-def import_event_data():
-    """Import event data from DatiEvento sheet"""
-    print("Importing event data...")
-    
-    try:
-        # Read the Excel file
-        # Note: .xlsb format may require additional libraries
-        # You may need to convert to .xlsx first or use pyxlsb library
-        
-        # Example structure for manual import:
-        with app.app_context():
-            event = RaceEvent(
-                name="Race Imola 25-29 Sett 2025",
-                track="Autodromo Enzo e Dino Ferrari - Imola",
-                date_start=datetime(2025, 9, 25, 9, 0),
-                date_end=datetime(2025, 9, 29, 18, 0),
-                weather="Variabile",
-                notes="Evento di gara importato da Excel"
-            )
-            db.session.add(event)
-            db.session.commit()
-            print(f"✓ Created event: {event.name} (ID: {event.id})")
-            return event.id
-            
-    except Exception as e:
-        print(f"✗ Error importing event data: {e}")
-        return None
-
-def import_session_data(event_id):
-    """Import session data from RunPlan sheets"""
-    print("Importing session data...")
-    
-    # Define sessions based on Excel sheets
-    sessions_config = [
-        {'type': 'Test', 'number': 1, 'duration': 60},
-        {'type': 'Test', 'number': 2, 'duration': 60},
-        {'type': 'Test', 'number': 3, 'duration': 60},
-        {'type': 'Test', 'number': 4, 'duration': 60},
-        {'type': 'FP1', 'number': 1, 'duration': 45},
-        {'type': 'FP2', 'number': 1, 'duration': 45},
-        {'type': 'FP3', 'number': 1, 'duration': 30},
-        {'type': 'Q', 'number': 1, 'duration': 30},
-        {'type': 'R1', 'number': 1, 'duration': None},  # Race duration depends on laps
-        {'type': 'R2', 'number': 1, 'duration': None},
-    ]
-    
-    try:
-        with app.app_context():
-            session_ids = []
-            for config in sessions_config:
-                session = Session(
-                    event_id=event_id,
-                    session_type=config['type'],
-                    session_number=config['number'],
-                    duration=config['duration'],
-                    fuel_start=50.0,  # Default starting fuel
-                    tire_set="Set#1",
-                    notes=f"Imported from Excel - {config['type']}"
-                )
-                db.session.add(session)
-                db.session.commit()
-                session_ids.append(session.id)
-                print(f"✓ Created session: {session.session_type} #{session.session_number}")
-            
-            return session_ids
-            
-    except Exception as e:
-        print(f"✗ Error importing session data: {e}")
-        return []
-
-def import_tire_data_template(session_id):
-    """Import tire data template (actual data needs to be extracted from Excel)"""
-    print(f"Creating tire data template for session {session_id}...")
-    
-    try:
-        with app.app_context():
-            tire_positions = ['FL', 'FR', 'RL', 'RR']
-            
-            for position in tire_positions:
-                tire = TireData(
-                    session_id=session_id,
-                    tire_position=position,
-                    tire_set="Set#1",
-                    pressure_cold=2.0,
-                    pressure_hot=2.3,
-                    temp_inner=85.0,
-                    temp_middle=88.0,
-                    temp_outer=82.0,
-                    wear_level=0.0
-                )
-                db.session.add(tire)
-            
-            db.session.commit()
-            print(f"✓ Created tire data for session {session_id}")
-            
-    except Exception as e:
-        print(f"✗ Error creating tire data: {e}")
-
-def manual_excel_data_guide():
-    """Print guide for manual data extraction from Excel"""
-    print("\n" + "="*70)
-    print("MANUAL DATA EXTRACTION GUIDE")
-    print("="*70)
-    print("""
-The Excel file uses .xlsb format with macros, which requires manual extraction.
-
-STEPS TO EXTRACT DATA:
-
-1. OPEN EXCEL FILE
-   - Open: 03_Race_Imola_25_29_Sett_2025.xlsb.xlsm
-   - Enable macros if prompted
-
-2. EXPORT DATA TO CSV
-   For each sheet you want to import:
-   
-   a) DatiEvento (Event Data):
-      - Go to DatiEvento sheet
-      - Select relevant cells with event info
-      - Save As → CSV (Comma delimited)
-      - Save as: data/evento.csv
-   
-   b) RunPlan sheets (Session Data):
-      - For each RunPlanTest1, RunPlanFP1, etc.
-      - Export key data (fuel, laps, tire sets)
-      - Save as: data/sessions/[sheet_name].csv
-   
-   c) Pressioni (Tire Pressure):
-      - Export pressure data
-      - Save as: data/tire_pressure.csv
-   
-   d) Tyre Temp Optimiser:
-      - Export temperature readings
-      - Save as: data/tire_temps.csv
-   
-   e) Assetto (Setup):
-      - Export setup parameters
-      - Save as: data/setup.csv
-   
-   f) Motore (Engine):
-      - Export engine parameters
-      - Save as: data/engine.csv
-
-3. CREATE DATA DIRECTORY
-   mkdir -p data/sessions
-
-4. RUN IMPORT SCRIPT
-   python scripts/import_excel_data.py
-
-ALTERNATIVE - USE OPENPYXL:
-   
-   If you save the Excel file as .xlsx (not .xlsb), you can use:
-   - File → Save As → Excel Workbook (.xlsx)
-   - Then this script can read it directly with pandas
-
-FORMULAS:
-   
-   The file 'formule_estratte.txt' contains all 16,552 formulas.
-   These are being implemented in the backend calculations.py module.
-   
-   Example formulas that are now implemented:
-   - Fuel consumption: =B13*$I$9 → calculate_fuel_consumption()
-   - Tire optimization: Complex formulas → optimize_tire_pressure()
-   - Lap time adjustments → calculate_lap_time_with_fuel()
-
-""")
-    print("="*70)
 
 def create_sample_data():
-    """Create sample data for demonstration"""
-    print("\nCreating sample data for demonstration...")
-    
+    """Create a demonstration event with sessions and tire data"""
+    from app import app, db, init_database
+    from models import RaceEvent, Session, TireData
+
+    init_database()
+    with app.app_context():
+        event = RaceEvent(
+            name="Race Imola 25-29 Sett 2025",
+            track="Autodromo Enzo e Dino Ferrari - Imola",
+            date_start=datetime(2025, 9, 25, 9, 0),
+            date_end=datetime(2025, 9, 29, 18, 0),
+            weather="Variabile",
+            notes="Evento di esempio"
+        )
+        db.session.add(event)
+        db.session.flush()
+
+        sessions_config = [('Test', 1, 60), ('Test', 2, 60), ('Test', 3, 60), ('Test', 4, 60),
+                           ('FP1', 1, 45), ('FP2', 1, 45), ('FP3', 1, 30), ('Q', 1, 30),
+                           ('R1', 1, None), ('R2', 1, None)]
+        sessions = [Session(event_id=event.id, session_type=session_type, session_number=number,
+                            duration=duration, fuel_start=50.0, tire_set="Set#1")
+                    for session_type, number, duration in sessions_config]
+        db.session.add_all(sessions)
+        db.session.flush()
+
+        for position in ('FL', 'FR', 'RL', 'RR'):
+            db.session.add(TireData(session_id=sessions[0].id, tire_position=position, tire_set="Set#1",
+                                    pressure_cold=2.0, pressure_hot=2.3, temp_inner=85.0,
+                                    temp_middle=88.0, temp_outer=82.0, wear_level=0.0))
+        db.session.commit()
+        print(f"✓ Created event: {event.name} (ID: {event.id}) with {len(sessions)} sessions")
+
+
+def _date(value):
     try:
-        # Create event
-        event_id = import_event_data()
-        
-        if event_id:
-            # Create sessions
-            session_ids = import_session_data(event_id)
-            
-            # Create tire data for first session
-            if session_ids:
-                import_tire_data_template(session_ids[0])
-        
-        print("\n✓ Sample data created successfully!")
-        print("\nYou can now start the application:")
-        print("  Backend:  python backend/app.py")
-        print("  Frontend: cd frontend && npm start")
-        
-    except Exception as e:
-        print(f"\n✗ Error creating sample data: {e}")
-        import traceback
-        traceback.print_exc()
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not a YYYY-MM-DD date')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a race-weekend Excel workbook')
+    parser.add_argument('workbook', nargs='?', help='.xlsm/.xlsx (or .xlsb with pyxlsb) workbook')
+    parser.add_argument('--name', help='event name (default: DatiEvento!O4)')
+    parser.add_argument('--start', type=_date, help='first day of the event, YYYY-MM-DD')
+    parser.add_argument('--end', type=_date, help='last day of the event, YYYY-MM-DD')
+    parser.add_argument('--workers', type=int, help='worker processes parsing sheets (default: CPU count)')
+    parser.add_argument('--dry-run', action='store_true', help='parse and insert, then roll back')
+    parser.add_argument('--sample', action='store_true', help='create demonstration data instead')
+    args = parser.parse_args()
 
-if __name__ == '__main__':
     print("\n" + "="*70)
     print("RACING CAR MANAGER - DATA IMPORT UTILITY")
     print("="*70)
-    
-    # Show manual guide
-    manual_excel_data_guide()
-    
-    # Ask if user wants to create sample data
-    response = input("\nCreate sample data for demonstration? (y/n): ")
-    
-    if response.lower() == 'y':
+
+    if args.sample:
         create_sample_data()
-    else:
-        print("\nTo import real data, follow the manual extraction guide above.")
-        print("After extracting to CSV, modify this script to read your CSV files.")
+        return 0
+    if not args.workbook:
+        parser.error('give a workbook to import, or --sample')
+
+    from app import app, db, init_database
+
+    init_database()
+    began = time.perf_counter()
+    with app.app_context():
+        try:
+            report = import_workbook(args.workbook, name=args.name, date_start=args.start,
+                                     date_end=args.end, workers=args.workers)
+        except ExcelImportError as e:
+            db.session.rollback()
+            print(f"\n✗ {e}")
+            return 1
+        except Exception:
+            db.session.rollback()
+            raise
+        if args.dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+
+    elapsed = time.perf_counter() - began
+    print(f"\n{'Checked' if args.dry_run else '✓ Imported'} {args.workbook} in {elapsed:.1f} s"
+          f"{' (dry run, nothing written)' if args.dry_run else ''}")
+    if not args.dry_run:
+        print(f"  event ID:    {report['event_id']}")
+    print(f"  sessions:    {report['sessions']}")
+    print(f"  laps:        {report['laps']}")
+    print(f"  tire data:   {report['tire_data']}")
+    print(f"  setups:      {report['setups']}")
+    print(f"  engine data: {report['engine_data']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
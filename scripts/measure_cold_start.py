@@ -0,0 +1,122 @@
+"""
+Cold Start Check
+Starts the backend the way the desktop app does (python app.py in backend/)
+against a fresh SQLite database and measures how long it takes until
+/api/health answers and until the first request that needs the database
+succeeds. Fails when the median time to a healthy backend is over budget.
+
+Usage:
+  python scripts/measure_cold_start.py
+  python scripts/measure_cold_start.py --runs 5 --budget 2.5
+Environment:
+  COLD_START_BUDGET_S   default budget in seconds (3.0)
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+DEFAULT_BUDGET_S = float(os.environ.get('COLD_START_BUDGET_S', 3.0))
+# Give up on a backend that never answers
+START_TIMEOUT_S = 30
+POLL_INTERVAL_S = 0.01
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get(url):
+    """Status code and JSON body, or None while nothing is listening"""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, json.loads(response.read())
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return None
+
+
+def _wait_for(url, process, began):
+    """Seconds from launch until url returns 200"""
+    while time.perf_counter() - began < START_TIMEOUT_S:
+        if process.poll() is not None:
+            raise RuntimeError(f'backend exited with code {process.returncode}')
+        result = _get(url)
+        if result is not None and result[0] == 200:
+            return time.perf_counter() - began, result[1]
+        time.sleep(POLL_INTERVAL_S)
+    raise RuntimeError(f'{url} did not answer within {START_TIMEOUT_S} s')
+
+
+def measure_once(database_dir):
+    """
+    Launch the backend once on a fresh database
+
+    Returns:
+        (seconds to /api/health, seconds to the first database request, startup report)
+    """
+    port = _free_port()
+    env = dict(os.environ, HOST='127.0.0.1', PORT=str(port), DEBUG='0',
+               DATABASE_URL='sqlite:///' + os.path.join(database_dir, f'cold-{port}.db'))
+    base = f'http://127.0.0.1:{port}/api'
+    began = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        healthy, _ = _wait_for(base + '/health', process, began)
+        first_query, _ = _wait_for(base + '/events', process, began)
+        _, health = _get(base + '/health')
+        return healthy, first_query, health['startup']
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure backend launch to first healthy response')
+    parser.add_argument('--runs', type=int, default=3, help='launches to measure (default 3)')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_S,
+                        help=f'seconds allowed until /api/health answers (default {DEFAULT_BUDGET_S})')
+    args = parser.parse_args()
+
+    print("\n" + "="*70)
+    print("COLD START CHECK")
+    print("="*70)
+
+    database_dir = tempfile.mkdtemp(prefix='cold-start-')
+    try:
+        runs = []
+        for run in range(1, args.runs + 1):
+            healthy, first_query, startup = measure_once(database_dir)
+            runs.append(healthy)
+            print(f"\nRun {run}: /api/health after {healthy * 1000:.0f} ms, "
+                  f"first database request after {first_query * 1000:.0f} ms")
+            print(f"  imports {startup['import_ms']:.0f} ms, database setup {startup['database_ms']:.0f} ms")
+    except RuntimeError as e:
+        print(f"\n✗ {e}")
+        return 1
+    finally:
+        shutil.rmtree(database_dir, True)
+
+    median = statistics.median(runs)
+    if median > args.budget:
+        print(f"\n✗ Median cold start {median:.2f} s is over the {args.budget:.2f} s budget")
+        return 1
+    print(f"\n✓ Median cold start {median:.2f} s (budget {args.budget:.2f} s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -51,8 +51,13 @@ echo "Starting Backend Server..."
 echo "Backend will run on http://localhost:5000"
 echo ""
 
-# Start backend in background
-python app.py &
+# Start backend in background: gunicorn workers when available
+# (see backend/gunicorn.conf.py), the development server otherwise
+if command -v gunicorn &> /dev/null; then
+    gunicorn -c gunicorn.conf.py wsgi:app &
+else
+    python app.py &
+fi
 BACKEND_PID=$!
 echo "Backend PID: $BACKEND_PID"
 